@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark of parse_date_exif.
+
+Compares the original implementation (kept below as reference_parse_date_exif) against the current one, both
+with a cold cache and with the cache warm, over date strings shaped like the time tags ExifTool reports for a
+burst of photos.  Also checks that both return the same result for every string.
+
+    python benchmarks/bench_parse_date.py [--files N] [--repeat R]
+"""
+
+from __future__ import annotations
+
+import argparse
+import random
+import re
+import sys
+import timeit
+from datetime import datetime, timedelta
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from src.sortphotos import _parse_date_string, parse_date_exif  # noqa: E402
+
+
+def reference_parse_date_exif(date_string: str) -> datetime | None:
+    """parse_date_exif as it was before it was precompiled and cached"""
+    elements = str(date_string).strip().split()
+    if len(elements) < 1:
+        return None
+    date_entries = elements[0].split(':')
+    if len(date_entries) == 3 and date_entries[0] > '0000' and '.' not in ''.join(date_entries):
+        year = int(date_entries[0])
+        month = int(date_entries[1])
+        day = int(date_entries[2])
+    else:
+        return None
+    time_zone_adjust = False
+    hour = 12
+    minute = 0
+    second = 0
+    if len(elements) > 1:
+        time_entries = re.split(r'(\+|-|Z)', elements[1])
+        time = time_entries[0].split(':')
+        if len(time) == 3:
+            hour = int(time[0])
+            minute = int(time[1])
+            second = int(time[2].split('.')[0])
+        elif len(time) == 2:
+            hour = int(time[0])
+            minute = int(time[1])
+        if len(time_entries) > 2:
+            time_zone = time_entries[2].split(':')
+            if len(time_zone) == 2:
+                time_zone_hour = int(time_zone[0])
+                time_zone_min = int(time_zone[1])
+                if time_entries[1] == '+':
+                    time_zone_hour *= -1
+                dateadd = timedelta(hours=time_zone_hour, minutes=time_zone_min)
+                time_zone_adjust = True
+    try:
+        date = datetime(year, month, day, hour, minute, second)
+    except ValueError:
+        return None
+    try:
+        date.strftime('%Y/%m-%b')
+    except ValueError:
+        return None
+    if time_zone_adjust:
+        date += dateadd
+    return date
+
+
+def corpus(num_files: int, seed: int = 0) -> list[str]:
+    """the time tag values of num_files photos taken in bursts of a few per second"""
+    rng = random.Random(seed)
+    start = datetime(2023, 6, 15, 9, 0, 0)
+    values = []
+    for i in range(num_files):
+        taken = start + timedelta(seconds=i // 4)
+        stamp = taken.strftime('%Y:%m:%d %H:%M:%S')
+        modified = (taken + timedelta(days=rng.randint(0, 30))).strftime('%Y:%m:%d %H:%M:%S')
+        values += [
+            stamp,                                          # EXIF:DateTimeOriginal
+            stamp,                                          # EXIF:CreateDate
+            modified,                                       # EXIF:ModifyDate
+            f'{stamp}.{rng.randint(0, 99):02d}',            # Composite:SubSecDateTimeOriginal
+            f'{stamp}+02:00',                               # XMP:DateCreated
+            f'{modified}-04:00',                            # File:FileModifyDate
+            '0000:00:00 00:00:00',                          # unset tags
+        ]
+    return values
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--files', type=int, default=10000, help='number of photos in the corpus (default: 10000)')
+    parser.add_argument('--repeat', type=int, default=5, help='timing repetitions, the best is reported (default: 5)')
+    args = parser.parse_args()
+
+    values = corpus(args.files)
+    mismatches = [v for v in values if reference_parse_date_exif(v) != parse_date_exif(v)]
+    if mismatches:
+        sys.exit(f'parse_date_exif differs from the reference for {len(mismatches)} values, e.g. {mismatches[0]!r}')
+
+    def reference() -> None:
+        for v in values:
+            reference_parse_date_exif(v)
+
+    def cold() -> None:
+        _parse_date_string.cache_clear()
+        for v in values:
+            parse_date_exif(v)
+
+    def warm() -> None:
+        for v in values:
+            parse_date_exif(v)
+
+    print(f'{len(values)} date strings ({len(set(values))} distinct) from {args.files} photos')
+    baseline = None
+    for name, run in (('reference', reference), ('cold cache', cold), ('warm cache', warm)):
+        best = min(timeit.repeat(run, number=1, repeat=args.repeat))
+        baseline = baseline or best
+        print(f'{name:>12}: {best * 1e3:8.1f} ms  {best / len(values) * 1e9:7.0f} ns/string  {baseline / best:5.1f}x')
+
+
+if __name__ == '__main__':
+    main()
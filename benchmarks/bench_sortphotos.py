@@ -0,0 +1,291 @@
+#!/usr/bin/env python3
+"""
+Benchmark suite for sortphotos.
+
+Generates a synthetic camera-style source tree (or reuses one from an earlier run), then times each phase of a
+run on its own with a stub ExifTool (fake_exiftool.pl) that answers with tags stored in the files themselves:
+
+    scan              walking the source tree
+    exiftool_execute  ExifTool.execute over every file (one -@ argument file, as without streaming)
+    exiftool_stream   ExifTool.iter_metadata over every file in batches, as when streaming
+    oldest_timestamp  choosing each file's date from its tags
+    plan              destination and collision planning (sortPhotos in test mode, metadata already extracted)
+    transfer          _transfer_file for every planned copy
+    end_to_end        a complete sortPhotos copy run
+    memory_batch      peak Python memory of a test-mode run reading all metadata at once (as without streaming)
+    memory_stream     the same, streaming
+
+Results are written as JSON so runs of different versions can be compared:
+
+    python benchmarks/bench_sortphotos.py --files 100000 --output new.json --compare old.json
+"""
+
+from __future__ import annotations
+
+import argparse
+import contextlib
+import functools
+import json
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections.abc import Callable, Iterator
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Any
+from unittest.mock import patch
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import src.sortphotos as sortphotos  # noqa: E402
+from src.sortphotos import (  # noqa: E402
+    ExifTool,
+    TagPolicy,
+    _argument_file,
+    _parse_date_string,
+    _scan_source_files,
+    sortPhotos,
+)
+
+fake_exiftool = str(Path(__file__).resolve().parent / 'fake_exiftool.pl')
+
+# tags every synthetic file carries besides its capture dates, padded up to --tags with maker note dates
+_EXTRA_TAGS = ('File:FileModifyDate', 'File:FileAccessDate', 'File:FileInodeChangeDate',
+               'ICC_Profile:ProfileDateTime', 'XMP:MetadataDate', 'EXIF:ModifyDate')
+
+
+def generate_corpus(
+    root: Path,
+    num_files: int,
+    file_size: int = 4096,
+    tags: int = 12,
+    duplicates: float = 0.02,
+    seed: int = 0,
+) -> None:
+    """
+    write num_files files laid out like camera imports: folders of 1000 IMG_nnnn.JPG files whose numbering
+    restarts in every folder, so names collide across folders taken on the same day.  The first line of each
+    file holds its tags for fake_exiftool.pl, the rest pads it to file_size.  A fraction are exact duplicates.
+    """
+    rng = random.Random(seed)
+    taken = datetime(2018, 1, 1, 8, 0, 0)
+    previous: list[bytes] = []
+    for i in range(num_files):
+        folder = root / 'DCIM' / f'{100 + i // 1000:03d}CANON'
+        if i % 1000 == 0:
+            folder.mkdir(parents=True, exist_ok=True)
+        path = folder / f'IMG_{i % 1000:04d}.JPG'
+
+        if previous and rng.random() < duplicates:
+            path.write_bytes(rng.choice(previous))
+            continue
+
+        taken += timedelta(seconds=rng.choice((1, 1, 2, 30, 600, 3600, 86400)))
+        stamp = taken.strftime('%Y:%m:%d %H:%M:%S')
+        modified = (taken + timedelta(days=rng.randint(0, 400))).strftime('%Y:%m:%d %H:%M:%S')
+        values = {
+            'EXIF:DateTimeOriginal': stamp,
+            'EXIF:CreateDate': stamp,
+            'Composite:SubSecDateTimeOriginal': f'{stamp}.{rng.randint(0, 99):02d}',
+        }
+        for tag in _EXTRA_TAGS:
+            values[tag] = f'{modified}+00:00' if tag.startswith('File:') else modified
+        for n in range(tags - len(values)):
+            values[f'MakerNotes:Date{n}'] = modified
+        line = ', '.join(f'"{tag}": "{value}"' for tag, value in values.items()).encode()
+        data = line + b'\n' + i.to_bytes(8, 'little') * max(0, (file_size - len(line) - 1) // 8)
+        path.write_bytes(data)
+        if len(previous) < 1000:
+            previous.append(data)
+
+
+def _corpus(workdir: Path, args: argparse.Namespace) -> Path:
+    """the source tree for args, generated unless an identical one is already in workdir"""
+    params = {'files': args.files, 'file_size': args.file_size, 'tags': args.tags, 'duplicates': args.duplicates,
+              'seed': args.seed}
+    src_dir = workdir / 'source'
+    manifest = workdir / 'corpus.json'
+    if manifest.exists() and json.loads(manifest.read_text()) == params:
+        print(f'Reusing corpus in {src_dir}')
+        return src_dir
+    shutil.rmtree(src_dir, ignore_errors=True)
+    print(f'Generating {args.files} files in {src_dir}...')
+    generate_corpus(src_dir, args.files, args.file_size, args.tags, args.duplicates, args.seed)
+    manifest.write_text(json.dumps(params))
+    return src_dir
+
+
+@contextlib.contextmanager
+def _timed(results: dict[str, dict[str, Any]], name: str, files: int) -> Iterator[dict[str, Any]]:
+    """time the block (wall and CPU of this process) into results[name]"""
+    entry: dict[str, Any] = {'files': files}
+    wall, cpu = time.perf_counter(), time.process_time()
+    yield entry
+    entry['seconds'] = entry.get('seconds', time.perf_counter() - wall)
+    entry['cpu_seconds'] = time.process_time() - cpu
+    entry['files_per_sec'] = entry['files'] / entry['seconds'] if entry['seconds'] else None
+    results[name] = entry
+    memory = f'  {entry["peak_mb_per_million_files"]:9.0f} MB peak per million files' if 'peak_bytes' in entry else ''
+    print(f'{name:>17}: {entry["seconds"]:9.3f} s  {entry["files_per_sec"] or 0:12.0f} files/s{memory}')
+
+
+def _peak_memory(results: dict[str, dict[str, Any]], name: str, files: int, fn: Callable[[], Any]) -> None:
+    """run fn as phase name, recording the peak memory allocated by Python while it runs (ExifTool not included)"""
+    with _timed(results, name, files) as entry:
+        tracemalloc.start()
+        try:
+            fn()
+        finally:
+            entry['peak_bytes'] = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        entry['peak_mb_per_million_files'] = entry['peak_bytes'] / max(files, 1) * 1e6 / 2**20
+
+
+def run(args: argparse.Namespace, workdir: Path) -> dict[str, Any]:
+    src_dir = _corpus(workdir, args)
+    files = list(_scan_source_files(str(src_dir), recursive=True))
+    policy = TagPolicy(['File'], [])
+    exif_args = ['-j', '-a', '-G', '-time:all']
+    results: dict[str, dict[str, Any]] = {}
+
+    with _timed(results, 'scan', len(files)):
+        list(_scan_source_files(str(src_dir), recursive=True))
+
+    with ExifTool(fake_exiftool) as e:
+        with _timed(results, 'exiftool_execute', len(files)), _argument_file(files) as target:
+            e.execute(*exif_args, '-@', target)
+        with _timed(results, 'exiftool_stream', len(files)):
+            records = list(e.iter_metadata(files, *exif_args, batch_size=args.batch_size))
+
+    _parse_date_string.cache_clear()
+    with _timed(results, 'oldest_timestamp', len(records)):
+        timestamps = [policy.oldest_timestamp(data) for data in records]
+
+    def sort(dest_dir: Path, **options: Any) -> dict[str, int]:
+        # metadata extraction is replaced by the timestamps found above, so only planning (and transfers) run
+        with patch.object(sortphotos, '_extract_timestamps', lambda *a, **k: iter(timestamps)):
+            return sortPhotos(str(src_dir), str(dest_dir), '%Y/%m-%b', None, recursive=True, copy_files=True,
+                              batch_size=args.batch_size, **options)
+
+    with _timed(results, 'plan', len(timestamps)):
+        sort(workdir / 'plan', test=True)
+
+    # _transfer_file is timed on its own, leaving out the planning around it
+    durations: list[float] = []
+    transfer_file = sortphotos._transfer_file
+
+    def timed_transfer(*a: Any) -> tuple[str, str, str | None, str | None]:
+        start = time.perf_counter()
+        result = transfer_file(*a)
+        durations.append(time.perf_counter() - start)
+        return result
+
+    dest_dir = workdir / 'transfer'
+    shutil.rmtree(dest_dir, ignore_errors=True)
+    with patch.object(sortphotos, '_transfer_file', timed_transfer):
+        with _timed(results, 'transfer', len(timestamps)) as entry:
+            stats = sort(dest_dir)
+            entry['seconds'] = sum(durations)
+            entry['files'] = len(durations)
+            entry['bytes'] = sum(p.stat().st_size for p in dest_dir.rglob('*') if p.is_file())
+            entry['methods'] = {k[len('transfer_'):]: v for k, v in stats.items() if k.startswith('transfer_')}
+
+    dest_dir = workdir / 'end_to_end'
+    shutil.rmtree(dest_dir, ignore_errors=True)
+    with ExifTool(fake_exiftool) as e, _timed(results, 'end_to_end', len(files)):
+        sortPhotos(str(src_dir), str(dest_dir), '%Y/%m-%b', None, recursive=True, copy_files=True,
+                   batch_size=args.batch_size, exiftool=e)
+
+    # timed as well, but slowed down by tracemalloc
+    with patch.object(sortphotos, 'ExifTool', functools.partial(ExifTool, fake_exiftool)):
+        _peak_memory(results, 'memory_batch', len(files), lambda: sortPhotos(
+            str(src_dir), str(workdir / 'memory'), '%Y/%m-%b', None, recursive=True, test=True))
+    with ExifTool(fake_exiftool) as e:
+        _peak_memory(results, 'memory_stream', len(files), lambda: sortPhotos(
+            str(src_dir), str(workdir / 'memory'), '%Y/%m-%b', None, recursive=True, test=True,
+            batch_size=args.batch_size, exiftool=e))
+
+    return {
+        'version': _version(),
+        'date': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'corpus': {'files': len(files), 'file_size': args.file_size, 'tags': args.tags,
+                   'duplicates': args.duplicates, 'seed': args.seed},
+        'phases': results,
+    }
+
+
+def _version() -> str:
+    try:
+        return subprocess.run(['git', 'describe', '--always', '--dirty'], capture_output=True, text=True,
+                              cwd=Path(__file__).resolve().parent, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def compare(result: dict[str, Any], baseline: dict[str, Any], threshold: float) -> list[str]:
+    """print each phase against baseline, returning the phases that got slower by more than threshold"""
+    print(f'\nCompared with {baseline.get("version", "?")} ({baseline.get("date", "?")}):')
+    regressions = []
+    for name, entry in result['phases'].items():
+        old = baseline.get('phases', {}).get(name)
+        if not old or not old.get('seconds') or not entry['seconds']:
+            continue
+        ratio = entry['seconds'] / old['seconds']
+        flag = ''
+        if ratio > threshold:
+            regressions.append(name)
+            flag = '  REGRESSION'
+        print(f'{name:>17}: {old["seconds"]:9.3f} s -> {entry["seconds"]:9.3f} s  ({ratio:5.2f}x time){flag}')
+        if old.get('peak_bytes') and 'peak_bytes' in entry:
+            ratio = entry['peak_bytes'] / old['peak_bytes']
+            flag = ''
+            if ratio > threshold:
+                regressions.append(f'{name} memory')
+                flag = '  REGRESSION'
+            print(f'{"":>17}  {old["peak_mb_per_million_files"]:9.0f} MB -> '
+                  f'{entry["peak_mb_per_million_files"]:9.0f} MB per million files  ({ratio:5.2f}x memory){flag}')
+    return regressions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--files', type=int, default=10000, help='number of files in the corpus (default: 10000)')
+    parser.add_argument('--file-size', type=int, default=4096, help='bytes per file (default: 4096)')
+    parser.add_argument('--tags', type=int, default=12, help='time tags per file (default: 12)')
+    parser.add_argument('--duplicates', type=float, default=0.02, help='fraction of duplicate files (default: 0.02)')
+    parser.add_argument('--seed', type=int, default=0, help='random seed for the corpus')
+    parser.add_argument('--batch-size', type=int, default=sortphotos.default_batch_size,
+                        help='ExifTool batch size when streaming')
+    parser.add_argument('--workdir', type=Path, default=None,
+                        help='directory for the corpus and outputs, kept between runs so the corpus is reused '
+                             '(default: a temporary directory)')
+    parser.add_argument('--output', type=Path, default=None, help='write the results to this JSON file')
+    parser.add_argument('--compare', type=Path, default=None, help='JSON results of an earlier run to compare with')
+    parser.add_argument('--threshold', type=float, default=1.2,
+                        help='with --compare, exit with status 1 if a phase takes more than this many times as '
+                             'long, or uses more than this many times as much memory (default: 1.2)')
+    args = parser.parse_args()
+
+    with contextlib.ExitStack() as stack:
+        workdir = args.workdir
+        if workdir is None:
+            workdir = Path(stack.enter_context(tempfile.TemporaryDirectory(prefix='sortphotos-bench-')))
+        workdir.mkdir(parents=True, exist_ok=True)
+        result = run(args, workdir)
+
+    if args.output is not None:
+        args.output.write_text(json.dumps(result, indent=2) + '\n')
+    if args.compare is not None:
+        if compare(result, json.loads(args.compare.read_text()), args.threshold):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
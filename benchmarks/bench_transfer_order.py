@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+"""
+Benchmark of --transfer-order for serial copies.
+
+Writes a camera-style tree whose files were created in a scrambled order, so that directory order (which is
+roughly the order ExifTool reports files in) jumps around the disk, as it does on a card or an old archive
+that has been written to over time.  Then copies the tree with sortPhotos once per transfer order, evicting the
+source files from the page cache before each run so they are really read from disk:
+
+    python benchmarks/bench_transfer_order.py --workdir /mnt/hdd/bench --files 20000
+
+The numbers only mean something with --workdir on a spinning disk; on an SSD every order performs about the
+same.  Evicting the cache uses posix_fadvise and needs Linux.
+"""
+
+from __future__ import annotations
+
+import argparse
+import contextlib
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Any
+from unittest.mock import patch
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import src.sortphotos as sortphotos  # noqa: E402
+from src.sortphotos import _scan_source_files, sortPhotos  # noqa: E402
+
+
+def generate_tree(root: Path, num_files: int, file_size: int, seed: int = 0) -> None:
+    """folders of 500 IMG_nnnn.JPG files, written in a random order across the whole tree"""
+    paths = [root / f'{100 + i // 500:03d}CANON' / f'IMG_{i % 500:04d}.JPG' for i in range(num_files)]
+    for folder in {path.parent for path in paths}:
+        folder.mkdir(parents=True, exist_ok=True)
+    random.Random(seed).shuffle(paths)
+    block = os.urandom(file_size)
+    for path in paths:
+        path.write_bytes(block)
+    os.sync()
+
+
+def _evict(files: list[str]) -> None:
+    """drop files from the page cache"""
+    for path in files:
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            os.fdatasync(fd)
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+        finally:
+            os.close(fd)
+
+
+def run(args: argparse.Namespace, workdir: Path) -> dict[str, Any]:
+    src_dir = workdir / 'source'
+    manifest = workdir / 'tree.json'
+    params = {'files': args.files, 'file_size': args.file_size, 'seed': args.seed}
+    if not manifest.exists() or json.loads(manifest.read_text()) != params:
+        shutil.rmtree(src_dir, ignore_errors=True)
+        print(f'Generating {args.files} files of {args.file_size} bytes in {src_dir}...')
+        generate_tree(src_dir, args.files, args.file_size, args.seed)
+        manifest.write_text(json.dumps(params))
+
+    files = list(_scan_source_files(str(src_dir), recursive=True))
+    taken = datetime(2018, 1, 1)
+    # metadata extraction is left out: files arrive in directory order, one day apart
+    timestamps = [(path, taken + timedelta(days=n), ['EXIF:DateTimeOriginal']) for n, path in enumerate(files)]
+    total = len(files) * args.file_size
+
+    results: dict[str, Any] = {}
+    for order in args.orders:
+        dest_dir = workdir / 'dest'
+        shutil.rmtree(dest_dir, ignore_errors=True)
+        _evict(files)
+        with patch.object(sortphotos, '_extract_timestamps', lambda *a, **k: iter(timestamps)):
+            start = time.perf_counter()
+            sortPhotos(str(src_dir), str(dest_dir), '%Y/%m', None, recursive=True, copy_files=True,
+                       batch_size=1000, transfer_order=None if order == 'none' else order)
+            os.sync()
+            seconds = time.perf_counter() - start
+        results[order] = {'seconds': seconds, 'files_per_sec': len(files) / seconds,
+                          'mb_per_sec': total / seconds / 2**20}
+        speedup = results['none']['seconds'] / seconds if 'none' in results else 1.0
+        print(f'{order:>7}: {seconds:9.3f} s  {len(files) / seconds:9.0f} files/s  '
+              f'{total / seconds / 2**20:8.1f} MB/s  ({speedup:4.2f}x)')
+    shutil.rmtree(workdir / 'dest', ignore_errors=True)
+
+    src_dev = os.stat(src_dir).st_dev
+    return {
+        'date': datetime.now().isoformat(timespec='seconds'),
+        'rotational': sortphotos._is_rotational(src_dev),
+        'tree': params,
+        'orders': results,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--files', type=int, default=5000, help='number of files in the tree (default: 5000)')
+    parser.add_argument('--file-size', type=int, default=256 * 1024, help='bytes per file (default: 262144)')
+    parser.add_argument('--seed', type=int, default=0, help='random seed for the order files are written in')
+    parser.add_argument('--orders', nargs='+', default=['none', *sortphotos.transfer_orders],
+                        choices=['none', *sortphotos.transfer_orders], help='transfer orders to time')
+    parser.add_argument('--workdir', type=Path, default=None,
+                        help='directory for the tree and the copies, on the disk to measure; kept between runs so '
+                             'the tree is reused (default: a temporary directory)')
+    parser.add_argument('--output', type=Path, default=None, help='write the results to this JSON file')
+    args = parser.parse_args()
+
+    with contextlib.ExitStack() as stack:
+        workdir = args.workdir
+        if workdir is None:
+            workdir = Path(stack.enter_context(tempfile.TemporaryDirectory(prefix='sortphotos-order-')))
+        workdir.mkdir(parents=True, exist_ok=True)
+        result = run(args, workdir)
+        if result['rotational'] is not True:
+            print('Note: the source is not on a disk known to be rotational, so little difference is expected.')
+
+    if args.output is not None:
+        args.output.write_text(json.dumps(result, indent=2) + '\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+#!/usr/bin/perl
+# Stand-in for ExifTool used by the benchmarks.  Speaks the -stay_open protocol sortphotos uses and answers
+# -j with the tags stored on the first line of each file by bench_sortphotos.py, so runs measure sortphotos
+# rather than ExifTool.  Options other than -@, -r and -stay_open are ignored.
+use strict;
+use warnings;
+use File::Find;
+
+$| = 1;
+
+sub record {
+    my ($path) = @_;
+    open(my $fh, '<', $path) or return undef;
+    my $tags = <$fh>;
+    close($fh);
+    return undef unless defined $tags && $tags =~ /^"/;
+    chomp $tags;
+    (my $name = $path) =~ s/(["\\])/\\$1/g;
+    return "{\n  \"SourceFile\": \"$name\",\n  $tags\n}";
+}
+
+sub run {
+    my @args = @_;
+    my (@targets, $recursive);
+    while (defined(my $arg = shift @args)) {
+        if ($arg eq '-@') {
+            my $file = shift @args;
+            open(my $fh, '<', $file) or next;
+            chomp(my @lines = <$fh>);
+            close($fh);
+            push @targets, grep { length } @lines;
+        } elsif ($arg eq '-r') {
+            $recursive = 1;
+        } elsif ($arg !~ /^-/) {
+            push @targets, $arg;
+        }
+    }
+    my @records;
+    for my $target (@targets) {
+        if (-d $target) {
+            my @files;
+            find({ no_chdir => 1, wanted => sub {
+                if (-d $_) {
+                    $File::Find::prune = 1 if $_ ne $target && (!$recursive || (split m{/}, $_)[-1] =~ /^\./);
+                } else {
+                    push @files, $_;
+                }
+            } }, $target);
+            push @records, map { record($_) } sort @files;
+        } else {
+            push @records, record($target);
+        }
+    }
+    @records = grep { defined } @records;
+    print '[', join(",\n", @records), "]\n" if @records;
+    print "{ready}\n";
+}
+
+my ($stay_open, @args) = (1);
+while ($stay_open && defined(my $line = <STDIN>)) {
+    chomp $line;
+    if ($line eq '-execute') {
+        run(@args);
+        @args = ();
+    } elsif ($line eq 'False' && @args && $args[-1] eq '-stay_open') {
+        $stay_open = 0;
+    } else {
+        push @args, $line;
+    }
+}
@@ -10,16 +10,36 @@ Copyright (c) S. Andrew Ning. All rights reserved.
 from __future__ import annotations
 
 import argparse
+import asyncio
+import collections
 import concurrent.futures
+import contextlib
+import ctypes
+import ctypes.util
+import errno
 import filecmp
+import functools
+import gzip
+import hashlib
+import itertools
 import json
 import locale
 import logging
+import math
 import os
+import queue
 import re
+import select
 import shutil
+import signal
+import sqlite3
+import struct
 import subprocess
 import sys
+import tempfile
+import threading
+import time
+from collections.abc import AsyncIterable, AsyncIterator, Callable, Iterable, Iterator, Sequence
 from datetime import datetime, timedelta
 from fnmatch import fnmatch
 from pathlib import Path
@@ -32,9 +52,39 @@ logger = logging.getLogger('sortphotos')
 
 exiftool_location: str = str(Path(__file__).resolve().parent / 'Image-ExifTool' / 'exiftool')
 
+# number of files handed to ExifTool per -execute when streaming metadata
+default_batch_size: int = 1000
+
+# tags tiered extraction may read in a fast first pass; files without a date from them are read again in full
+default_primary_tags: tuple[str, ...] = (
+    'EXIF:DateTimeOriginal',
+    'EXIF:CreateDate',
+    'Composite:SubSecDateTimeOriginal',
+    'Composite:SubSecCreateDate',
+)
+
+# maximum number of files remembered by the metadata cache before the least recently used are evicted
+default_cache_max_entries: int = 1_000_000
+
+# name of the content index kept in dest_dir when no other location is given
+default_content_index_name: str = '.sortphotos-index.sqlite'
+
+# maximum number of transfers running or waiting for their devices when transferring with several workers
+default_transfer_window: int = 1024
+
+# how a verified copy is checked once written, and how many times a copy that fails is tried again
+verify_modes: tuple[str, ...] = ('readback', 'fsync')
+default_verify_retries: int = 2
+
 
 # -------- convenience methods -------------
 
+# the usual forms of EXIF dates, answered without the general parser below
+_EXIF_DATE = re.compile(
+    r'([0-9]{4}):([0-9]{2}):([0-9]{2})(?: ([0-9]{2}):([0-9]{2}):([0-9]{2})(?:\.[0-9]*)?(?:([+-])([0-9]{2}):([0-9]{2})|Z)?)?')
+_TIME_ZONE_SPLIT = re.compile(r'(\+|-|Z)')
+
+
 def parse_date_exif(date_string: str) -> datetime | None:
     """
     extract date info from EXIF data
@@ -43,57 +93,85 @@ def parse_date_exif(date_string: str) -> datetime | None:
     or YYYY:MM:DD HH:MM:SS-HH:MM
     or YYYY:MM:DD HH:MM:SSZ
     """
+    return _parse_date_string(str(date_string).strip())
 
-    # split into date and time
-    elements = str(date_string).strip().split()  # ['YYYY:MM:DD', 'HH:MM:SS']
 
-    if len(elements) < 1:
-        return None
-
-    # parse year, month, day
-    date_entries = elements[0].split(':')  # ['YYYY', 'MM', 'DD']
+@functools.lru_cache(maxsize=1 << 16)
+def _strftime_ok(year: int, month: int) -> bool:
+    # some "valid" dates are way before 1900 and cannot be formatted by strftime later
+    try:
+        datetime(year, month, 1).strftime('%Y/%m-%b')  # any format with year, month, day, would work here.
+    except ValueError:
+        return False
+    return True
+
+
+@functools.lru_cache(maxsize=1 << 16)
+def _parse_date_string(date_string: str) -> datetime | None:
+    """parse_date_exif for a stripped string.  Cached, as the same date usually appears in several tags of a file"""
+
+    dateadd = None
+    match = _EXIF_DATE.fullmatch(date_string)
+    if match is not None:
+        year_s, month_s, day_s, hour_s, minute_s, second_s, sign, tz_hour, tz_min = match.groups()
+        if year_s == '0000':
+            return None
+        year, month, day = int(year_s), int(month_s), int(day_s)
+        if hour_s is None:
+            hour, minute, second = 12, 0, 0  # defaulting to noon if no time data provided
+        else:
+            hour, minute, second = int(hour_s), int(minute_s), int(second_s)
+        if sign is not None:
+            dateadd = timedelta(hours=int(tz_hour) * (-1 if sign == '+' else 1), minutes=int(tz_min))
 
-    # check if three entries, nonzero data, and no decimal (which occurs for timestamps with only time but no date)
-    if len(date_entries) == 3 and date_entries[0] > '0000' and '.' not in ''.join(date_entries):
-        year = int(date_entries[0])
-        month = int(date_entries[1])
-        day = int(date_entries[2])
     else:
-        return None
+        # split into date and time
+        elements = date_string.split()  # ['YYYY:MM:DD', 'HH:MM:SS']
 
-    # parse hour, min, second
-    time_zone_adjust = False
-    hour = 12  # defaulting to noon if no time data provided
-    minute = 0
-    second = 0
+        if len(elements) < 1:
+            return None
 
-    if len(elements) > 1:
-        time_entries = re.split(r'(\+|-|Z)', elements[1])  # ['HH:MM:SS', '+', 'HH:MM']
-        time = time_entries[0].split(':')  # ['HH', 'MM', 'SS']
+        # parse year, month, day
+        date_entries = elements[0].split(':')  # ['YYYY', 'MM', 'DD']
+
+        # check if three entries, nonzero data, and no decimal (which occurs for timestamps with only time but no date)
+        if len(date_entries) == 3 and date_entries[0] > '0000' and '.' not in elements[0]:
+            year = int(date_entries[0])
+            month = int(date_entries[1])
+            day = int(date_entries[2])
+        else:
+            return None
 
-        if len(time) == 3:
-            hour = int(time[0])
-            minute = int(time[1])
-            second = int(time[2].split('.')[0])
-        elif len(time) == 2:
-            hour = int(time[0])
-            minute = int(time[1])
+        # parse hour, min, second
+        hour = 12  # defaulting to noon if no time data provided
+        minute = 0
+        second = 0
 
-        # adjust for time-zone if needed
-        if len(time_entries) > 2:
-            time_zone = time_entries[2].split(':')  # ['HH', 'MM']
+        if len(elements) > 1:
+            time_entries = _TIME_ZONE_SPLIT.split(elements[1])  # ['HH:MM:SS', '+', 'HH:MM']
+            time = time_entries[0].split(':')  # ['HH', 'MM', 'SS']
 
-            if len(time_zone) == 2:
-                time_zone_hour = int(time_zone[0])
-                time_zone_min = int(time_zone[1])
+            if len(time) == 3:
+                hour = int(time[0])
+                minute = int(time[1])
+                second = int(time[2].split('.')[0])
+            elif len(time) == 2:
+                hour = int(time[0])
+                minute = int(time[1])
 
-                # check if + or -
-                if time_entries[1] == '+':
-                    time_zone_hour *= -1
+            # adjust for time-zone if needed
+            if len(time_entries) > 2:
+                time_zone = time_entries[2].split(':')  # ['HH', 'MM']
 
-                dateadd = timedelta(hours=time_zone_hour, minutes=time_zone_min)
-                time_zone_adjust = True
+                if len(time_zone) == 2:
+                    time_zone_hour = int(time_zone[0])
+                    time_zone_min = int(time_zone[1])
 
+                    # check if + or -
+                    if time_entries[1] == '+':
+                        time_zone_hour *= -1
+
+                    dateadd = timedelta(hours=time_zone_hour, minutes=time_zone_min)
 
     # form date object
     try:
@@ -101,50 +179,53 @@ def parse_date_exif(date_string: str) -> datetime | None:
     except ValueError:
         return None  # errors in time format
 
-    # try converting it (some "valid" dates are way before 1900 and cannot be parsed by strtime later)
-    try:
-        date.strftime('%Y/%m-%b')  # any format with year, month, day, would work here.
-    except ValueError:
+    if not _strftime_ok(year, month):
         return None  # errors in time format
 
     # adjust for time zone if necessary
-    if time_zone_adjust:
+    if dateadd is not None:
         date += dateadd
 
     return date
 
 
 
-def get_oldest_timestamp(
-    data: dict[str, Any],
-    additional_groups_to_ignore: list[str],
-    additional_tags_to_ignore: list[str],
-) -> tuple[str, datetime | None, list[str]]:
-    """data as dictionary from json.  Should contain only time stamps except SourceFile"""
-
-    # save only the oldest date
-    date_available = False
-    oldest_date = datetime.now()
-    oldest_keys: list[str] = []
-
-    # save src file
-    src_file = data['SourceFile']
-
-    # setup tags to ignore
-    ignore_groups = ['ICC_Profile'] + additional_groups_to_ignore
-    ignore_tags = ['SourceFile', 'XMP:HistoryWhen'] + additional_tags_to_ignore
-
-    logger.debug('All relevant tags:')
-
-    # run through all keys
-    for key in data.keys():
-
-        # check if this key needs to be ignored, or is in the set of tags that must be used
-        if (key not in ignore_tags) and (key.split(':')[0] not in ignore_groups) and 'GPS' not in key:
+class TagPolicy:
+    """
+    which tags of an ExifTool record may supply a file's date, built once from the ignore options of a run.
+    Groups and tags are held in frozensets and the decision for each tag name is cached, so records with dozens
+    of time tags cost a dictionary lookup per tag.  Dates later than the moment the policy was built are never
+    chosen, so a camera clock set far in the future does not win.
+    """
 
-            date = data[key]
+    def __init__(self, additional_groups_to_ignore: Iterable[str], additional_tags_to_ignore: Iterable[str]) -> None:
+        self.ignore_groups = frozenset(['ICC_Profile', *additional_groups_to_ignore])
+        self.ignore_tags = frozenset(['SourceFile', 'XMP:HistoryWhen', *additional_tags_to_ignore])
+        self.latest = datetime.now()
+        self._accepts: dict[str, bool] = {}
+
+    def accepts(self, key: str) -> bool:
+        """True if the tag key (Group:Tag) may supply a date"""
+        accepted = self._accepts.get(key)
+        if accepted is None:
+            accepted = (key not in self.ignore_tags and key.split(':')[0] not in self.ignore_groups
+                        and 'GPS' not in key)
+            self._accepts[key] = accepted
+        return accepted
+
+    def oldest_timestamp(self, data: dict[str, Any]) -> tuple[str, datetime | None, list[str]]:
+        """the source file, oldest accepted date (None if there is none) and the tags holding that date"""
+        oldest_date = None
+        oldest_keys: list[str] = []
+        debug = logger.isEnabledFor(logging.DEBUG)
+        if debug:
+            logger.debug('All relevant tags:')
 
-            logger.debug(f'{key}, {date}')
+        for key, date in data.items():
+            if not self.accepts(key):
+                continue
+            if debug:
+                logger.debug(f'{key}, {date}')
 
             # (rare) check if multiple dates returned in a list, take the first one which is the oldest
             if isinstance(date, list):
@@ -153,20 +234,26 @@ def get_oldest_timestamp(
             try:
                 exifdate = parse_date_exif(date)  # check for poor-formed exif data, but allow continuation
             except Exception:
-                exifdate = None
+                continue
 
-            if exifdate and exifdate < oldest_date:
-                date_available = True
+            if exifdate is None or exifdate >= self.latest:
+                continue
+            if oldest_date is None or exifdate < oldest_date:
                 oldest_date = exifdate
                 oldest_keys = [key]
-
-            elif exifdate and exifdate == oldest_date:
+            elif exifdate == oldest_date:
                 oldest_keys.append(key)
 
-    if not date_available:
-        oldest_date = None
+        return data['SourceFile'], oldest_date, oldest_keys
+
 
-    return src_file, oldest_date, oldest_keys
+def get_oldest_timestamp(
+    data: dict[str, Any],
+    additional_groups_to_ignore: list[str],
+    additional_tags_to_ignore: list[str],
+) -> tuple[str, datetime | None, list[str]]:
+    """data as dictionary from json.  Should contain only time stamps except SourceFile"""
+    return TagPolicy(additional_groups_to_ignore, additional_tags_to_ignore).oldest_timestamp(data)
 
 
 
@@ -180,20 +267,938 @@ def check_for_early_morning_photos(date: datetime, day_begins: int) -> datetime:
     return date
 
 
+def _normalize_extensions(extensions: Iterable[str] | None) -> frozenset[str] | None:
+    """lowercase extensions with a leading dot, e.g. ['JPG', '.cr2'] -> {'.jpg', '.cr2'}"""
+    if extensions is None:
+        return None
+    return frozenset('.' + ext.lower().lstrip('.') for ext in extensions)
+
+
+@functools.lru_cache
+def _exiftool_extensions(executable: str = exiftool_location) -> frozenset[str] | None:
+    """
+    extensions of the file types ExifTool reads (exiftool -listf), normalized as by _normalize_extensions, or None
+    if they cannot be listed.  ExifTool only reads files of these types when it scans a directory itself
+    """
+    try:
+        output = subprocess.run(['perl', executable, '-listf'], capture_output=True, text=True, check=True).stdout
+    except (OSError, subprocess.CalledProcessError) as e:
+        logger.warning(f'Could not list the file types ExifTool reads ({e}); every file will be handed to it')
+        return None
+    # a heading line, then the extensions separated by spaces
+    return _normalize_extensions(ext for line in output.splitlines()[1:] for ext in line.split())
+
+
+def _is_excluded_dir(path: str, name: str, exclude_patterns: list[str]) -> bool:
+    """true if a directory name matches a pattern, or a pattern ending in '*' covers everything below path"""
+    for pat in exclude_patterns:
+        if fnmatch(name, pat):
+            return True
+        if pat.endswith('*') and fnmatch(path + os.sep, pat[:-1]):
+            return True
+    return False
+
+
+def _scan_source_files(
+    src_dir: str,
+    recursive: bool,
+    exclude_patterns: list[str] | None = None,
+    extensions: Iterable[str] | None = None,
+    exclude_extensions: Iterable[str] | None = None,
+    stats: dict[str, int] | None = None,
+    file_types: frozenset[str] | None = None,
+) -> Iterator[str]:
+    """
+    yield the files in src_dir (top level only unless recursive) that should be handed to ExifTool.
+    Hidden and excluded directories are pruned without being read, like ExifTool -r skips hidden
+    directories.  Hidden files, files matching exclude_patterns, and files whose extension is not in
+    extensions (if given) or is in exclude_extensions are skipped and counted in stats.  Without extensions,
+    files whose extension is not in file_types (if given, see _exiftool_extensions) are left out silently, as
+    ExifTool's own directory scan never reads them; files given by name would all be read.
+    """
+    exclude_patterns = exclude_patterns or []
+
+    def skip(reason: str) -> None:
+        if stats is not None:
+            stats[reason] += 1
+
+    return _filter_extensions(_walk(src_dir, recursive, exclude_patterns, skip), extensions, exclude_extensions,
+                              stats, file_types)
+
+
+def _walk(
+    src_dir: str,
+    recursive: bool,
+    exclude_patterns: list[str],
+    skip: Callable[[str], None],
+) -> Iterator[str]:
+    """
+    the walk of _scan_source_files, before extension filters.  Symbolic links to directories are followed, as by
+    ExifTool -r, each directory being read once however many links lead to it
+    """
+    pending = [src_dir]
+    seen: set[tuple[int, int]] = set()
+    with contextlib.suppress(OSError):
+        st = os.stat(src_dir)
+        seen.add((st.st_dev, st.st_ino))
+    while pending:
+        directory = pending.pop()
+        try:
+            with os.scandir(directory) as it:
+                entries = sorted(it, key=lambda entry: entry.name)
+        except OSError as e:
+            logger.error(f'Error reading directory {directory}: {e}')
+            skip('errors')
+            continue
+
+        subdirs = []
+        for entry in entries:
+            try:
+                is_dir = entry.is_dir()
+            except OSError:
+                is_dir = False
+            if is_dir:
+                if recursive and not entry.name.startswith('.') \
+                        and not _is_excluded_dir(entry.path, entry.name, exclude_patterns):
+                    try:
+                        st = entry.stat()
+                    except OSError:
+                        continue
+                    if (st.st_dev, st.st_ino) not in seen:
+                        seen.add((st.st_dev, st.st_ino))
+                        subdirs.append(entry.path)
+                continue
+            if not entry.is_file():
+                continue
+
+            if entry.name.startswith('.'):
+                skip('skipped_hidden')
+                continue
+            if any(fnmatch(entry.name, pat) or fnmatch(entry.path, pat) for pat in exclude_patterns):
+                skip('skipped_excluded')
+                continue
+
+            yield entry.path
+
+        # depth first, in name order
+        pending.extend(reversed(subdirs))
+
+
+def _filter_extensions(
+    files: Iterable[str],
+    extensions: Iterable[str] | None = None,
+    exclude_extensions: Iterable[str] | None = None,
+    stats: dict[str, int] | None = None,
+    file_types: frozenset[str] | None = None,
+) -> Iterator[str]:
+    """the extension filters of _scan_source_files, for files found by it or given by name"""
+    allowed = _normalize_extensions(extensions)
+    denied = _normalize_extensions(exclude_extensions) or frozenset()
+    for src_file in files:
+        ext = os.path.splitext(src_file)[1].lower()
+        if (allowed is not None and ext not in allowed) or ext in denied:
+            if stats is not None:
+                stats['skipped_excluded'] += 1
+            continue
+        if allowed is None and file_types is not None and ext not in file_types:
+            continue
+        yield src_file
+
+
+def _filter_excluded(
+    files: Iterable[str],
+    roots: Sequence[str],
+    exclude_patterns: list[str] | None = None,
+    stats: dict[str, int] | None = None,
+) -> Iterator[str]:
+    """
+    the directory and name filters of _scan_source_files, for files given by name: files below a hidden or
+    excluded directory under their root (one of roots) or matching exclude_patterns are skipped and counted
+    """
+    exclude_patterns = exclude_patterns or []
+    for src_file in files:
+        folder, name = os.path.split(src_file)
+        path = ''
+        for root in roots:
+            relative = os.path.relpath(folder, root)
+            if relative != os.pardir and not relative.startswith(os.pardir + os.sep):
+                path = root
+                break
+        reason = None
+        if path:
+            for part in Path(relative).parts if relative != os.curdir else ():
+                path = os.path.join(path, part)
+                if part.startswith('.'):
+                    reason = 'skipped_hidden'
+                elif _is_excluded_dir(path, part, exclude_patterns):
+                    reason = 'skipped_excluded'
+                if reason:
+                    break
+        if reason is None and any(fnmatch(name, pat) or fnmatch(src_file, pat) for pat in exclude_patterns):
+            reason = 'skipped_excluded'
+        if reason is not None:
+            if stats is not None:
+                stats[reason] += 1
+            continue
+        yield src_file
+
+
+@contextlib.contextmanager
+def _argument_file(files: Iterable[str]) -> Iterator[str]:
+    """write files to a temporary ExifTool -@ argument file (one per line) and remove it afterwards"""
+    with tempfile.NamedTemporaryFile('wb', prefix='sortphotos-', suffix='.args', delete=False) as f:
+        for src_file in files:
+            f.write(os.fsencode(src_file) + b'\n')
+    try:
+        yield f.name
+    finally:
+        os.remove(f.name)
+
+
+# ioctl request cloning a whole file (linux/fs.h) and the errors meaning a method is not available here
+_FICLONE = 0x40049409
+_NOT_SUPPORTED = frozenset({errno.EXDEV, errno.EOPNOTSUPP, errno.ENOTTY, errno.EINVAL, errno.ENOSYS,
+                            errno.EBADF, errno.EPERM})
+
+# bytes copied between checks of the bandwidth limit
+_THROTTLE_CHUNK = 1 << 20
+
+_SIZE = re.compile(r'(\d+(?:\.\d*)?)\s*([kmgt]?)(?:i?b)?(?:/s)?', re.IGNORECASE)
+
+
+def _parse_size(text: str) -> float:
+    """a number of bytes such as 20M, 1.5GB or 500k/s (binary multiples), as used by --max-bandwidth"""
+    match = _SIZE.fullmatch(text.strip())
+    if match is None:
+        raise ValueError(f'not a size: {text!r}')
+    return float(match.group(1)) * 1024 ** ' kmgt'.index(match.group(2).lower() or ' ')
+
+
+class Throttle:
+    """
+    token buckets limiting transfers to files_per_sec files and bandwidth bytes per second (None for no limit),
+    shared by every transfer worker.  The buckets hold a tenth of a second's worth, and callers reserve what they
+    need and sleep until it is theirs, so throughput is paced evenly rather than in bursts.
+
+    With a control_file, the limits can be changed while a run is going: lines such as "max-bandwidth = 20M" or
+    "max-files-per-sec = none" override the limits given here.  The file is read again when it changes (checked at
+    most once a second) and straight away on SIGUSR1 while the throttle is entered as a context manager.
+    """
+
+    burst: float = 0.1
+
+    def __init__(self, bandwidth: float | None = None, files_per_sec: float | None = None,
+                 control_file: str | None = None) -> None:
+        self.lock = threading.Lock()
+        self.defaults = {'max-bandwidth': bandwidth, 'max-files-per-sec': files_per_sec}
+        self.control_file = control_file
+        self._control_signature: tuple[int, int] | None = None
+        self._next_check = 0.0
+        self._reload = False
+        self._previous_handler: Any = None
+        # name -> [rate, tokens, time of the last refill]
+        self.buckets: dict[str, list[float]] = {}
+        self.set_limits(bandwidth, files_per_sec)
+        if control_file is not None:
+            self._check_control_file(force=True, announce=False)
+
+    @property
+    def bandwidth(self) -> float | None:
+        return self.buckets['bytes'][0] if 'bytes' in self.buckets else None
+
+    @property
+    def files_per_sec(self) -> float | None:
+        return self.buckets['files'][0] if 'files' in self.buckets else None
+
+    def set_limits(self, bandwidth: float | None, files_per_sec: float | None) -> None:
+        for name, rate in (('bytes', bandwidth), ('files', files_per_sec)):
+            if rate is not None and rate <= 0:
+                raise ValueError('limits must be positive')
+            if rate is None:
+                self.buckets.pop(name, None)
+            elif name in self.buckets:
+                bucket = self.buckets[name]
+                bucket[0] = rate
+                bucket[1] = min(bucket[1], rate * self.burst)
+            else:
+                self.buckets[name] = [rate, rate * self.burst, time.monotonic()]
+
+    def acquire(self, files: int = 0, nbytes: int = 0) -> None:
+        """wait until files files and nbytes bytes may be transferred"""
+        with self.lock:
+            if self.control_file is not None:
+                self._check_control_file(force=self._reload)
+            delay = 0.0
+            now = time.monotonic()
+            for name, amount in (('files', files), ('bytes', nbytes)):
+                bucket = self.buckets.get(name)
+                if bucket is None or not amount:
+                    continue
+                rate, tokens, last = bucket
+                tokens = min(rate * self.burst, tokens + (now - last) * rate) - amount
+                bucket[1:] = [tokens, now]
+                # a deficit is paid back by waiting, which also makes the callers after this one wait their turn
+                if tokens < 0:
+                    delay = max(delay, -tokens / rate)
+        if delay:
+            time.sleep(delay)
+
+    def _check_control_file(self, force: bool = False, announce: bool = True) -> None:
+        now = time.monotonic()
+        if not force and now < self._next_check:
+            return
+        self._next_check = now + 1.0
+        self._reload = False
+        try:
+            st = os.stat(self.control_file)  # type: ignore[arg-type]
+        except OSError:
+            return
+        signature = (st.st_mtime_ns, st.st_size)
+        if signature == self._control_signature and not force:
+            return
+        self._control_signature = signature
+        limits = dict(self.defaults)
+        try:
+            for line in Path(self.control_file).read_text().splitlines():  # type: ignore[arg-type]
+                line = line.split('#', 1)[0].strip()
+                if not line:
+                    continue
+                key, _, value = (part.strip() for part in line.partition('='))
+                if key not in limits:
+                    raise ValueError(f'unknown setting {key!r}')
+                limits[key] = None if value.lower() == 'none' else _parse_size(value)
+            self.set_limits(limits['max-bandwidth'], limits['max-files-per-sec'])
+        except (OSError, ValueError) as e:
+            logger.warning(f'Ignoring {self.control_file}: {e}')
+            return
+        if announce:
+            logger.info(f'Transfer limits: {self.describe()}')
+
+    def describe(self) -> str:
+        bandwidth, files = self.bandwidth, self.files_per_sec
+        return (f'{f"{bandwidth / 2**20:.1f} MB/s" if bandwidth else "unlimited bandwidth"}, '
+                f'{f"{files:g} files/s" if files else "unlimited files/s"}')
+
+    def __enter__(self) -> Throttle:
+        if self.control_file is not None and hasattr(signal, 'SIGUSR1'):
+            with contextlib.suppress(ValueError):  # only possible on the main thread
+                self._previous_handler = signal.signal(signal.SIGUSR1, self._on_signal)
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        if self._previous_handler is not None:
+            signal.signal(signal.SIGUSR1, self._previous_handler)
+            self._previous_handler = None
+
+    def _on_signal(self, signum: int, frame: Any) -> None:
+        self._reload = True  # read on the next acquire, as the lock may be held by the interrupted code
+
+
+def _copy_chunks(fsrc: Any, fdst: Any, throttle: Throttle) -> None:
+    while chunk := fsrc.read(_THROTTLE_CHUNK):
+        throttle.acquire(nbytes=len(chunk))
+        fdst.write(chunk)
+
+
+def _copy_data(src: str, dest: str, throttle: Throttle | None = None) -> str:
+    """
+    copy the contents of src to the new file dest without passing them through Python where the system allows,
+    returning the method used: a reflink sharing the data blocks (btrfs, XFS), copy_file_range, sendfile or copy.
+    With a throttle, data is copied a chunk at a time within its bandwidth limit (reflinks copy no data).
+    """
+    if not sys.platform.startswith('linux'):
+        if throttle is None:
+            shutil.copyfile(src, dest)  # uses fcopyfile on macOS
+        else:
+            with open(src, 'rb') as fsrc, open(dest, 'wb') as fdst:
+                _copy_chunks(fsrc, fdst, throttle)
+        return 'copy'
+
+    with open(src, 'rb') as fsrc, open(dest, 'wb') as fdst:
+        infd, outfd = fsrc.fileno(), fdst.fileno()
+        try:
+            import fcntl
+            fcntl.ioctl(outfd, _FICLONE, infd)
+            return 'reflink'
+        except OSError as e:
+            if e.errno not in _NOT_SUPPORTED:
+                raise
+
+        size = os.fstat(infd).st_size
+        chunk_size = 1 << 30 if throttle is None else _THROTTLE_CHUNK
+        for method, send in (('copy_file_range', lambda n: os.copy_file_range(infd, outfd, n)),
+                             ('sendfile', lambda n: os.sendfile(outfd, infd, None, n))):
+            copied = 0
+            try:
+                while copied < size:
+                    chunk = min(size - copied, chunk_size)
+                    if throttle is not None:
+                        throttle.acquire(nbytes=chunk)
+                    if not (sent := send(chunk)):
+                        break
+                    copied += sent
+            except OSError as e:
+                # only fall back while nothing has been written
+                if copied or e.errno not in _NOT_SUPPORTED:
+                    raise
+                continue
+            if copied == size:
+                return method
+            if copied:
+                # the source shrank, or the file system stopped short: never pass a partial copy off as complete
+                raise OSError(errno.EIO, f'{method} stopped after {copied} of {size} bytes')
+            # nothing copied (some file systems answer 0 rather than an error), so try the next method
+
+        if throttle is None:
+            shutil.copyfileobj(fsrc, fdst)
+        else:
+            _copy_chunks(fsrc, fdst, throttle)
+        return 'copy'
+
+
+class CopyVerifier:
+    """
+    verified copies, shared by every transfer worker.  The data is hashed (sha256) as it streams from the source
+    to the destination in one pass, the destination is synced, and then checked: mode 'readback' drops it from the
+    page cache and hashes it again as stored, 'fsync' trusts the sync and only checks its size.  An attempt that
+    fails is made again up to retries times.  The hash of each verified file is kept in digests (by destination)
+    until the caller collects it, so it can be recorded rather than read again.
+    """
+
+    def __init__(self, mode: str = 'readback', retries: int = default_verify_retries) -> None:
+        if mode not in verify_modes:
+            raise ValueError(f'verification mode must be one of {", ".join(verify_modes)}')
+        if retries < 0:
+            raise ValueError('verify retries must not be negative')
+        self.mode = mode
+        self.retries = retries
+        self.lock = threading.Lock()
+        self.digests: dict[str, str] = {}
+        self.retried = 0
+
+    def copy(self, src: str, dest: str, throttle: Throttle | None = None) -> str:
+        """copy src to the new file dest and verify it, returning the sha256 of its contents"""
+        for attempt in range(self.retries + 1):
+            try:
+                digest, size = self._copy(src, dest, throttle)
+                problem = self._check(src, dest, digest, size)
+                if problem is None:
+                    return digest
+                error = OSError(errno.EIO, f'verification failed: {problem}')
+            except (FileNotFoundError, PermissionError):
+                raise  # trying again would not help
+            except OSError as e:
+                error = e
+            if attempt < self.retries:
+                logger.warning(f'Copy of {src} failed ({error}), trying again')
+                with self.lock:
+                    self.retried += 1
+        raise error
+
+    def _copy(self, src: str, dest: str, throttle: Throttle | None) -> tuple[str, int]:
+        digest = hashlib.sha256()
+        size = 0
+        with open(src, 'rb') as fsrc, open(dest, 'wb') as fdst:
+            while chunk := fsrc.read(_THROTTLE_CHUNK):
+                if throttle is not None:
+                    throttle.acquire(nbytes=len(chunk))
+                digest.update(chunk)
+                fdst.write(chunk)
+                size += len(chunk)
+            fdst.flush()
+            os.fsync(fdst.fileno())
+        return digest.hexdigest(), size
+
+    def _check(self, src: str, dest: str, digest: str, size: int) -> str | None:
+        """what is wrong with the copy at dest, or None if it is intact"""
+        if os.stat(src).st_size != size:
+            return 'the source changed while it was copied'
+        if (written := os.stat(dest).st_size) != size:
+            return f'{written} bytes written of {size}'
+        if self.mode == 'readback':
+            if hasattr(os, 'posix_fadvise'):
+                # read what storage holds rather than the pages just written
+                fd = os.open(dest, os.O_RDONLY)
+                try:
+                    os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+                finally:
+                    os.close(fd)
+            if _hash_file(dest) != digest:
+                return 'the data read back differs from the source'
+        return None
+
+
+# ioctl request mapping the extents of a file (linux/fiemap.h), and its header and extent layouts
+_FS_IOC_FIEMAP = 0xC020660B
+_FIEMAP = struct.Struct('=QQLLLL')
+_FIEMAP_EXTENT = struct.Struct('=QQQ16xL12x')
+
+# ways transfers can be ordered to follow the layout of the source disk
+transfer_orders: tuple[str, ...] = ('inode', 'extent')
+
+
+def _first_extent(path: str) -> int | None:
+    """physical byte offset of the start of path's data on its device (FIEMAP, Linux), or None if not known"""
+    try:
+        import fcntl
+        request = bytearray(_FIEMAP.pack(0, 2**64 - 1, 0, 0, 1, 0) + bytes(_FIEMAP_EXTENT.size))
+        with open(path, 'rb') as f:
+            fcntl.ioctl(f.fileno(), _FS_IOC_FIEMAP, request)
+    except (ImportError, OSError):
+        return None
+    if not _FIEMAP.unpack_from(request)[3]:
+        return None  # no extents, e.g. an empty file or data stored inline
+    return _FIEMAP_EXTENT.unpack_from(request, _FIEMAP.size)[1]
+
+
+def _locality_key(path: str | os.PathLike[str], order: str) -> tuple[int, int, int]:
+    """
+    sort key putting files in the order they are stored on their device: by inode number, or with order 'extent'
+    by where their data starts (files whose extents are not known follow, by inode)
+    """
+    try:
+        st = os.stat(path)
+    except OSError:
+        return (-1, 1, 0)
+    if order == 'extent' and (start := _first_extent(os.fspath(path))) is not None:
+        return (st.st_dev, 0, start)
+    return (st.st_dev, 1, st.st_ino)
+
+
 def _transfer_file(
     src: str,
     dest: str,
     copy: bool,
-) -> tuple[str, str, str | None]:
-    """Move or copy a single file. Returns (src, dest, error_message_or_None)."""
+    hardlink: bool = False,
+    throttle: Throttle | None = None,
+    verifier: CopyVerifier | None = None,
+) -> tuple[str, str, str | None, str | None]:
+    """
+    Move or copy a single file using the cheapest method available.  Moves within a file system are renames;
+    otherwise the data goes to a temporary file next to dest that replaces dest once it is complete, so dest never
+    holds a partial file.  With hardlink, copies are hard links where src and dest share a file system.  With a
+    throttle, waits for its file limit first and copies data within its bandwidth limit.  With a verifier, data is
+    copied and checked by it (method 'verified') and the source of a move is only removed once its copy checks out.
+    Returns (src, dest, error_message_or_None, method_or_None).
+    """
+    if throttle is not None:
+        throttle.acquire(files=1)
+    if not copy:
+        try:
+            os.rename(src, dest)
+            return (src, dest, None, 'rename')
+        except OSError as e:
+            if e.errno != errno.EXDEV:
+                return (src, dest, str(e), None)
+
+    folder, name = os.path.split(dest)
+    try:
+        fd, tmp = tempfile.mkstemp(dir=folder, prefix=f'.{name}.', suffix='.part')
+        os.close(fd)
+    except OSError as e:
+        return (src, dest, str(e), None)
     try:
-        if copy:
-            shutil.copy2(src, dest)
+        method = None
+        if copy and hardlink:
+            try:
+                os.remove(tmp)
+                os.link(src, tmp)
+                method = 'hardlink'
+            except OSError as e:
+                if e.errno not in _NOT_SUPPORTED:
+                    raise
+        digest = None
+        if method is None:
+            if verifier is not None:
+                digest = verifier.copy(src, tmp, throttle)
+                method = 'verified'
+            else:
+                method = _copy_data(src, tmp, throttle)
+            shutil.copystat(src, tmp)
+        os.replace(tmp, dest)
+        if verifier is not None and digest is not None:
+            with verifier.lock:
+                verifier.digests[dest] = digest
+        if not copy:
+            os.remove(src)
+        return (src, dest, None, method)
+    except OSError as e:
+        with contextlib.suppress(OSError):
+            os.remove(tmp)
+        return (src, dest, str(e), None)
+
+
+# -------- native EXIF date reader -------------
+
+# extensions read by read_exif_dates, everything else always goes to ExifTool
+native_exif_extensions: frozenset[str] = frozenset({'.jpg', '.jpeg', '.jpe', '.tif', '.tiff'})
+
+# EXIF date tags (IFD0 / ExifIFD) as (name, date tag, SubSecTime tag, OffsetTime tag)
+_EXIF_DATE_TAGS: tuple[tuple[str, int, int, int], ...] = (
+    ('ModifyDate', 0x0132, 0x9290, 0x9010),
+    ('DateTimeOriginal', 0x9003, 0x9291, 0x9011),
+    ('CreateDate', 0x9004, 0x9292, 0x9012),
+)
+_EXIF_IFD_POINTER = 0x8769
+# IFD0 tags embedding XMP, IPTC or Photoshop data, which can hold dates of their own
+_EXIF_EMBEDDED_TAGS = frozenset({0x02bc, 0x83bb, 0x8649})
+
+# JPEG APPn segments known to carry no date tags: JFIF/JFXX, ICC profile, MPF and Adobe
+_JPEG_DATELESS_SEGMENTS: tuple[tuple[int, bytes], ...] = (
+    (0xe0, b'JFIF\0'), (0xe0, b'JFXX\0'), (0xe2, b'ICC_PROFILE\0'), (0xe2, b'MPF\0'), (0xee, b'Adobe'))
+
+
+def _read_ifd(tiff: bytes, offset: int, byte_order: str) -> dict[int, tuple[int, int, bytes | int]]:
+    """read one TIFF IFD into {tag: (type, count, raw value)}, raw value being bytes for ASCII and int otherwise"""
+    (count,) = struct.unpack_from(byte_order + 'H', tiff, offset)
+    entries = {}
+    for i in range(count):
+        tag, typ, n, value = struct.unpack_from(byte_order + 'HHII', tiff, offset + 2 + 12 * i)
+        if typ == 2:  # ASCII, stored inline when it fits in 4 bytes
+            start = offset + 2 + 12 * i + 8 if n <= 4 else value
+            if start + n > len(tiff):
+                raise ValueError('EXIF value out of range')
+            entries[tag] = (typ, n, tiff[start:start + n])
+        else:
+            entries[tag] = (typ, n, value)
+    return entries
+
+
+def _read_tiff_dates(tiff: bytes) -> dict[str, str] | None:
+    """
+    extract date tags from TIFF-structured EXIF data, keyed like ExifTool -G (e.g., EXIF:CreateDate),
+    including the Composite:SubSec* tags ExifTool derives when sub-seconds or offsets are present.
+    Returns None if the data holds something only ExifTool can interpret fully.
+    """
+    try:
+        byte_order = {b'II': '<', b'MM': '>'}[tiff[:2]]
+        magic, ifd0_offset = struct.unpack_from(byte_order + 'HI', tiff, 2)
+        if magic != 42:
+            return None
+        ifd0 = _read_ifd(tiff, ifd0_offset, byte_order)
+        if _EXIF_EMBEDDED_TAGS & ifd0.keys():
+            return None
+        entries = dict(ifd0)
+        if _EXIF_IFD_POINTER in ifd0:
+            entries.update(_read_ifd(tiff, ifd0[_EXIF_IFD_POINTER][2], byte_order))
+    except (KeyError, ValueError, struct.error):
+        return None
+
+    def text(tag: int) -> str | None:
+        if tag not in entries:
+            return None
+        typ, _, raw = entries[tag]
+        if typ != 2:
+            raise ValueError('not an ASCII value')
+        return raw.split(b'\0', 1)[0].decode('ascii')
+
+    dates: dict[str, str] = {}
+    composites: dict[str, str] = {}
+    try:
+        for name, date_tag, subsec_tag, offset_tag in _EXIF_DATE_TAGS:
+            value = text(date_tag)
+            if value is None:
+                continue
+            dates[f'EXIF:{name}'] = value
+
+            # same rules ExifTool uses to build Composite:SubSecDateTimeOriginal and friends
+            subsec, offset = text(subsec_tag), text(offset_tag)
+            composite = None
+            match = re.match(r'\d+', subsec) if subsec is not None else None
+            if match:
+                composite, replaced = re.subn(r'( \d{2}:\d{2}:\d{2})', rf'\g<1>.{match.group()}', value, count=1)
+                if not replaced:
+                    composite = None
+            match = re.match(r'([-+])(\d{1,2}):(\d{2})', offset) if offset is not None else None
+            if match and not re.search(r'[-+]', value):
+                composite = (composite or value) + f'{match.group(1)}{int(match.group(2)):02d}:{match.group(3)}'
+            if composite:
+                composites[f'Composite:SubSec{name}'] = composite
+    except (ValueError, UnicodeDecodeError):
+        return None
+
+    dates.update(composites)
+    return dates
+
+
+def _read_jpeg_exif(f: Any) -> bytes | None:
+    """return the TIFF block of a JPEG's Exif APP1 segment (b'' if there is none), or None to defer to ExifTool"""
+    if f.read(2) != b'\xff\xd8':
+        return None
+    tiff = b''
+    while True:
+        header = f.read(4)
+        if len(header) < 4 or header[0] != 0xff:
+            return None
+        marker = header[1]
+        if marker in (0xda, 0xd9):  # start of scan / end of image: no more metadata
+            return tiff
+        (length,) = struct.unpack('>H', header[2:])
+        if length < 2:
+            return None
+        if marker == 0xe1:
+            segment = f.read(length - 2)
+            if segment.startswith(b'Exif\0') and not tiff:
+                tiff = segment[6:]
+                continue
+            return None  # XMP or a second Exif block
+        if 0xe0 <= marker <= 0xef:
+            identifier = f.read(min(length - 2, 12))
+            if not any(marker == m and identifier.startswith(i) for m, i in _JPEG_DATELESS_SEGMENTS):
+                return None
+            f.seek(length - 2 - len(identifier), os.SEEK_CUR)
+            continue
+        f.seek(length - 2, os.SEEK_CUR)
+
+
+def _format_file_date(timestamp: float) -> str:
+    """format a file system timestamp the way ExifTool reports File:FileModifyDate and friends"""
+    local = time.localtime(int(timestamp))
+    offset = local.tm_gmtoff // 60
+    sign = '-' if offset < 0 else '+'
+    return time.strftime('%Y:%m:%d %H:%M:%S', local) + f'{sign}{abs(offset) // 60:02d}:{abs(offset) % 60:02d}'
+
+
+def read_exif_dates(
+    src_file: str,
+    st: os.stat_result | None = None,
+    file_dates: bool = True,
+) -> dict[str, Any] | None:
+    """
+    read the EXIF dates of a JPEG or TIFF file without ExifTool, returning a dictionary shaped like one
+    record of ExifTool -j -a -G -time:all output (SourceFile, EXIF:DateTimeOriginal, EXIF:CreateDate,
+    EXIF:ModifyDate, Composite:SubSec*, and the File: dates from st if file_dates).  Maker notes are not
+    read.  Returns None when the file is not a plain JPEG/TIFF or holds XMP, IPTC or other metadata that
+    could contain dates, in which case the file should be handed to ExifTool instead.
+    """
+    if os.path.splitext(src_file)[1].lower() not in native_exif_extensions:
+        return None
+    try:
+        if st is None:
+            st = os.stat(src_file)
+        with open(src_file, 'rb') as f:
+            start = f.read(4)
+            f.seek(0)
+            if start[:2] == b'\xff\xd8':
+                tiff = _read_jpeg_exif(f)
+            elif start in (b'II*\0', b'MM\0*'):
+                tiff = f.read(1 << 20)  # IFD0 and the ExifIFD sit near the start of the file
+            else:
+                return None
+    except OSError:
+        return None
+    if tiff is None:
+        return None
+    dates = _read_tiff_dates(tiff) if tiff else {}
+    if dates is None:
+        return None
+
+    data: dict[str, Any] = {'SourceFile': src_file}
+    if file_dates:
+        data['File:FileModifyDate'] = _format_file_date(st.st_mtime)
+        data['File:FileAccessDate'] = _format_file_date(st.st_atime)
+        data['File:FileInodeChangeDate'] = _format_file_date(st.st_ctime)
+    data.update(dates)
+    return data
+
+
+# -------- profiling -------------
+
+# context manager for hooks when no profiler is in use
+_no_phase = contextlib.nullcontext()
+
+
+class Profiler:
+    """
+    records where the time of a run goes.  Time is charged to the innermost phase running on each thread, so
+    nested phases are not counted twice, and phase times are summed over threads (phases running at the same
+    time, as with pipeline or several transfer workers, can add up to more than the run took).  Per-file
+    latencies are kept in logarithmic histograms, so memory does not grow with the number of files.
+    """
+
+    # histogram buckets per doubling of latency
+    resolution = 8
+
+    def __init__(self) -> None:
+        self.wall: collections.Counter[str] = collections.Counter()
+        self.cpu: collections.Counter[str] = collections.Counter()
+        self.latencies: dict[str, collections.Counter[int]] = collections.defaultdict(collections.Counter)
+        self.max_latency: collections.Counter[str] = collections.Counter()
+        self.files = 0
+        self.bytes_transferred = 0
+        self.transfer_span = [math.inf, 0.0]
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.start = time.perf_counter()
+        self.cpu_start = time.process_time()
+
+    def _switch(self, push: str | None = None) -> float:
+        """charge the time since the last switch on this thread to the running phase, then push or pop one"""
+        now, cpu = time.perf_counter(), time.thread_time()
+        stack = self.local.__dict__.setdefault('stack', [])
+        if stack:
+            with self.lock:
+                self.wall[stack[-1]] += now - self.local.mark
+                self.cpu[stack[-1]] += cpu - self.local.cpu_mark
+        if push is not None:
+            stack.append(push)
         else:
-            shutil.move(src, dest)
-        return (src, dest, None)
-    except (PermissionError, OSError) as e:
-        return (src, dest, str(e))
+            stack.pop()
+        self.local.mark, self.local.cpu_mark = now, cpu
+        return now
+
+    def _latency(self, name: str, seconds: float) -> None:
+        bucket = math.floor(math.log2(max(seconds, 1e-9)) * self.resolution)
+        with self.lock:
+            self.latencies[name][bucket] += 1
+            self.max_latency[name] = max(self.max_latency[name], seconds)
+
+    @contextlib.contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        self._switch(name)
+        try:
+            yield
+        finally:
+            self._switch()
+
+    def wrap(self, name: str, function: Callable[..., Any]) -> Callable[..., Any]:
+        """function, timed as phase name"""
+        def timed(*args: Any, **kwargs: Any) -> Any:
+            with self.phase(name):
+                return function(*args, **kwargs)
+        return timed
+
+    def iterate(self, name: str, items: Iterable[Any], between: str | None = None) -> Iterator[Any]:
+        """
+        items, with the time spent producing them charged to phase name and, if given, the time the consumer
+        spends on each item (until it asks for the next one) to phase between, recording per-item latencies
+        and counting the items as the files of the run
+        """
+        iterator = iter(items)
+        while True:
+            self._switch(name)
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                self._switch()
+            if between is None:
+                yield item
+                continue
+            started = self._switch(between)
+            try:
+                yield item
+            finally:
+                self._latency(between, self._switch() - started)
+                self.files += 1
+
+    def transfer(self, function: Callable[..., tuple[str, str, str | None, str | None]]) -> Callable[..., Any]:
+        """a _transfer_file that records its latency, and the bytes it moved or copied"""
+        def timed(*args: Any) -> tuple[str, str, str | None, str | None]:
+            started = self._switch('transfer')
+            try:
+                result = function(*args)
+            finally:
+                ended = self._switch()
+            self._latency('transfer', ended - started)
+            if result[2] is None:
+                with contextlib.suppress(OSError):
+                    size = os.stat(result[1]).st_size
+                    with self.lock:
+                        self.bytes_transferred += size
+                        self.transfer_span = [min(self.transfer_span[0], started), max(self.transfer_span[1], ended)]
+            return result
+        return timed
+
+    def _percentiles(self, name: str) -> dict[str, float]:
+        histogram = self.latencies[name]
+        total = sum(histogram.values())
+        result = {}
+        for label, fraction in (('p50', 0.5), ('p90', 0.9), ('p99', 0.99)):
+            count = 0
+            for bucket in sorted(histogram):
+                count += histogram[bucket]
+                if count >= fraction * total:
+                    # upper edge of the bucket, never beyond the largest latency seen
+                    result[label] = min(2 ** ((bucket + 1) / self.resolution), self.max_latency[name]) * 1e3
+                    break
+        result['max'] = self.max_latency[name] * 1e3
+        return result
+
+    def report(self) -> dict[str, Any]:
+        """everything recorded so far, as plain data"""
+        wall = time.perf_counter() - self.start
+        phases = {}
+        for name in sorted(self.wall, key=self.wall.__getitem__, reverse=True):
+            phases[name] = {'wall_seconds': self.wall[name], 'cpu_seconds': self.cpu[name]}
+            if self.latencies[name]:
+                phases[name]['count'] = sum(self.latencies[name].values())
+                phases[name]['latency_ms'] = self._percentiles(name)
+        span = max(self.transfer_span[1] - self.transfer_span[0], 0.0)
+        transferred = sum(self.latencies['transfer'].values())
+        report: dict[str, Any] = {
+            'wall_seconds': wall,
+            'cpu_seconds': time.process_time() - self.cpu_start,
+            'files': self.files,
+            'files_per_sec': self.files / wall if wall else None,
+            'phases': phases,
+            'transfer': {
+                'files': transferred,
+                'bytes': self.bytes_transferred,
+                'seconds': span,
+                'files_per_sec': transferred / span if span else None,
+                'bytes_per_sec': self.bytes_transferred / span if span else None,
+            },
+            'peak_rss_bytes': None,
+            'children_peak_rss_bytes': None,
+        }
+        try:
+            import resource
+            # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+            scale = 1 if sys.platform == 'darwin' else 1024
+            report['peak_rss_bytes'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+            report['children_peak_rss_bytes'] = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * scale
+        except ImportError:
+            pass
+        return report
+
+
+def _log_profile(report: dict[str, Any]) -> None:
+    logger.info('')
+    logger.info('--- Profile ---')
+    logger.info(f'{"phase":<12}{"wall s":>10}{"cpu s":>10}{"count":>10}{"p50 ms":>10}{"p90 ms":>10}'
+                f'{"p99 ms":>10}{"max ms":>10}')
+    for name, phase in report['phases'].items():
+        latency = phase.get('latency_ms', {})
+        columns = ''.join(f'{latency[k]:10.3f}' if k in latency else f'{"":>10}' for k in ('p50', 'p90', 'p99', 'max'))
+        logger.info(f'{name:<12}{phase["wall_seconds"]:10.3f}{phase["cpu_seconds"]:10.3f}'
+                    f'{phase.get("count", ""):>10}{columns}')
+    logger.info(f'Total: {report["wall_seconds"]:.3f} s wall, {report["cpu_seconds"]:.3f} s CPU, '
+                f'{report["files_per_sec"] or 0:.1f} files/s')
+    transfer = report['transfer']
+    if transfer['files']:
+        logger.info(f'Transfers: {transfer["files"]} files, {transfer["bytes"] / 1e6:.1f} MB in '
+                    f'{transfer["seconds"]:.3f} s ({transfer["files_per_sec"] or 0:.1f} files/s, '
+                    f'{(transfer["bytes_per_sec"] or 0) / 1e6:.1f} MB/s)')
+    if report['peak_rss_bytes'] is not None:
+        logger.info(f'Peak memory: {report["peak_rss_bytes"] / 1e6:.1f} MB '
+                    f'(child processes: {report["children_peak_rss_bytes"] / 1e6:.1f} MB)')
+
+
+# -------- ExifTool -------------
+
+def _low_priority_prefix() -> list[str]:
+    """
+    command prefix running a program at the lowest CPU priority and the lowest best-effort disk priority, with
+    whichever of nice and ionice are installed
+    """
+    prefix = []
+    if nice := shutil.which('nice'):
+        prefix += [nice, '-n', '19']
+    if ionice := shutil.which('ionice'):
+        prefix += [ionice, '-c', '2', '-n', '7']
+    return prefix
 
 
 #  this class is based on code from Sven Marnach (http://stackoverflow.com/questions/10075115/call-exiftool-from-a-python-script)
@@ -201,13 +1206,17 @@ class ExifTool:
     """used to run ExifTool from Python and keep it open"""
 
     sentinel: str = "{ready}"
+    read_size: int = 65536
 
-    def __init__(self, executable: str = exiftool_location) -> None:
+    def __init__(self, executable: str = exiftool_location, profiler: Profiler | None = None,
+                 nice: bool = False) -> None:
         self.executable = executable
+        self.profiler = profiler
+        self.nice = nice
 
     def __enter__(self) -> ExifTool:
         self.process = subprocess.Popen(
-            ['perl', self.executable, "-stay_open", "True",  "-@", "-"],
+            [*(_low_priority_prefix() if self.nice else []), 'perl', self.executable, "-stay_open", "True",  "-@", "-"],
             stdin=subprocess.PIPE, stdout=subprocess.PIPE)
         return self
 
@@ -222,31 +1231,1146 @@ class ExifTool:
             self.process.kill()
             self.process.wait()
 
-    def execute(self, *args: str) -> str:
+    def _send(self, args: tuple[str, ...]) -> None:
         args = args + ("-execute\n",)
         self.process.stdin.write(str.join("\n", args).encode('utf-8'))
         self.process.stdin.flush()
-        output = ""
-        fd = self.process.stdout.fileno()
-        while not output.rstrip(' \t\n\r').endswith(self.sentinel):
-            increment = os.read(fd, 4096)
-            logger.debug(increment.decode('utf-8'))
-            output += increment.decode('utf-8')
-        return output.rstrip(' \t\n\r')[:-len(self.sentinel)]
+
+    def _read(self) -> bytes:
+        increment = os.read(self.process.stdout.fileno(), self.read_size)
+        if not increment:
+            raise RuntimeError('ExifTool exited unexpectedly')
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(increment.decode('utf-8', errors='replace'))
+        return increment
+
+    def _is_ready(self, buffer: bytearray) -> bool:
+        """check only the tail of buffer for the sentinel, not the whole output"""
+        return bytes(buffer[-(len(self.sentinel) + 16):]).rstrip(b' \t\n\r').endswith(self.sentinel.encode())
+
+    def execute(self, *args: str) -> str:
+        self._send(args)
+        output = bytearray()
+        while not self._is_ready(output):
+            output += self._read()
+        # decode once at the end so multibyte characters split across reads are handled
+        return output.decode('utf-8').rstrip(' \t\n\r')[:-len(self.sentinel)]
+
+    def iter_json(self, *args: str) -> Iterator[dict[str, Any]]:
+        """
+        execute args (which should include -j) and yield each top-level JSON object as soon as it
+        has been read completely, rather than waiting for the whole array.  ExifTool closes every
+        top-level object with a "}" at the start of a line, which is what this looks for.
+        """
+        self._send(args)
+        buffer = bytearray()
+        start = 0  # beginning of data not yet handed out
+        ready = False
+        try:
+            while not ready:
+                scan_from = max(len(buffer) - 1, start)
+                buffer += self._read()
+                while (end := buffer.find(b'\n}', scan_from)) >= 0:
+                    begin = buffer.find(b'{', start, end)
+                    start = scan_from = end + 2
+                    try:
+                        with self.profiler.phase('json') if self.profiler else _no_phase:
+                            record = json.loads(bytes(buffer[begin:start]))
+                    except ValueError as e:
+                        raise RuntimeError('No files to parse or invalid data') from e
+                    yield record
+                ready = self._is_ready(buffer)
+                # drop data that has already been handed out
+                if start > self.read_size:
+                    del buffer[:start]
+                    start = 0
+        finally:
+            # keep the process usable if the caller stops early or an error occurs
+            while not ready:
+                try:
+                    buffer += self._read()
+                except RuntimeError:
+                    break
+                ready = self._is_ready(buffer)
+                del buffer[:-len(self.sentinel) - 16]
 
     def get_metadata(self, *args: str) -> list[dict[str, Any]]:
+        output = self.execute(*args)
         try:
-            return json.loads(self.execute(*args))
+            with self.profiler.phase('json') if self.profiler else _no_phase:
+                return json.loads(output)
         except ValueError as e:
             raise RuntimeError('No files to parse or invalid data') from e
 
+    def iter_metadata(
+        self,
+        files: Iterable[str],
+        *args: str,
+        batch_size: int = default_batch_size,
+    ) -> Iterator[dict[str, Any]]:
+        """
+        run ExifTool over files in batches of at most batch_size, yielding one record per file
+        as soon as ExifTool has written it.  At most one batch of output is held in memory at a time.
+        """
+        files = iter(files)
+        while True:
+            batch = list(itertools.islice(files, batch_size))
+            if not batch:
+                return
+            # files that cannot be read produce no object, so an empty batch yields nothing
+            yield from self.iter_json(*args, *batch)
+
+
+class ExifToolPool:
+    """several stay-open ExifTool processes that share out batches of files between them"""
+
+    def __init__(self, size: int, executable: str = exiftool_location, profiler: Profiler | None = None,
+                 nice: bool = False) -> None:
+        if size < 1:
+            raise ValueError('ExifToolPool size must be a positive integer')
+        self.size = size
+        self.executable = executable
+        self.profiler = profiler
+        self.nice = nice
+        self.workers: list[ExifTool] = []
+
+    def __enter__(self) -> ExifToolPool:
+        try:
+            for _ in range(self.size):
+                worker = ExifTool(self.executable, self.profiler, self.nice)
+                self.workers.append(worker.__enter__())
+        except BaseException:
+            self.__exit__(*sys.exc_info())
+            raise
+        return self
+
+    def __exit__(self, exc_type: type | None, exc_value: BaseException | None, traceback: Any) -> None:
+        # every worker is shut down even if another one fails to stop cleanly
+        workers, self.workers = self.workers, []
+        for worker in workers:
+            try:
+                worker.__exit__(exc_type, exc_value, traceback)
+            except Exception as e:
+                logger.debug(f'Error stopping ExifTool worker: {e}')
+
+    def iter_metadata(
+        self,
+        files: Iterable[str],
+        *args: str,
+        batch_size: int = default_batch_size,
+    ) -> Iterator[dict[str, Any]]:
+        """
+        same as ExifTool.iter_metadata, but batches are run concurrently on the pool's workers.
+        Records are yielded in the same order as files regardless of which worker finishes first,
+        and at most two batches per worker are in flight at any time.
+        """
+        idle: queue.Queue[ExifTool] = queue.Queue()
+        for worker in self.workers:
+            idle.put(worker)
+
+        def run(batch: list[str]) -> list[dict[str, Any]]:
+            worker = idle.get()
+            try:
+                return list(worker.iter_metadata(batch, *args, batch_size=len(batch)))
+            finally:
+                idle.put(worker)
+
+        files = iter(files)
+        pending: collections.deque[concurrent.futures.Future[list[dict[str, Any]]]] = collections.deque()
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.size) as pool:
+            try:
+                while True:
+                    while len(pending) < 2 * self.size:
+                        batch = list(itertools.islice(files, batch_size))
+                        if not batch:
+                            break
+                        pending.append(pool.submit(run, batch))
+                    if not pending:
+                        return
+                    yield from pending.popleft().result()
+            finally:
+                for future in pending:
+                    future.cancel()
+
+
+class MetadataCache:
+    """
+    on-disk (SQLite) cache of get_oldest_timestamp results.  Entries are keyed on the file path and
+    its size, modification time and inode, plus a settings string describing the tag selection, so
+    a file only needs ExifTool again if it changes or different tags are requested.
+    """
+
+    def __init__(self, path: str, settings: str, max_entries: int = default_cache_max_entries) -> None:
+        if max_entries < 1:
+            raise ValueError('max_entries must be a positive integer')
+        self.path = path
+        self.settings = settings
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+
+    def __enter__(self) -> MetadataCache:
+        Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+        self.connection = sqlite3.connect(self.path, check_same_thread=False)
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS timestamps ('
+            'path TEXT NOT NULL, settings TEXT NOT NULL, '
+            'size INTEGER NOT NULL, mtime_ns INTEGER NOT NULL, inode INTEGER NOT NULL, '
+            'date TEXT, keys TEXT NOT NULL, last_used REAL NOT NULL, '
+            'PRIMARY KEY (path, settings))')
+        self.connection.execute('CREATE INDEX IF NOT EXISTS timestamps_last_used ON timestamps (last_used)')
+        self.now = time.time()
+        return self
+
+    def __exit__(self, exc_type: type | None, exc_value: BaseException | None, traceback: Any) -> None:
+        try:
+            self.evict()
+            self.connection.commit()
+        finally:
+            self.connection.close()
+
+    def lookup(self, path: str, st: os.stat_result) -> tuple[str, datetime | None, list[str]] | None:
+        """return the cached (src_file, date, keys) for path, or None if it is missing or stale"""
+        row = self.connection.execute(
+            'SELECT date, keys FROM timestamps '
+            'WHERE path = ? AND settings = ? AND size = ? AND mtime_ns = ? AND inode = ?',
+            (path, self.settings, st.st_size, st.st_mtime_ns, st.st_ino)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.connection.execute('UPDATE timestamps SET last_used = ? WHERE path = ? AND settings = ?',
+                                (self.now, path, self.settings))
+        date = datetime.fromisoformat(row[0]) if row[0] is not None else None
+        return path, date, json.loads(row[1])
+
+    def store(self, path: str, st: os.stat_result, date: datetime | None, keys: list[str]) -> None:
+        self.connection.execute(
+            'INSERT OR REPLACE INTO timestamps VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+            (path, self.settings, st.st_size, st.st_mtime_ns, st.st_ino,
+             date.isoformat() if date is not None else None, json.dumps(keys), self.now))
+
+    def evict(self) -> None:
+        """drop the least recently used entries beyond max_entries"""
+        count = self.connection.execute('SELECT COUNT(*) FROM timestamps').fetchone()[0]
+        if count > self.max_entries:
+            self.connection.execute(
+                'DELETE FROM timestamps WHERE rowid IN '
+                '(SELECT rowid FROM timestamps ORDER BY last_used LIMIT ?)',
+                (count - self.max_entries,))
+            logger.debug(f'Evicted {count - self.max_entries} entries from metadata cache')
+
+
+def _hash_file(path: str, chunk_size: int = 1 << 20) -> str:
+    """sha256 of a file's contents"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while chunk := f.read(chunk_size):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ContentIndex:
+    """
+    persistent (SQLite) index of the files in dest_dir by size and content hash, used to find a file that
+    is already in the library under any name.  Hashes are only computed for files whose size matches a
+    file being looked up, and entries are checked against the file system whenever they are used, so the
+    index is built once and then kept up to date incrementally as files are transferred.  With read_only (for dry
+    runs) the index is read into memory, or built there if there is none, and nothing is written to disk.
+    """
+
+    def __init__(self, path: str, dest_dir: str, rebuild: bool = False, read_only: bool = False) -> None:
+        self.path = path
+        self.dest_dir = dest_dir
+        self.rebuild = rebuild
+        self.read_only = read_only
+        self.hashes_computed = 0
+        # files planned in this run but not transferred yet: size -> {dest: [src, hash or None]}
+        self.planned: dict[int, dict[str, list[Any]]] = {}
+        self._last_hash: tuple[str, str] | None = None
+
+    def __enter__(self) -> ContentIndex:
+        if self.read_only:
+            self.connection = sqlite3.connect(':memory:', check_same_thread=False)
+            if not self.rebuild and os.path.isfile(self.path):
+                with contextlib.closing(sqlite3.connect(f'{Path(self.path).absolute().as_uri()}?mode=ro',
+                                                        uri=True)) as saved:
+                    saved.backup(self.connection)
+        else:
+            Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+            self.connection = sqlite3.connect(self.path, check_same_thread=False)
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS files ('
+            'path TEXT PRIMARY KEY, size INTEGER NOT NULL, mtime_ns INTEGER NOT NULL, hash TEXT)')
+        self.connection.execute('CREATE INDEX IF NOT EXISTS files_size ON files (size)')
+        self.connection.execute('CREATE INDEX IF NOT EXISTS files_hash ON files (hash)')
+        empty = self.connection.execute('SELECT 1 FROM files LIMIT 1').fetchone() is None
+        if self.rebuild or empty:
+            self.scan()
+        return self
+
+    def __exit__(self, exc_type: type | None, exc_value: BaseException | None, traceback: Any) -> None:
+        try:
+            self.connection.commit()
+        finally:
+            self.connection.close()
+
+    def scan(self) -> None:
+        """record every (non-hidden) file under dest_dir, keeping the hashes of files that have not changed"""
+        logger.info(f'Indexing files in {self.dest_dir}...')
+        known = {path: (size, mtime_ns) for path, size, mtime_ns
+                 in self.connection.execute('SELECT path, size, mtime_ns FROM files')}
+        seen = set()
+        files = _scan_source_files(self.dest_dir, recursive=True) if os.path.isdir(self.dest_dir) else []
+        for dest_file in files:
+            try:
+                st = os.stat(dest_file)
+            except OSError:
+                continue
+            seen.add(dest_file)
+            if known.get(dest_file) != (st.st_size, st.st_mtime_ns):
+                self.add(dest_file, st)
+        self.connection.executemany('DELETE FROM files WHERE path = ?', ((p,) for p in known.keys() - seen))
+        self.connection.commit()
+
+    def add(self, dest_file: str, st: os.stat_result | None = None, digest: str | None = None) -> None:
+        """record (or refresh) a file in the library, optionally with its already known hash"""
+        if st is None:
+            st = os.stat(dest_file)
+        self.connection.execute('INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?)',
+                                (dest_file, st.st_size, st.st_mtime_ns, digest))
+
+    def plan(self, dest_file: str, src_file: str | _FileRecord, size: int) -> None:
+        """remember a file that will be transferred to dest_file later in this run"""
+        digest = self._last_hash[1] if self._last_hash and self._last_hash[0] == os.fspath(src_file) else None
+        self.planned.setdefault(size, {})[dest_file] = [src_file, digest]
+
+    def transferred(self, dest_file: str, digest: str | None = None) -> None:
+        """move a planned file into the index once it has arrived at dest_file, with its hash if already known"""
+        st = os.stat(dest_file)
+        src_file, planned_digest = self.planned.get(st.st_size, {}).pop(dest_file, (None, None))
+        self.add(dest_file, st, digest or planned_digest)
+
+    def _hash(self, path: str) -> str:
+        self.hashes_computed += 1
+        return _hash_file(path)
+
+    def find_duplicate(self, src_file: str, st: os.stat_result) -> str | None:
+        """return a file in (or planned for) the library with the same content as src_file, if any"""
+        rows = self.connection.execute('SELECT path, mtime_ns, hash FROM files WHERE size = ?',
+                                       (st.st_size,)).fetchall()
+        planned = self.planned.get(st.st_size, {})
+        if not rows and not planned:
+            return None  # no file of this size, so no need to read src_file at all
+
+        src_hash = self._hash(src_file)
+        self._last_hash = (src_file, src_hash)
+        for dest_file, mtime_ns, digest in rows:
+            try:
+                dest_st = os.stat(dest_file)
+            except OSError:
+                self.connection.execute('DELETE FROM files WHERE path = ?', (dest_file,))
+                continue
+            if os.path.samestat(st, dest_st):
+                continue  # src_file itself (inside dest_dir), whichever way the two paths are written
+            if dest_st.st_mtime_ns != mtime_ns or dest_st.st_size != st.st_size:
+                digest = None
+            if digest is None:
+                digest = self._hash(dest_file)
+                self.add(dest_file, dest_st, digest)
+            if digest == src_hash:
+                return dest_file
+        for dest_file, entry in planned.items():
+            if entry[1] is None:
+                # a move may already have taken the planned file to its destination
+                for path in (entry[0], dest_file):
+                    with contextlib.suppress(FileNotFoundError):
+                        entry[1] = self._hash(path)
+                        break
+            if entry[1] == src_hash:
+                return dest_file
+        return None
+
+
+_EPOCH = datetime(1970, 1, 1)
+_MICROSECOND = timedelta(microseconds=1)
+
+
+class _FileRecord:
+    """
+    what a run keeps of one file between reading its metadata and transferring it: the folder up to and including
+    its last separator (shared by every record of that folder), name, date as microseconds since 1970 (None
+    without one), index of the tags the date came from in _RecordTable.tag_sets, and once planned the destination
+    folder and name, split the same way.  Usable wherever a path is.
+    """
+
+    __slots__ = ('folder', 'name', 'stamp', 'tags', 'dest_folder', 'dest_name')
+
+    def __init__(self, folder: str, name: str, stamp: int | None, tags: int) -> None:
+        self.folder = folder
+        self.name = name
+        self.stamp = stamp
+        self.tags = tags
+        self.dest_folder = ''
+        self.dest_name = ''
+
+    @property
+    def path(self) -> str:
+        return self.folder + self.name
+
+    @property
+    def dest(self) -> str:
+        return self.dest_folder + self.dest_name
+
+    @property
+    def date(self) -> datetime | None:
+        return None if self.stamp is None else _EPOCH + self.stamp * _MICROSECOND
+
+    def __fspath__(self) -> str:
+        return self.path
+
+
+class _RecordTable:
+    """
+    packs (src_file, date, keys) from _extract_timestamps into _FileRecords as soon as they are parsed, so a run
+    over millions of files holds one small object per file instead of ExifTool records, datetimes and paths.
+    Folders and tag lists are interned, as most files share them with many others.
+    """
+
+    def __init__(self) -> None:
+        self.folders: dict[str, str] = {}
+        self.tag_sets: list[tuple[str, ...]] = []
+        self._tag_set_index: dict[tuple[str, ...], int] = {}
+
+    def pack(self, src_file: str, date: datetime | None, keys: Iterable[str]) -> _FileRecord:
+        # split by hand so path gives back src_file exactly, whichever separator ExifTool used
+        cut = max(src_file.rfind('/'), src_file.rfind(os.sep)) + 1
+        folder = self.folders.setdefault(src_file[:cut], src_file[:cut])
+        name = src_file[cut:]
+        keys = tuple(keys)
+        tags = self._tag_set_index.get(keys)
+        if tags is None:
+            tags = self._tag_set_index[keys] = len(self.tag_sets)
+            self.tag_sets.append(keys)
+        stamp = None if date is None else (date - _EPOCH) // _MICROSECOND
+        return _FileRecord(folder, name, stamp, tags)
+
+    def unpack(self, record: _FileRecord) -> tuple[str, datetime | None, tuple[str, ...]]:
+        return record.path, record.date, self.tag_sets[record.tags]
+
+
+def _consume(items: list[Any]) -> Iterator[Any]:
+    """iterate over items, releasing each one from the list once it has been reached"""
+    items.reverse()
+    while items:
+        yield items.pop()
+
+
+def _ignores_case(folder: str) -> bool:
+    """
+    whether the file system holding folder (which must exist) looks names up regardless of case, tried with a
+    name in it that has letters, or decided by platform when there is none
+    """
+    with os.scandir(folder) as it:
+        for entry in it:
+            swapped = entry.name.swapcase()
+            if swapped != entry.name and swapped.swapcase() == entry.name:
+                try:
+                    return os.path.samestat(entry.stat(follow_symlinks=False),
+                                            os.lstat(os.path.join(folder, swapped)))
+                except FileNotFoundError:
+                    return False
+    return sys.platform in ('darwin', 'win32')
+
+
+class _DestinationIndex:
+    """
+    in-memory view of the destination folders used in a run.  Each folder is read with a single scandir the
+    first time it is needed and created at most once, so collision checks cost no system calls per file.
+    Names are compared case-insensitively where the destination file system ignores case (checked once per
+    device), and exactly everywhere else.
+    """
+
+    def __init__(self) -> None:
+        # folder -> {name (casefolded where case is ignored): path to compare against ('' if it is not a regular
+        # file), or the record of the file planned to take that name in this run}
+        self.folders: dict[str, dict[str, str | _FileRecord]] = {}
+        # folder -> whether its names ignore case, and the same by device
+        self.fold: dict[str, bool] = {}
+        self.device_folds: dict[int, bool] = {}
+        # folder -> the folder with a trailing separator, shared by the records planned into it
+        self.prefixes: dict[str, str] = {}
+        self.created: set[str] = set()
+
+    def mkdir(self, folder: str) -> None:
+        if folder not in self.created:
+            os.makedirs(folder, exist_ok=True)
+            self.created.add(folder)
+
+    def _folds(self, folder: str) -> bool:
+        # a folder that does not exist yet will be on the device of its nearest existing parent
+        path = os.path.abspath(folder)
+        while not os.path.isdir(path) and os.path.dirname(path) != path:
+            path = os.path.dirname(path)
+        try:
+            dev = os.stat(path).st_dev
+            if dev not in self.device_folds:
+                self.device_folds[dev] = _ignores_case(path)
+            return self.device_folds[dev]
+        except OSError:
+            return sys.platform in ('darwin', 'win32')
+
+    def _key(self, folder: str, name: str) -> str:
+        return name.casefold() if self.fold[folder] else name
+
+    def _names(self, folder: str) -> dict[str, str | _FileRecord]:
+        names = self.folders.get(folder)
+        if names is None:
+            names = {}
+            fold = self.fold[folder] = self._folds(folder)
+            try:
+                with os.scandir(folder) as it:
+                    for entry in it:
+                        try:
+                            is_file = entry.is_file()
+                        except OSError:
+                            is_file = False
+                        names[entry.name.casefold() if fold else entry.name] = entry.path if is_file else ''
+            except FileNotFoundError:
+                pass
+            self.folders[folder] = names
+        return names
+
+    def find(self, dest_file: str) -> str | None:
+        """
+        None if dest_file is free, otherwise the file holding that name to compare contents against ('' if it is
+        not a regular file).  For files planned in this run that is the source until the transfer has happened.
+        """
+        folder, name = os.path.split(dest_file)
+        existing = self._names(folder).get(self._key(folder, name))
+        if isinstance(existing, _FileRecord):
+            src_file = existing.path
+            # a move may already have taken the planned file to its destination
+            return src_file if os.path.exists(src_file) or not os.path.exists(existing.dest) else existing.dest
+        return existing
+
+    def add(self, dest_file: str, record: _FileRecord) -> None:
+        """claim dest_file for the file of record, which becomes its destination"""
+        folder, name = os.path.split(dest_file)
+        prefix = self.prefixes.get(folder)
+        if prefix is None:
+            prefix = self.prefixes[folder] = os.path.join(folder, '')
+        record.dest_folder = prefix
+        record.dest_name = record.name if name == record.name else name
+        self._names(folder)[self._key(folder, name)] = record
+
+
+class TransferJournal:
+    """
+    append-only write-ahead journal of a run, one JSON object per line.  Each transfer is recorded as planned
+    (and synced to disk) before it starts and as done once it has finished, and files that were looked at but
+    left where they are are recorded as skipped.  A killed run can then be resumed: unfinished transfers are
+    replayed and files already in the journal are not read again.
+    """
+
+    # completed transfers are synced to disk after this many entries or seconds, whichever comes first
+    sync_entries = 1000
+    sync_seconds = 1.0
+
+    def __init__(self, path: str, resume: bool = False) -> None:
+        self.path = path
+        # src -> (dest, copy) for transfers that were planned but not recorded as done
+        self.unfinished: dict[str, tuple[str, bool]] = {}
+        # sources that need no further work
+        self.finished: set[str] = set()
+        torn = resume and self._load()
+        self.f = open(path, 'a' if resume else 'w', encoding='utf-8')
+        if torn:
+            self.f.write('\n')  # keep the next entry off the end of a torn line
+        self.unsynced = 0
+        self.last_sync = time.monotonic()
+
+    def _load(self) -> bool:
+        """read the journal, returning True if its last line is incomplete"""
+        try:
+            f = open(self.path, encoding='utf-8')
+        except FileNotFoundError:
+            return False
+        line = '\n'
+        with f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue  # torn write at the moment the run was killed
+                src = entry['src']
+                if entry['op'] == 'plan':
+                    self.unfinished[src] = (entry['dest'], entry['copy'])
+                else:
+                    self.unfinished.pop(src, None)
+                    self.finished.add(src)
+        return not line.endswith('\n')
+
+    def __enter__(self) -> 'TransferJournal':
+        return self
+
+    def __exit__(self, exc_type: Any, exc_value: Any, traceback: Any) -> None:
+        self.sync()
+        self.f.close()
+
+    def __contains__(self, src_file: str) -> bool:
+        return src_file in self.finished or src_file in self.unfinished
+
+    def _write(self, entry: dict[str, Any]) -> None:
+        self.f.write(json.dumps(entry) + '\n')
+        self.unsynced += 1
+        if self.unsynced >= self.sync_entries or time.monotonic() - self.last_sync >= self.sync_seconds:
+            self.sync()
+
+    def sync(self) -> None:
+        self.f.flush()
+        os.fsync(self.f.fileno())
+        self.unsynced = 0
+        self.last_sync = time.monotonic()
+
+    def plan(self, src_file: str, dest_file: str, copy: bool) -> None:
+        self._write({'op': 'plan', 'src': src_file, 'dest': dest_file, 'copy': copy})
+        self.unfinished[src_file] = (dest_file, copy)
+
+    def done(self, src_file: str, dest_file: str) -> None:
+        self._write({'op': 'done', 'src': src_file, 'dest': dest_file})
+        self.unfinished.pop(src_file, None)
+        self.finished.add(src_file)
+
+    def skip(self, src_file: str) -> None:
+        self._write({'op': 'skip', 'src': src_file})
+        self.finished.add(src_file)
+
+
+def _remove_partial_copies(dest: str) -> None:
+    """delete the temporary files (see _transfer_file) of copies to dest that a killed run left behind"""
+    folder, name = os.path.split(dest)
+    partial = re.compile(re.escape(f'.{name}.') + r'[a-z0-9_]{8}\.part')
+    with contextlib.suppress(FileNotFoundError), os.scandir(folder or '.') as entries:
+        for entry in entries:
+            if partial.fullmatch(entry.name):
+                with contextlib.suppress(FileNotFoundError):
+                    os.remove(entry.path)
+
+
+def _replay_journal(journal: TransferJournal, stats: dict[str, int], hardlink: bool = False,
+                    transfer_file: Callable[..., tuple[str, str, str | None, str | None]] = _transfer_file,
+                    verifier: CopyVerifier | None = None, index: ContentIndex | None = None) -> None:
+    """
+    finish the transfers a previous run planned but did not record as done, with the run's transfer_file (so
+    throttled and verified like the others), recording the files that arrive in index.  A dest taken by a
+    different file is an error and left alone, and the temporary files of copies cut short are deleted.
+    """
+    if journal.unfinished:
+        logger.info(f'Resuming {len(journal.unfinished)} unfinished transfers from {journal.path}.')
+    for src, (dest, copy) in list(journal.unfinished.items()):
+        digest = None
+        with contextlib.suppress(OSError):
+            _remove_partial_copies(dest)
+        if not os.path.exists(src):
+            if os.path.exists(dest):
+                # moved just before the run was killed
+                if index is not None:
+                    index.transferred(dest)
+                journal.done(src, dest)
+                stats['resumed'] += 1
+            else:
+                logger.error(f'Error resuming {src} -> {dest}: source no longer exists')
+                stats['errors'] += 1
+            continue
+        try:
+            if os.path.lexists(dest):
+                if not (os.path.isfile(dest) and filecmp.cmp(src, dest, shallow=False)):
+                    raise OSError('destination already exists')
+                # the copy finished, but a move may not have removed the source yet
+                if not copy:
+                    os.remove(src)
+            else:
+                os.makedirs(os.path.dirname(dest), exist_ok=True)
+                error = transfer_file(src, dest, copy, hardlink)[2]
+                if verifier is not None:
+                    digest = verifier.digests.pop(dest, None)
+                if error:
+                    raise OSError(error)
+            if index is not None:
+                index.transferred(dest, digest)
+        except OSError as e:
+            logger.error(f'Error resuming {src} -> {dest}: {e}')
+            stats['errors'] += 1
+            continue
+        journal.done(src, dest)
+        stats['resumed'] += 1
+
+
+class TransferPlan:
+    """
+    the outcome of a dry run, written one JSON object per line (gzip-compressed if the file name ends in .gz)
+    so it can be reviewed and then carried out by applyPlan without reading any metadata again.  A header line
+    is followed by one entry per file: its source, destination and action (move, copy, duplicate of an existing
+    file, or skip when no date was found), the date and tags it was sorted by, and the size and modification
+    time of the source.  Paths are stored relative to src_dir and dest_dir, so a plan can be applied on a host
+    where the same trees are mounted elsewhere.
+    """
+
+    version = 1
+
+    def __init__(self, path: str, src_dir: str, dest_dir: str) -> None:
+        self.path = path
+        self.src_dir = os.path.abspath(src_dir)
+        self.dest_dir = os.path.abspath(dest_dir)
+
+    @staticmethod
+    def _open(path: str, mode: str) -> Any:
+        if path.endswith('.gz'):
+            return gzip.open(path, mode + 't', encoding='utf-8')
+        return open(path, mode, encoding='utf-8')
+
+    def __enter__(self) -> TransferPlan:
+        self.f = self._open(self.path, 'w')
+        self._write({'sortphotos_plan': self.version, 'src_dir': self.src_dir, 'dest_dir': self.dest_dir})
+        return self
+
+    def __exit__(self, exc_type: Any, exc_value: Any, traceback: Any) -> None:
+        self.f.close()
+
+    def _write(self, entry: dict[str, Any]) -> None:
+        self.f.write(json.dumps(entry, separators=(',', ':')) + '\n')
+
+    def add(self, src_file: str, dest_file: str | None, action: str, date: datetime | None = None,
+            keys: list[str] | None = None) -> None:
+        entry: dict[str, Any] = {'src': os.path.relpath(src_file, self.src_dir), 'action': action}
+        if dest_file is not None:
+            entry['dest'] = os.path.relpath(dest_file, self.dest_dir)
+        if date is not None:
+            entry['date'] = date.isoformat()
+            entry['keys'] = keys
+        if action in ('move', 'copy'):
+            st = os.stat(src_file)
+            entry['size'] = st.st_size
+            entry['mtime_ns'] = st.st_mtime_ns
+        self._write(entry)
+
+    @classmethod
+    def read(cls, path: str) -> tuple[dict[str, Any], Iterator[dict[str, Any]]]:
+        """the header of the plan at path, and an iterator over its entries"""
+        f = cls._open(path, 'r')
+        try:
+            header = json.loads(f.readline())
+            if header.get('sortphotos_plan') != cls.version:
+                raise ValueError
+        except (ValueError, AttributeError):
+            f.close()
+            raise ValueError(f'{path} is not a sortphotos plan') from None
+
+        def entries() -> Iterator[dict[str, Any]]:
+            with f:
+                for line in f:
+                    yield json.loads(line)
+
+        return header, entries()
+
+
+def _prefetch(items: Iterable[Any], maxsize: int) -> Iterator[Any]:
+    """
+    iterate items on a background thread, running up to maxsize items ahead of the consumer so producing them
+    overlaps with whatever is done with each one.  Exceptions are re-raised in the consumer, and closing the
+    iterator stops the thread (and closes items, if it is a generator) before returning.
+    """
+    buffer: queue.Queue[tuple[Any, BaseException | None]] = queue.Queue(maxsize)
+    stop = threading.Event()
+    end = object()
+
+    def put(item: Any, error: BaseException | None = None) -> bool:
+        while not stop.is_set():
+            try:
+                buffer.put((item, error), timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def produce() -> None:
+        iterator = iter(items)
+        try:
+            for item in iterator:
+                if not put(item):
+                    break
+            else:
+                put(end)
+        except BaseException as e:
+            put(end, e)
+        finally:
+            if hasattr(iterator, 'close'):
+                iterator.close()
+
+    thread = threading.Thread(target=produce, daemon=True)
+    thread.start()
+    try:
+        while True:
+            item, error = buffer.get()
+            if error is not None:
+                raise error
+            if item is end:
+                return
+            yield item
+    finally:
+        stop.set()
+        thread.join()
+
+
+class _TransferQueue:
+    """
+    transfers fed in while planning goes on, scheduled by _schedule_transfers on a background thread with the same
+    per-device limits as _transfer_all.  At most maxsize transfers wait to be taken and maxsize are in flight, so
+    put blocks when planning gets ahead of the disks.  Results are collected with completed and finish.
+    """
+
+    def __init__(self, jobs: int, copy: bool, hardlink: bool, maxsize: int = default_transfer_window,
+                 transfer_file: Callable[..., tuple[str, str, str | None, str | None]] = _transfer_file,
+                 source_jobs: int | None = None, rotational: Iterable[str] = (),
+                 solid_state: Iterable[str] = ()) -> None:
+        self.copy = copy
+        self.todo: queue.Queue[tuple[str, str] | None] = queue.Queue(maxsize)
+        self.results: queue.Queue[tuple[str, str, str | None, str | None]] = queue.Queue()
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._scheduler: asyncio.Task[None] | None = None
+        self._started = threading.Event()
+        schedule = _schedule_transfers(self._transfers(), lambda *result: self.results.put(result), jobs,
+                                       source_jobs or jobs, hardlink, transfer_file, maxsize,
+                                       _rotational_overrides(rotational, solid_state))
+        self.thread = threading.Thread(target=self._run, args=(schedule,), daemon=True)
+        self.thread.start()
+        self._started.wait()
+
+    def _run(self, schedule: Any) -> None:
+        async def run() -> None:
+            self._loop = asyncio.get_running_loop()
+            self._scheduler = asyncio.current_task()
+            self._started.set()
+            with contextlib.suppress(asyncio.CancelledError):
+                await schedule
+
+        asyncio.run(run())
+
+    async def _transfers(self) -> Any:
+        loop = asyncio.get_running_loop()
+        # wait for the planner on another thread, so transfers already taken keep running
+        while (item := await loop.run_in_executor(None, self.todo.get)) is not None:
+            yield (*item, self.copy)
+
+    def put(self, src_file: str, dest_file: str) -> None:
+        self.todo.put((src_file, dest_file))
+
+    def completed(self) -> Iterator[tuple[str, str, str | None, str | None]]:
+        """results of the transfers that have finished so far"""
+        while True:
+            try:
+                yield self.results.get_nowait()
+            except queue.Empty:
+                return
+
+    def finish(self) -> Iterator[tuple[str, str, str | None, str | None]]:
+        """wait for every transfer, yielding the results not collected yet"""
+        self.todo.put(None)
+        while self.thread.is_alive():
+            try:
+                yield self.results.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        yield from self.completed()
+
+    def cancel(self) -> None:
+        """drop the transfers that have not started and stop once the running ones are done"""
+        if not self.thread.is_alive():
+            return
+        with contextlib.suppress(queue.Empty):
+            while True:
+                self.todo.get_nowait()
+        assert self._loop is not None and self._scheduler is not None
+        with contextlib.suppress(RuntimeError):  # the loop has just finished
+            self._loop.call_soon_threadsafe(self._scheduler.cancel)
+        self.todo.put(None)  # in case the scheduler is waiting for the next transfer
+        self.thread.join()
+
+
+def _device_of(folder: str) -> int:
+    """the device a folder is on, or -1 if it cannot be found"""
+    try:
+        return os.stat(folder).st_dev
+    except OSError:
+        return -1
+
+
+@functools.lru_cache(maxsize=None)
+def _is_rotational(dev: int) -> bool | None:
+    """
+    whether the block device dev is a spinning disk, from /sys/dev/block on Linux (USB card readers usually report
+    themselves as rotational too).  None if it is not known, as for network and virtual file systems
+    """
+    if not sys.platform.startswith('linux') or dev < 0 or os.major(dev) == 0:
+        return None
+    path = os.path.realpath(f'/sys/dev/block/{os.major(dev)}:{os.minor(dev)}')
+    # a partition has no queue of its own, its disk's is one level up
+    for folder in (path, os.path.dirname(path)):
+        try:
+            with open(os.path.join(folder, 'queue', 'rotational')) as f:
+                return f.read().strip() == '1'
+        except OSError:
+            continue
+    return None
+
+
+async def _schedule_transfers(
+    transfers: Iterable[tuple[str, str, bool]] | AsyncIterable[tuple[str, str, bool]],
+    finished: Callable[[str, str, str | None, str | None], None],
+    jobs: int,
+    source_jobs: int,
+    hardlink: bool,
+    transfer_file: Callable[..., tuple[str, str, str | None, str | None]],
+    window: int,
+    rotational: Callable[[int], bool | None] = _is_rotational,
+) -> None:
+    """
+    run (src, dest, copy) transfers with at most jobs at once per destination device and source_jobs at once per
+    source device, so a slow device only holds up the transfers that involve it.  Devices for which rotational
+    is true take one transfer at a time, as parallel copies make a spinning disk seek back and forth.  Each
+    destination device gets its own worker threads.  At most window transfers are in flight (running or waiting
+    for their devices); beyond that no more are taken from transfers, which may be asynchronous so the next one can
+    be awaited while others run.  finished gets each result on the event
+    loop's thread.  If this is cancelled or finished raises, transfers that have not started are dropped and the
+    running ones are allowed to complete (and reported) first, so no file is left half written.
+    """
+    loop = asyncio.get_running_loop()
+    devices: dict[str, int] = {}
+    source_limits: dict[int, asyncio.Semaphore] = {}
+    dest_limits: dict[int, asyncio.Semaphore] = {}
+    pools: dict[int, concurrent.futures.ThreadPoolExecutor] = {}
+    in_flight = asyncio.Semaphore(window)
+    waiting: set[asyncio.Task[None]] = set()
+    running: set[asyncio.Task[None]] = set()
+    failures: list[BaseException] = []
+
+    def device(path: str) -> int:
+        folder = os.path.dirname(path)
+        dev = devices.get(folder)
+        if dev is None:
+            dev = devices[folder] = _device_of(folder)
+        return dev
+
+    def limit(dev: int, folder: str, default: int) -> int:
+        if default > 1 and rotational(dev):
+            logger.info(f'{folder} is on a rotational disk, transferring one file at a time there.')
+            return 1
+        return default
+
+    async def transfer(src: str, dest: str, copy: bool, source_limit: asyncio.Semaphore,
+                       dest_limit: asyncio.Semaphore, pool: concurrent.futures.Executor) -> None:
+        task = asyncio.current_task()
+        try:
+            async with source_limit, dest_limit:
+                waiting.discard(task)  # type: ignore[arg-type]
+                try:
+                    result = await loop.run_in_executor(pool, transfer_file, src, dest, copy, hardlink)
+                except Exception as e:
+                    result = (src, dest, str(e), None)
+                finished(*result)
+        finally:
+            in_flight.release()
+
+    def done(task: asyncio.Task[None]) -> None:
+        running.discard(task)
+        waiting.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            failures.append(task.exception())  # type: ignore[arg-type]
+
+    async def items() -> AsyncIterator[tuple[str, str, bool]]:
+        if isinstance(transfers, AsyncIterable):
+            async for item in transfers:
+                yield item
+        else:
+            for item in transfers:
+                yield item
+
+    try:
+        async for src, dest, copy in items():
+            await in_flight.acquire()
+            if failures:
+                break
+            source_dev, dest_dev = device(src), device(dest)
+            if dest_dev not in pools:
+                dest_jobs = limit(dest_dev, os.path.dirname(dest), jobs)
+                dest_limits[dest_dev] = asyncio.Semaphore(dest_jobs)
+                pools[dest_dev] = concurrent.futures.ThreadPoolExecutor(max_workers=dest_jobs)
+            if source_dev not in source_limits:
+                source_limits[source_dev] = asyncio.Semaphore(limit(source_dev, os.path.dirname(src), source_jobs))
+            source_limit = source_limits[source_dev]
+            task = loop.create_task(transfer(src, dest, copy, source_limit, dest_limits[dest_dev], pools[dest_dev]))
+            running.add(task)
+            waiting.add(task)
+            task.add_done_callback(done)
+        while running and not failures:
+            await asyncio.wait(running, return_when=asyncio.FIRST_EXCEPTION)
+    finally:
+        for task in waiting:
+            task.cancel()
+        while running:
+            await asyncio.wait(running)
+        for pool in pools.values():
+            pool.shutdown()
+    if failures:
+        raise failures[0]
+
+
+def _transfer_all(
+    transfers: Iterable[tuple[str, str, bool]],
+    finished: Callable[[str, str, str | None, str | None], None],
+    jobs: int,
+    source_jobs: int | None = None,
+    hardlink: bool = False,
+    transfer_file: Callable[..., tuple[str, str, str | None, str | None]] = _transfer_file,
+    window: int = default_transfer_window,
+    rotational: Iterable[str] = (),
+    solid_state: Iterable[str] = (),
+) -> None:
+    """
+    carry out transfers with _schedule_transfers (source_jobs defaults to jobs).  The devices holding the
+    folders in rotational and solid_state are taken to be spinning disks and SSDs whatever /sys says.  On Ctrl-C
+    the running transfers are completed before KeyboardInterrupt is raised.
+    """
+    asyncio.run(_schedule_transfers(transfers, finished, jobs, source_jobs or jobs, hardlink, transfer_file, window,
+                                    _rotational_overrides(rotational, solid_state)))
+
+
+def _rotational_overrides(rotational: Iterable[str], solid_state: Iterable[str]) -> Callable[[int], bool | None]:
+    """_is_rotational, except that the devices holding the folders given are spinning disks or SSDs"""
+    overrides = {_device_of(folder): True for folder in rotational}
+    overrides.update((_device_of(folder), False) for folder in solid_state)
+
+    def is_rotational(dev: int) -> bool | None:
+        return overrides[dev] if dev in overrides else _is_rotational(dev)
+
+    return is_rotational
+
+
+def _extract_timestamps(
+    files: Iterable[str],
+    args: list[str],
+    batch_size: int,
+    policy: TagPolicy,
+    exif_jobs: int = 1,
+    cache: MetadataCache | None = None,
+    native_exif: bool = False,
+    primary_args: list[str] | None = None,
+    exiftool: ExifTool | ExifToolPool | None = None,
+    profiler: Profiler | None = None,
+    nice: bool = False,
+) -> Iterator[tuple[str, datetime | None, list[str]]]:
+    """
+    stream (src_file, date, keys) for files through ExifTool process(es) that live as long as the
+    iteration, or through exiftool if one that is already running is given.  With a cache (opened here
+    for the same lifetime), files whose stat signature is unchanged are answered from the cache.  With
+    native_exif, JPEG/TIFF files with a date that read_exif_dates can read fully skip ExifTool.  With
+    primary_args, ExifTool first reads the files with those and files without a date from them get a second
+    pass with args; a date from the first pass is final, so primary_args must read every tag args could supply
+    a date from (only faster).  ExifTool is only started once a file actually needs it, with profiler if given, and at low
+    priority with nice.
+    """
+    with contextlib.ExitStack() as stack:
+        if cache is not None:
+            stack.enter_context(cache)
+
+        def metadata(batch: Iterable[str], exif_args: list[str] = args) -> Iterator[dict[str, Any]]:
+            nonlocal exiftool
+            if exiftool is None:
+                exiftool = stack.enter_context(ExifToolPool(exif_jobs, profiler=profiler, nice=nice) if exif_jobs > 1
+                                               else ExifTool(profiler=profiler, nice=nice))
+            return exiftool.iter_metadata(batch, *exif_args, batch_size=batch_size)
+
+        if cache is None and not native_exif and primary_args is None:
+            for data in metadata(files):
+                yield policy.oldest_timestamp(data)
+            return
+
+        file_dates = 'File' not in policy.ignore_groups
+
+        # look files up a chunk at a time, enough to keep every ExifTool process busy with the misses
+        files = iter(files)
+        while chunk := list(itertools.islice(files, batch_size * exif_jobs * 2)):
+            misses: dict[str, os.stat_result] = {}
+            for src_file in chunk:
+                try:
+                    st = os.stat(src_file)
+                except OSError:
+                    continue
+                hit = cache.lookup(src_file, st) if cache is not None else None
+                if hit is None and native_exif:
+                    data = read_exif_dates(src_file, st, file_dates)
+                    # without any date, ExifTool gets a chance to find one elsewhere in the file
+                    if data is not None and (result := policy.oldest_timestamp(data))[1] is not None:
+                        hit = result
+                        if cache is not None:
+                            cache.store(src_file, st, result[1], result[2])
+                if hit is None:
+                    misses[src_file] = st
+                else:
+                    yield hit
+
+            # files still without a date after the primary tags get the full set
+            remaining = list(misses)
+            if primary_args is not None and remaining:
+                remaining = []
+                for data in metadata(list(misses), primary_args):
+                    src_file, date, keys = policy.oldest_timestamp(data)
+                    if date is None:
+                        remaining.append(src_file)
+                        continue
+                    if cache is not None and src_file in misses:
+                        cache.store(src_file, misses[src_file], date, keys)
+                    yield src_file, date, keys
+
+            if remaining:
+                for data in metadata(remaining):
+                    src_file, date, keys = policy.oldest_timestamp(data)
+                    if cache is not None and src_file in misses:
+                        cache.store(src_file, misses[src_file], date, keys)
+                    yield src_file, date, keys
+            if cache is not None:
+                cache.connection.commit()
+
 
 # ---------------------------------------
 
 
 
+def _source_roots(src_dir: str | Sequence[str], recursive: bool) -> list[str]:
+    """
+    the source directories of a run, without repeats and, when recursive, without folders inside another one, so
+    no file is read twice
+    """
+    roots: list[str] = []
+    seen: set[str] = set()
+    for folder in [src_dir] if isinstance(src_dir, str) else src_dir:
+        if not Path(folder).exists():
+            raise Exception(f'Source directory does not exist: {folder}')
+        real = os.path.realpath(folder)
+        if real not in seen:
+            seen.add(real)
+            roots.append(folder)
+    if recursive:
+        real_roots = {folder: os.path.join(os.path.realpath(folder), '') for folder in roots}
+        roots = [folder for folder in roots
+                 if not any(real_roots[folder].startswith(other) and real_roots[folder] != other
+                            for other in real_roots.values())]
+    return roots
+
+
 def sortPhotos(
-    src_dir: str,
+    src_dir: str | Sequence[str],
     dest_dir: str,
     sort_format: str,
     rename_format: str | None,
@@ -262,14 +2386,46 @@ def sortPhotos(
     keep_filename: bool = False,
     exclude_patterns: list[str] | None = None,
     jobs: int = 1,
-) -> dict[str, int]:
+    batch_size: int | None = None,
+    exif_jobs: int = 1,
+    cache_file: str | None = None,
+    cache_max_entries: int = default_cache_max_entries,
+    prefilter: bool = False,
+    extensions: list[str] | None = None,
+    exclude_extensions: list[str] | None = None,
+    native_exif: bool = False,
+    primary_tags: list[str] | None = None,
+    primary_fast: int = 2,
+    content_index: str | None = None,
+    rebuild_content_index: bool = False,
+    files: Iterable[str] | None = None,
+    exiftool: ExifTool | ExifToolPool | None = None,
+    journal: str | None = None,
+    resume: bool = False,
+    hardlink: bool = False,
+    pipeline: bool = False,
+    profile: str | None = None,
+    plan_out: str | None = None,
+    source_jobs: int | None = None,
+    rotational: list[str] | None = None,
+    solid_state: list[str] | None = None,
+    transfer_order: str | None = None,
+    max_bandwidth: float | None = None,
+    max_files_per_sec: float | None = None,
+    throttle_file: str | None = None,
+    exif_nice: bool = False,
+    verify: str | None = None,
+    verify_retries: int = default_verify_retries,
+) -> dict[str, Any]:
     """
     This function is a convenience wrapper around ExifTool based on common usage scenarios for sortphotos.py
 
     Parameters
     ---------------
-    src_dir : str
-        directory containing files you want to process
+    src_dir : str | Sequence[str]
+        directory containing files you want to process, or several.  Files from several directories are sorted in
+        one run, sharing one ExifTool session, one view of dest_dir and one set of transfers, so duplicates and
+        name collisions between them are resolved as if they were in one directory
     dest_dir : str
         directory where you want to move/copy the files to
     sort_format : str
@@ -303,11 +2459,102 @@ def sortPhotos(
     exclude_patterns : list[str]
         glob patterns for files to exclude (e.g., ['*.raw', 'backup/*'])
     jobs : int
-        number of parallel workers for file operations (default: 1 for serial)
+        number of parallel workers for file operations (default: 1 for serial).  Without pipeline, each
+        destination device gets this many, so transfers to a fast disk are not held up by a slow one, and
+        spinning disks (see rotational) take one transfer at a time
+    batch_size : int
+        if given, stream metadata from ExifTool in batches of this many files so processing starts
+        immediately and memory use does not grow with the size of src_dir.  None reads everything at once
+    exif_jobs : int
+        number of ExifTool processes used to extract metadata in parallel (default: 1).  Values above 1
+        imply streaming, using batch_size (or a default batch size) to share files between the processes
+    cache_file : str
+        path of a SQLite database caching the date found for each file.  Files whose size, modification
+        time and inode are unchanged since an earlier run with the same tag settings skip ExifTool.
+        Implies streaming.  None disables the cache
+    cache_max_entries : int
+        number of files kept in cache_file; the least recently used entries beyond this are evicted
+    prefilter : bool
+        True to walk src_dir in Python and apply hidden-file, exclude_patterns and extension filters before
+        ExifTool reads anything, pruning hidden and excluded directories.  Always done when streaming
+    extensions : list[str]
+        only process files with these extensions (e.g., ['jpg', 'mov']).  Implies prefilter
+    exclude_extensions : list[str]
+        never process files with these extensions (e.g., ['thm', 'db']).  Implies prefilter
+    native_exif : bool
+        True to read the EXIF dates of plain JPEG/TIFF files directly in Python, handing only files it cannot
+        fully interpret to ExifTool.  Maker note dates are not considered.  Not used together with
+        use_only_groups/use_only_tags, or on non-Linux systems unless the File group is ignored.  Implies streaming
+    primary_tags : list[str]
+        enable tiered extraction: ExifTool first reads use_only_tags with -fast, and only files without a date
+        from them are read again in full.  Only used when use_only_tags names nothing but these tags, since
+        otherwise a tag outside them could hold an older date and every file would need the full read anyway.
+        None reads all tags at once.  Implies streaming
+    primary_fast : int
+        ExifTool -fast level (1-2) used for the primary pass (default: 2, which also skips maker notes and stops
+        at the media data of QuickTime files, so keep to tags stored before it).  0 turns the primary pass off
+    content_index : str
+        path of a SQLite index of the contents of dest_dir, or '' for dest_dir/.sortphotos-index.sqlite.  With
+        remove_duplicates, files whose content is already anywhere in dest_dir are skipped.  None disables it
+    rebuild_content_index : bool
+        True to rescan dest_dir for content_index rather than only updating it incrementally
+    files : Iterable[str]
+        process these files instead of searching src_dir.  They are filtered by extension as a search would
+        filter them (see _scan_source_files).  Implies streaming
+    exiftool : ExifTool | ExifToolPool
+        an already running ExifTool (or pool) to use instead of starting a new one.  Implies streaming
+    journal : str
+        path of a journal recording every planned and completed transfer, so an interrupted run can be
+        resumed.  Not written in test mode.  None disables it
+    resume : bool
+        True to continue the run recorded in journal: its unfinished transfers are completed first, and files
+        it already moved, copied or skipped are not read again.  Implies streaming
+    hardlink : bool
+        with copy_files, hard link files into dest_dir instead of copying them where both are on the same file
+        system.  The source and destination are then the same file, so changing one changes the other
+    pipeline : bool
+        True to run metadata extraction, planning and file transfers at the same time, connected by bounded
+        queues, so files are transferred while later ones are still being read.  Uses jobs transfer workers.
+        Implies streaming
+    profile : str
+        record the wall and CPU time of each phase (scan, extract, json, timestamps, plan, transfer), per-file
+        latencies, transfer throughput and peak memory.  The report is logged after the summary, returned in
+        the statistics under 'profile' and, unless profile is '', written to this path as JSON.  None disables it
+    plan_out : str
+        write what would be done with every file to this path (see TransferPlan) instead of moving or copying
+        anything, to be reviewed and carried out later with applyPlan.  Implies test
+    source_jobs : int
+        with jobs above 1 (and without pipeline), the number of files read from each source device at once
+        (default: jobs).  Set it below jobs to stop a slow card reader from taking every worker of a destination
+    rotational, solid_state : list[str]
+        folders whose devices are to be treated as spinning disks (one transfer at a time) or as SSDs (jobs at
+        once).  Other devices are looked up in /sys on Linux, and treated as SSDs when that is not possible
+    transfer_order : str
+        'inode' to transfer files in order of their inode numbers, or 'extent' in order of where their data is
+        on disk (FIEMAP, Linux; inode order where it is not available), so a spinning source disk reads them
+        front to back rather than seeking around.  With pipeline, only each group handed to the workers is
+        ordered.  None keeps the order ExifTool reported them in
+    max_bandwidth : float
+        most bytes per second to move or copy (renames within a file system and hard links do not count).
+        Copies are paced a chunk at a time, so the rate is steady rather than bursty.  None for no limit
+    max_files_per_sec : float
+        most files per second to transfer.  None for no limit
+    throttle_file : str
+        a file that can change max_bandwidth and max_files_per_sec during the run (see Throttle), read again
+        when it changes and on SIGUSR1
+    exif_nice : bool
+        True to run ExifTool at the lowest CPU and disk priority (nice/ionice where available)
+    verify : str
+        check every file whose data is copied (see CopyVerifier): 'readback' to read the copy back and compare
+        hashes, 'fsync' to trust a successful fsync and compare sizes.  Reflinks are not used then.  With a
+        content index, the hashes are recorded in it and used by duplicate checks instead of reading files again.
+        None copies without checking
+    verify_retries : int
+        times a copy that fails verification (or an I/O error) is tried again before it counts as an error
 
     Returns
     -------
-    dict[str, int]
+    dict[str, Any]
         Statistics about the operation (files processed, skipped, errors, etc.)
     """
 
@@ -317,8 +2564,7 @@ def sortPhotos(
         additional_tags_to_ignore = []
 
     # some error checking
-    if not Path(src_dir).exists():
-        raise Exception('Source directory does not exist')
+    src_dirs = _source_roots(src_dir, recursive)
 
     # setup arguments to exiftool
     args = ['-j', '-a', '-G']
@@ -339,191 +2585,408 @@ def sortPhotos(
         args += ['-time:all']
 
 
-    if recursive:
-        args += ['-r']
-
-    args += [src_dir]
+    # which tags may supply each file's date
+    policy = TagPolicy(additional_groups_to_ignore, additional_tags_to_ignore)
+
+    throttle = None
+    transfer_file: Callable[..., tuple[str, str, str | None, str | None]] = _transfer_file
+    if max_bandwidth is not None or max_files_per_sec is not None or throttle_file is not None:
+        throttle = Throttle(max_bandwidth, max_files_per_sec, throttle_file)
+    verifier = CopyVerifier(verify, verify_retries) if verify is not None else None
+    if throttle is not None or verifier is not None:
+        transfer_file = functools.partial(_transfer_file, throttle=throttle, verifier=verifier)
+
+    profiler = None
+    if profile is not None:
+        profiler = Profiler()
+        policy.oldest_timestamp = profiler.wrap('timestamps', policy.oldest_timestamp)  # type: ignore[method-assign]
+        transfer_file = profiler.transfer(transfer_file)
+
+    if batch_size is not None and batch_size < 1:
+        raise ValueError('batch_size must be a positive integer')
+    if exif_jobs < 1:
+        raise ValueError('exif_jobs must be a positive integer')
+    if source_jobs is not None and source_jobs < 1:
+        raise ValueError('source_jobs must be a positive integer')
+    if transfer_order is not None and transfer_order not in transfer_orders:
+        raise ValueError(f'transfer_order must be one of {", ".join(transfer_orders)}')
+    if native_exif and (use_only_tags is not None or use_only_groups is not None):
+        logger.info('Native EXIF reader is not used with --use-only-groups/--use-only-tags.')
+        native_exif = False
+    if native_exif and 'File' not in additional_groups_to_ignore and not sys.platform.startswith('linux'):
+        logger.info('Native EXIF reader can only reproduce File dates on Linux; ignore the File group to use it.')
+        native_exif = False
+    if primary_tags is not None:
+        # a date from the primary pass is only final if a full read could not find an older one, which holds when
+        # every tag that may supply a date is a primary tag.  Otherwise each file would need the full read anyway
+        primary = {tag.lower() for tag in primary_tags}
+        if use_only_tags is None or not {tag.lower() for tag in use_only_tags} <= primary:
+            logger.warning('Tiered extraction needs --use-only-tags naming only primary tags, as any other tag could '
+                           'hold an older date; reading all time tags at once (--native-exif is exact for JPEG/TIFF).')
+            primary_tags = None
+    if primary_fast not in (0, 1, 2):
+        raise ValueError('primary_fast must be 0, 1 or 2')
+    if resume and journal is None:
+        raise ValueError('resume requires a journal')
+    if plan_out is not None:
+        test = True
+    if test and journal is not None:
+        logger.info('The journal is not used in test mode.')
+        journal, resume = None, False
+    if (exif_jobs > 1 or cache_file is not None or native_exif or primary_tags is not None
+            or files is not None or exiftool is not None or resume or pipeline) and batch_size is None:
+        batch_size = default_batch_size
 
     # statistics tracking
-    stats: dict[str, int] = {
+    stats: dict[str, Any] = {
         'processed': 0,
         'skipped_no_date': 0,
         'skipped_hidden': 0,
         'skipped_duplicate': 0,
         'skipped_excluded': 0,
         'renamed_collision': 0,
+        'resumed': 0,
         'errors': 0,
     }
 
-    # get all metadata
-    with ExifTool() as e:
-        logger.info('Preprocessing with ExifTool.  May take a while for a large number of files.')
-        sys.stdout.flush()
-        metadata = e.get_metadata(*args)
-
-    # setup output to screen
-    num_files = len(metadata)
-
-    if test:
-        test_file_dict: dict[str, str] = {}
-
-    # collect pending file transfers for parallel execution
-    pending_transfers: list[tuple[str, str]] = []
-
-    # determine if we should show progress bar
-    show_progress = logger.getEffectiveLevel() >= logging.INFO and num_files > 0
-    try:
-        from tqdm import tqdm
-        progress = tqdm(total=num_files, disable=not show_progress, unit='file')
-    except ImportError:
-        progress = None
-
-    # parse output extracting oldest relevant date
-    for idx, data in enumerate(metadata):
-
-        # extract timestamp date for photo
-        src_file, date, keys = get_oldest_timestamp(data, additional_groups_to_ignore, additional_tags_to_ignore)
-
-        if logger.getEffectiveLevel() <= logging.DEBUG:
-            ending = ']'
-            if test:
-                ending = '] (TEST - no files are being moved/copied)'
-            logger.debug(f'[{idx+1}/{num_files}{ending}')
-            logger.debug(f'Source: {src_file}')
+    with contextlib.ExitStack() as resources:
+        if throttle is not None and not test:
+            resources.enter_context(throttle)
+            logger.info(f'Transfer limits: {throttle.describe()}')
+        scan_stats: collections.Counter[str] = collections.Counter()
+        plan = None
+        if plan_out is not None:
+            # sources are recorded relative to the folder holding every source directory
+            plan_root = os.path.commonpath([os.path.abspath(folder) for folder in src_dirs])
+            plan = resources.enter_context(TransferPlan(plan_out, plan_root, dest_dir))
+        # index of the contents of dest_dir for duplicates under other names
+        index = None
+        if content_index is not None and remove_duplicates:
+            index_path = content_index or str(Path(dest_dir) / default_content_index_name)
+            index = resources.enter_context(ContentIndex(index_path, dest_dir, rebuild_content_index, read_only=test))
+
+        transfer_journal = None
+        if journal is not None:
+            transfer_journal = resources.enter_context(TransferJournal(journal, resume))
+            _replay_journal(transfer_journal, stats, hardlink, transfer_file, verifier, index)
+
+        # get all metadata, each file reduced to a compact record as soon as its date has been chosen
+        table = _RecordTable()
+        records: Iterable[_FileRecord]
+        cache = None
+        if batch_size is not None:
+            primary_args = None
+            if primary_tags is not None and primary_fast:
+                # the same tags as the full read, so only -fast differs
+                primary_args = [f'-fast{primary_fast}', *args]
+
+            if cache_file is not None:
+                settings = json.dumps([args, primary_args, additional_groups_to_ignore, additional_tags_to_ignore])
+                cache = MetadataCache(cache_file, settings, cache_max_entries)
+
+            # files are planned as each batch arrives, so the total is unknown up front
+            logger.info(f'Streaming metadata from ExifTool in batches of {batch_size} files'
+                        f'{f" with {exif_jobs} ExifTool processes" if exif_jobs > 1 else ""}.')
+            if files is None:
+                # counted separately as the scan may run on another thread, and added to stats at the end
+                files = itertools.chain.from_iterable(
+                    _scan_source_files(folder, recursive, exclude_patterns, extensions, exclude_extensions, scan_stats,
+                                       _exiftool_extensions())
+                    for folder in src_dirs)
+                if profiler is not None:
+                    files = profiler.iterate('scan', files)
+                if resume:
+                    files = (f for f in files if f not in transfer_journal)
+            else:
+                # files given by name (such as new arrivals in watch mode) pass the same filters as a search
+                files = _filter_extensions(_filter_excluded(files, src_dirs, exclude_patterns, scan_stats),
+                                           extensions, exclude_extensions, scan_stats, _exiftool_extensions())
+            timestamps = _extract_timestamps(files, args, batch_size,
+                                             policy,
+                                             exif_jobs, cache, native_exif, primary_args, exiftool, profiler,
+                                             exif_nice)
+            records = (table.pack(*timestamp) for timestamp in timestamps)
+            num_files: int | None = None
+        else:
+            if prefilter or extensions is not None or exclude_extensions is not None:
+                files = itertools.chain.from_iterable(
+                    _scan_source_files(folder, recursive, exclude_patterns, extensions, exclude_extensions, stats,
+                                       _exiftool_extensions())
+                    for folder in src_dirs)
+                files = list(profiler.iterate('scan', files) if profiler is not None else files)
+                targets = _argument_file(files)
+            else:
+                files = None
+                if recursive:
+                    args += ['-r']
+                targets = contextlib.nullcontext(src_dirs)
+
+            with targets as target:
+                if files == []:
+                    metadata = []  # everything was filtered out, no need to start ExifTool
+                else:
+                    with ExifTool(profiler=profiler, nice=exif_nice) as e, \
+                            profiler.phase('extract') if profiler else _no_phase:
+                        logger.info('Preprocessing with ExifTool.  May take a while for a large number of files.')
+                        sys.stdout.flush()
+                        metadata = e.get_metadata(*args, *(['-@', target] if files is not None else target))
+            num_files = len(metadata)
+            # each ExifTool record is released once it has been packed, and each packed one once it is planned
+            records = _consume([table.pack(*policy.oldest_timestamp(data)) for data in _consume(metadata)])
+            files = None
+
+        # names already taken in the destination folders, including files planned in this run
+        dest_index = _DestinationIndex()
+
+        # collect pending file transfers for parallel execution
+        pending_transfers: list[_FileRecord] = []
+        methods: collections.Counter[str] = collections.Counter()
+
+        def finished(src: str, dest: str, error: str | None, method: str | None) -> None:
+            if error:
+                logger.error(f'Error: {src} -> {dest}: {error}')
+                stats['errors'] += 1
+                stats['processed'] -= 1
+                return
+            methods[method] += 1
+            digest = verifier.digests.pop(dest, None) if verifier is not None else None
+            if index is not None:
+                index.transferred(dest, digest)
+            if transfer_journal is not None:
+                transfer_journal.done(src, dest)
+
+        # with pipeline, metadata is read ahead on another thread and planned files are handed to the transfer
+        # workers in groups (each synced to the journal first) while the rest are still being planned
+        transfers = None
+        transfer_group = 64
+        if pipeline:
+            records = resources.enter_context(contextlib.closing(_prefetch(records, batch_size)))
+            if not test:
+                transfers = _TransferQueue(jobs, copy_files, hardlink, 4 * transfer_group, transfer_file, source_jobs,
+                                           rotational or (), solid_state or ())
+                resources.callback(transfers.cancel)
+        if profiler is not None:
+            # waiting for the next file is extraction, everything until the following one is planning
+            records = profiler.iterate('extract', records, between='plan')
+
+        def locality(record: _FileRecord) -> tuple[int, int, int]:
+            return _locality_key(record, transfer_order)  # type: ignore[arg-type]
+
+        def hand_off() -> None:
+            if transfer_journal is not None:
+                transfer_journal.sync()
+            if transfer_order is not None:
+                pending_transfers.sort(key=locality)
+            for record in pending_transfers:
+                transfers.put(record.path, record.dest)
+            pending_transfers.clear()
+
+        # determine if we should show progress bar
+        show_progress = logger.getEffectiveLevel() >= logging.INFO and num_files != 0
+        try:
+            from tqdm import tqdm
+            progress = tqdm(total=num_files, disable=not show_progress, unit='file')
+        except ImportError:
+            progress = None
 
-        # update progress bar
-        if progress is not None:
-            progress.update(1)
+        # run through the oldest relevant date of each file
+        for idx, record in enumerate(records):
+            src_file, date, keys = table.unpack(record)
 
-        # check for excluded patterns
-        if exclude_patterns:
-            src_path = Path(src_file)
-            if any(fnmatch(src_path.name, pat) or fnmatch(str(src_path), pat) for pat in exclude_patterns):
-                logger.debug(f'Excluded by pattern: {src_file}')
-                stats['skipped_excluded'] += 1
+            if logger.getEffectiveLevel() <= logging.DEBUG:
+                ending = ']'
+                if test:
+                    ending = '] (TEST - no files are being moved/copied)'
+                logger.debug(f'[{idx+1}/{num_files if num_files is not None else "?"}{ending}')
+                logger.debug(f'Source: {src_file}')
+
+            # update progress bar
+            if progress is not None:
+                progress.update(1)
+
+            if transfers is not None:
+                for result in transfers.completed():
+                    finished(*result)
+
+            # check for excluded patterns
+            if exclude_patterns:
+                src_path = Path(src_file)
+                if any(fnmatch(src_path.name, pat) or fnmatch(str(src_path), pat) for pat in exclude_patterns):
+                    logger.debug(f'Excluded by pattern: {src_file}')
+                    stats['skipped_excluded'] += 1
+                    if transfer_journal is not None:
+                        transfer_journal.skip(src_file)
+                    continue
+
+            # check if no valid date found
+            if not date:
+                logger.debug('No valid dates were found using the specified tags.  File will remain where it is.')
+                stats['skipped_no_date'] += 1
+                if transfer_journal is not None:
+                    transfer_journal.skip(src_file)
+                if plan is not None:
+                    plan.add(src_file, None, 'skip')
                 continue
 
-        # check if no valid date found
-        if not date:
-            logger.debug('No valid dates were found using the specified tags.  File will remain where it is.')
-            stats['skipped_no_date'] += 1
-            continue
-
-        # ignore hidden files
-        if Path(src_file).name.startswith('.'):
-            logger.debug('hidden file.  will be skipped')
-            stats['skipped_hidden'] += 1
-            continue
-
-        logger.debug(f'Date/Time: {date}')
-        logger.debug(f'Corresponding Tags: {", ".join(keys)}')
-
-        # early morning photos can be grouped with previous day (depending on user setting)
-        date = check_for_early_morning_photos(date, day_begins)
-
-
-        # create folder structure
-        dir_structure = date.strftime(sort_format)
-        dest_path = Path(dest_dir) / dir_structure
-        if not test:
-            try:
-                dest_path.mkdir(parents=True, exist_ok=True)
-            except PermissionError:
-                logger.error(f'Permission denied creating directory: {dest_path}')
-                stats['errors'] += 1
-                continue
-            except OSError as e:
-                logger.error(f'Error creating directory {dest_path}: {e}')
-                stats['errors'] += 1
+            # ignore hidden files
+            if Path(src_file).name.startswith('.'):
+                logger.debug('hidden file.  will be skipped')
+                stats['skipped_hidden'] += 1
+                if transfer_journal is not None:
+                    transfer_journal.skip(src_file)
                 continue
 
-        # rename file if necessary
-        filename = Path(src_file).name
-
-        if rename_format is not None and date is not None:
-            ext = Path(filename).suffix
-            filename = date.strftime(rename_format) + ext.lower()
+            # skip content that is already somewhere in the library
+            if index is not None:
+                try:
+                    src_st = os.stat(src_file)
+                    duplicate = index.find_duplicate(src_file, src_st)
+                except OSError as e:
+                    logger.error(f'Error reading {src_file}: {e}')
+                    stats['errors'] += 1
+                    continue
+                if duplicate is not None:
+                    logger.debug(f'Identical file already exists at {duplicate}.  Duplicate will be ignored.')
+                    stats['skipped_duplicate'] += 1
+                    if transfer_journal is not None:
+                        transfer_journal.skip(src_file)
+                    if plan is not None:
+                        plan.add(src_file, duplicate, 'duplicate', date, keys)
+                    continue
+
+            logger.debug(f'Date/Time: {date}')
+            logger.debug(f'Corresponding Tags: {", ".join(keys)}')
+
+            # early morning photos can be grouped with previous day (depending on user setting)
+            tag_date = date
+            date = check_for_early_morning_photos(date, day_begins)
+
+
+            # create folder structure
+            dir_structure = date.strftime(sort_format)
+            dest_path = Path(dest_dir) / dir_structure
+            if not test:
+                try:
+                    dest_index.mkdir(str(dest_path))
+                except PermissionError:
+                    logger.error(f'Permission denied creating directory: {dest_path}')
+                    stats['errors'] += 1
+                    continue
+                except OSError as e:
+                    logger.error(f'Error creating directory {dest_path}: {e}')
+                    stats['errors'] += 1
+                    continue
 
-        # setup destination file
-        dest_file = str(dest_path / filename)
-        root, ext = os.path.splitext(dest_file)
+            # rename file if necessary
+            filename = Path(src_file).name
 
-        if copy_files:
-            logger.debug(f'Destination (copy): {dest_file}')
-        else:
-            logger.debug(f'Destination (move): {dest_file}')
+            if rename_format is not None and date is not None:
+                ext = Path(filename).suffix
+                filename = date.strftime(rename_format) + ext.lower()
 
+            # setup destination file
+            dest_file = str(dest_path / filename)
+            root, ext = os.path.splitext(dest_file)
 
-        # check for collisions
-        append = 1
-        fileIsIdentical = False
-
-        while True:
+            if copy_files:
+                logger.debug(f'Destination (copy): {dest_file}')
+            else:
+                logger.debug(f'Destination (move): {dest_file}')
+
+
+            # check for collisions
+            append = 1
+            fileIsIdentical = False
+
+            while True:
+
+                dest_compare = dest_index.find(dest_file)
+                if dest_compare is not None:  # check for existing name
+                    try:
+                        identical = remove_duplicates and dest_compare and filecmp.cmp(src_file, dest_compare)
+                    except FileNotFoundError:
+                        if transfers is not None and os.path.exists(src_file):
+                            continue  # a planned file was moved while being compared, look again
+                        raise
+                    if identical:  # check for identical files
+                        fileIsIdentical = True
+                        logger.debug('Identical file already exists.  Duplicate will be ignored.')
+                        stats['skipped_duplicate'] += 1
+                        break
+
+                    else:  # name is same, but file is different
+                        if keep_filename:
+                            orig_filename = Path(src_file).stem
+                            dest_file = f'{root}_{orig_filename}_{append}{ext}'
+                        else:
+                            dest_file = f'{root}_{append}{ext}'
+                        append += 1
+                        stats['renamed_collision'] += 1
+                        logger.debug(f'Same name already exists...renaming to: {dest_file}')
 
-            if (not test and Path(dest_file).is_file()) or (test and dest_file in test_file_dict):  # check for existing name
-                if test:
-                    dest_compare = test_file_dict[dest_file]
                 else:
-                    dest_compare = dest_file
-                if remove_duplicates and filecmp.cmp(src_file, dest_compare):  # check for identical files
-                    fileIsIdentical = True
-                    logger.debug('Identical file already exists.  Duplicate will be ignored.')
-                    stats['skipped_duplicate'] += 1
                     break
 
-                else:  # name is same, but file is different
-                    if keep_filename:
-                        orig_filename = Path(src_file).stem
-                        dest_file = f'{root}_{orig_filename}_{append}{ext}'
-                    else:
-                        dest_file = f'{root}_{append}{ext}'
-                    append += 1
-                    stats['renamed_collision'] += 1
-                    logger.debug(f'Same name already exists...renaming to: {dest_file}')
 
-            else:
-                break
+            # finally move or copy the file
+            if not fileIsIdentical:
+                dest_index.add(dest_file, record)
+                if index is not None:
+                    index.plan(dest_file, record, src_st.st_size)
 
+            if plan is not None:
+                plan.add(src_file, dest_file, 'duplicate' if fileIsIdentical else 'copy' if copy_files else 'move',
+                         tag_date, keys)
 
-        # finally move or copy the file
-        if test:
-            test_file_dict[dest_file] = src_file
-            if not fileIsIdentical:
-                stats['processed'] += 1
+            if test:
+                if not fileIsIdentical:
+                    stats['processed'] += 1
 
-        else:
+            else:
+
+                if fileIsIdentical:
+                    if transfer_journal is not None:
+                        transfer_journal.skip(src_file)
+                    continue  # ignore identical files
+                else:
+                    if transfer_journal is not None:
+                        transfer_journal.plan(src_file, dest_file, copy_files)
+                    pending_transfers.append(record)
+                    stats['processed'] += 1
+                    if transfers is not None and len(pending_transfers) >= transfer_group:
+                        hand_off()
 
-            if fileIsIdentical:
-                continue  # ignore identical files
+        if progress is not None:
+            progress.close()
+
+        for key, count in scan_stats.items():
+            stats[key] += count
+
+        # execute file transfers
+        if transfers is not None:
+            hand_off()
+            for result in transfers.finish():
+                finished(*result)
+        elif not test and pending_transfers:
+            if transfer_order is not None:
+                pending_transfers.sort(key=locality)
+            if transfer_journal is not None:
+                transfer_journal.sync()  # every transfer is on disk as planned before any of them starts
+            if jobs > 1:
+                logger.info(f'Transferring {len(pending_transfers)} files '
+                            f'with {jobs} workers per destination device...')
+                _transfer_all(((r.path, r.dest, copy_files) for r in _consume(pending_transfers)), finished,
+                              jobs, source_jobs, hardlink, transfer_file,
+                              rotational=rotational or (), solid_state=solid_state or ())
             else:
-                pending_transfers.append((src_file, dest_file))
-                stats['processed'] += 1
+                for record in _consume(pending_transfers):
+                    finished(*transfer_file(record.path, record.dest, copy_files, hardlink))
 
-    if progress is not None:
-        progress.close()
+        for method, count in methods.items():
+            stats[f'transfer_{method}'] = count
+        if verifier is not None and verifier.retried:
+            stats['verify_retries'] = verifier.retried
 
-    # execute file transfers
-    if not test and pending_transfers:
-        if jobs > 1:
-            logger.info(f'Transferring {len(pending_transfers)} files with {jobs} workers...')
-            with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as pool:
-                futures = {
-                    pool.submit(_transfer_file, s, d, copy_files): (s, d)
-                    for s, d in pending_transfers
-                }
-                for future in concurrent.futures.as_completed(futures):
-                    src, dest, error = future.result()
-                    if error:
-                        logger.error(f'Error: {src} -> {dest}: {error}')
-                        stats['errors'] += 1
-                        stats['processed'] -= 1
-        else:
-            for src, dest in pending_transfers:
-                src, dest, error = _transfer_file(src, dest, copy_files)
-                if error:
-                    logger.error(f'Error: {src} -> {dest}: {error}')
-                    stats['errors'] += 1
-                    stats['processed'] -= 1
 
     # print summary
     action = 'copy' if copy_files else 'move'
@@ -541,19 +3004,379 @@ def sortPhotos(
         logger.info(f'Skipped (excluded): {stats["skipped_excluded"]}')
     if stats['renamed_collision']:
         logger.info(f'Renamed (collision): {stats["renamed_collision"]}')
+    if stats['resumed']:
+        logger.info(f'Resumed from journal: {stats["resumed"]}')
+    if stats['errors']:
+        logger.info(f'Errors: {stats["errors"]}')
+    if methods:
+        logger.info('Transferred by: ' + ', '.join(f'{method} {count}' for method, count in methods.most_common()))
+    if stats.get('verify_retries'):
+        logger.info(f'Copies tried again: {stats["verify_retries"]}')
+    if cache is not None:
+        logger.info(f'Metadata cache: {cache.hits} hits, {cache.misses} misses')
+
+    if profiler is not None:
+        report = profiler.report()
+        _log_profile(report)
+        if profile:
+            Path(profile).write_text(json.dumps(report, indent=2) + '\n')
+        stats['profile'] = report
+
+    return stats
+
+
+def applyPlan(
+    plan_file: str,
+    src_dir: str | None = None,
+    dest_dir: str | None = None,
+    jobs: int = 1,
+    hardlink: bool = False,
+    source_jobs: int | None = None,
+    rotational: list[str] | None = None,
+    solid_state: list[str] | None = None,
+    max_bandwidth: float | None = None,
+    max_files_per_sec: float | None = None,
+    throttle_file: str | None = None,
+    verify: str | None = None,
+    verify_retries: int = default_verify_retries,
+) -> dict[str, Any]:
+    """
+    Carry out the moves and copies of a plan written by sortPhotos(plan_out=...), without reading any metadata.
+
+    Parameters
+    ---------------
+    plan_file : str
+        the plan
+    src_dir, dest_dir : str
+        where the source and destination trees of the plan are on this host (default: where they were when the
+        plan was made)
+    jobs : int
+        number of parallel workers for file operations per destination device (default: 1 for serial)
+    hardlink : bool
+        hard link files that the plan copies where possible, as for sortPhotos
+    source_jobs : int
+        with jobs above 1, the number of files read from each source device at once (default: jobs)
+    rotational, solid_state : list[str]
+        folders whose devices are to be treated as spinning disks or SSDs, as for sortPhotos
+    max_bandwidth, max_files_per_sec, throttle_file
+        limits on the transfers, as for sortPhotos
+    verify, verify_retries
+        verification of copied data, as for sortPhotos
+
+    Returns
+    -------
+    dict[str, Any]
+        Statistics about the operation.  Sources whose size or modification time changed since the plan was made
+        are skipped (skipped_changed), as are planned destinations that are now taken by a different file (errors)
+    """
+    header, entries = TransferPlan.read(plan_file)
+    src_root = src_dir if src_dir is not None else header['src_dir']
+    dest_root = dest_dir if dest_dir is not None else header['dest_dir']
+
+    stats: dict[str, Any] = {
+        'processed': 0,
+        'skipped_changed': 0,
+        'skipped_duplicate': 0,
+        'errors': 0,
+    }
+    methods: collections.Counter[str] = collections.Counter()
+    dest_index = _DestinationIndex()
+    throttle = None
+    transfer_file: Callable[..., tuple[str, str, str | None, str | None]] = _transfer_file
+    if max_bandwidth is not None or max_files_per_sec is not None or throttle_file is not None:
+        throttle = Throttle(max_bandwidth, max_files_per_sec, throttle_file)
+        logger.info(f'Transfer limits: {throttle.describe()}')
+    verifier = CopyVerifier(verify, verify_retries) if verify is not None else None
+    if throttle is not None or verifier is not None:
+        transfer_file = functools.partial(_transfer_file, throttle=throttle, verifier=verifier)
+
+    def transfers() -> Iterator[tuple[str, str, bool]]:
+        for entry in entries:
+            if entry['action'] not in ('move', 'copy'):
+                continue
+            src_file = os.path.join(src_root, entry['src'])
+            dest_file = os.path.join(dest_root, entry['dest'])
+            try:
+                st = os.stat(src_file)
+            except OSError as e:
+                logger.error(f'Error reading {src_file}: {e}')
+                stats['errors'] += 1
+                continue
+            if (st.st_size, st.st_mtime_ns) != (entry['size'], entry['mtime_ns']):
+                logger.info(f'Changed since the plan was made, skipping: {src_file}')
+                stats['skipped_changed'] += 1
+                continue
+            try:
+                dest_index.mkdir(os.path.dirname(dest_file))
+                if os.path.lexists(dest_file):
+                    if os.path.isfile(dest_file) and filecmp.cmp(src_file, dest_file, shallow=False):
+                        stats['skipped_duplicate'] += 1
+                    else:
+                        logger.error(f'Error: {src_file} -> {dest_file}: destination already exists')
+                        stats['errors'] += 1
+                    continue
+            except OSError as e:
+                logger.error(f'Error: {src_file} -> {dest_file}: {e}')
+                stats['errors'] += 1
+                continue
+            yield src_file, dest_file, entry['action'] == 'copy'
+
+    def finished(src: str, dest: str, error: str | None, method: str | None) -> None:
+        if error:
+            logger.error(f'Error: {src} -> {dest}: {error}')
+            stats['errors'] += 1
+        else:
+            methods[method] += 1
+            stats['processed'] += 1
+        if verifier is not None:
+            verifier.digests.pop(dest, None)  # a plan has no content index to record them in
+
+    with throttle if throttle is not None else contextlib.nullcontext():
+        if jobs > 1:
+            _transfer_all(transfers(), finished, jobs, source_jobs, hardlink, transfer_file,
+                          rotational=rotational or (), solid_state=solid_state or ())
+        else:
+            for src_file, dest_file, copy in transfers():
+                finished(*transfer_file(src_file, dest_file, copy, hardlink))
+
+    for method, count in methods.items():
+        stats[f'transfer_{method}'] = count
+    if verifier is not None and verifier.retried:
+        stats['verify_retries'] = verifier.retried
+
+    logger.info('')
+    logger.info('--- Summary ---')
+    logger.info(f'Applied: {stats["processed"]} files')
+    if stats['skipped_changed']:
+        logger.info(f'Skipped (changed since planned): {stats["skipped_changed"]}')
+    if stats['skipped_duplicate']:
+        logger.info(f'Skipped (already at destination): {stats["skipped_duplicate"]}')
     if stats['errors']:
         logger.info(f'Errors: {stats["errors"]}')
+    if methods:
+        logger.info('Transferred by: ' + ', '.join(f'{method} {count}' for method, count in methods.most_common()))
 
     return stats
 
 
+# -------- watch mode -------------
+
+class _PollingWatcher:
+    """reports files under a directory that are new or changed since the last scan"""
+
+    def __init__(self, root: str, recursive: bool, interval: float) -> None:
+        self.root = root
+        self.recursive = recursive
+        self.interval = interval
+        self.known = self._snapshot()
+
+    def _snapshot(self) -> dict[str, tuple[int, int]]:
+        snapshot = {}
+        for src_file in _scan_source_files(self.root, self.recursive):
+            try:
+                st = os.stat(src_file)
+            except OSError:
+                continue
+            snapshot[src_file] = (st.st_size, st.st_mtime_ns)
+        return snapshot
+
+    def read(self, timeout: float) -> set[str]:
+        time.sleep(min(timeout, self.interval))
+        snapshot = self._snapshot()
+        changed = {path for path, sig in snapshot.items() if self.known.get(path) != sig}
+        self.known = snapshot
+        return changed
+
+    def close(self) -> None:
+        pass
+
+
+class _InotifyWatcher:
+    """reports files written or moved into a directory (and its subdirectories if recursive) using Linux inotify"""
+
+    IN_MODIFY = 0x00000002
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_ISDIR = 0x40000000
+    IN_NONBLOCK = 0o4000
+    IN_CLOEXEC = 0o2000000
+    event = struct.Struct('iIII')
+
+    def __init__(self, root: str, recursive: bool) -> None:
+        if not sys.platform.startswith('linux'):
+            raise OSError(errno.ENOSYS, 'inotify is only available on Linux')
+        self.libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self.fd = self.libc.inotify_init1(self.IN_NONBLOCK | self.IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        self.recursive = recursive
+        self.watches: dict[int, str] = {}
+        self._watch_tree(root)
+
+    def _watch(self, directory: str) -> None:
+        mask = self.IN_MODIFY | self.IN_CLOSE_WRITE | self.IN_MOVED_TO | self.IN_CREATE
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(directory), mask)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), f'cannot watch {directory}')
+        self.watches[wd] = directory
+
+    def _watch_tree(self, root: str) -> set[str]:
+        """watch root (and subdirectories if recursive), returning the files already in it"""
+        self._watch(root)
+        found = set()
+        for entry in os.scandir(root):
+            if entry.name.startswith('.'):
+                continue
+            if entry.is_dir(follow_symlinks=False):
+                if self.recursive:
+                    found |= self._watch_tree(entry.path)
+            elif entry.is_file():
+                found.add(entry.path)
+        return found
+
+    def read(self, timeout: float) -> set[str]:
+        changed: set[str] = set()
+        if not select.select([self.fd], [], [], timeout)[0]:
+            return changed
+        while True:
+            try:
+                data = os.read(self.fd, 65536)
+            except BlockingIOError:
+                return changed
+            offset = 0
+            while offset < len(data):
+                wd, mask, _, length = self.event.unpack_from(data, offset)
+                name = data[offset + self.event.size:offset + self.event.size + length].rstrip(b'\0')
+                offset += self.event.size + length
+                if wd not in self.watches or not name or name.startswith(b'.'):
+                    continue
+                path = os.path.join(self.watches[wd], os.fsdecode(name))
+                if mask & self.IN_ISDIR:
+                    if self.recursive and mask & (self.IN_CREATE | self.IN_MOVED_TO):
+                        try:
+                            # files may have arrived before the watch was in place
+                            changed |= self._watch_tree(path)
+                        except OSError as e:
+                            logger.error(f'Error watching {path}: {e}')
+                else:
+                    changed.add(path)
+
+    def close(self) -> None:
+        os.close(self.fd)
+
+
+def watchPhotos(
+    src_dir: str,
+    dest_dir: str,
+    sort_format: str,
+    rename_format: str | None,
+    recursive: bool = False,
+    settle: float = 2.0,
+    poll_interval: float = 5.0,
+    use_inotify: bool = True,
+    stop: threading.Event | None = None,
+    **sort_options: Any,
+) -> dict[str, Any]:
+    """
+    Sort the files in src_dir, then keep watching it and sort new or changed files as they arrive, reusing a
+    single ExifTool process.  Uses inotify on Linux and falls back to polling every poll_interval seconds.
+
+    Parameters
+    ---------------
+    src_dir, dest_dir, sort_format, rename_format, recursive
+        as for sortPhotos
+    settle : float
+        seconds a file's size and modification time must stay unchanged before it is sorted, so files
+        that are still being written are left alone
+    poll_interval : float
+        seconds between scans when polling
+    use_inotify : bool
+        False to always poll
+    stop : threading.Event
+        set to stop watching (otherwise runs until interrupted)
+    sort_options
+        any other sortPhotos keyword arguments
+
+    Returns
+    -------
+    dict[str, Any]
+        Statistics summed over everything sorted while watching (with the profile of the latest round)
+    """
+    if not Path(src_dir).exists():
+        raise Exception('Source directory does not exist')
+    stop = stop or threading.Event()
+    totals: dict[str, Any] = {}
+
+    def sort(files: Iterable[str] | None, exiftool: ExifTool | ExifToolPool) -> None:
+        stats = sortPhotos(src_dir, dest_dir, sort_format, rename_format, recursive,
+                           files=files, exiftool=exiftool, **sort_options)
+        for key, value in stats.items():
+            if isinstance(value, int):
+                totals[key] = totals.get(key, 0) + value
+            else:
+                totals[key] = value  # the profile of the latest round
+        if sort_options.get('journal') is not None:
+            sort_options['resume'] = True  # later rounds add to the same journal
+
+    watcher: _InotifyWatcher | _PollingWatcher
+    try:
+        if not use_inotify:
+            raise OSError(errno.ENOSYS, 'inotify disabled')
+        watcher = _InotifyWatcher(src_dir, recursive)
+        logger.info(f'Watching {src_dir} for new files (inotify).')
+    except OSError as e:
+        logger.debug(f'Not using inotify: {e}')
+        watcher = _PollingWatcher(src_dir, recursive, poll_interval)
+        logger.info(f'Watching {src_dir} for new files (polling every {poll_interval} s).')
+
+    exif_jobs = sort_options.get('exif_jobs', 1)
+    with contextlib.ExitStack() as resources:
+        resources.callback(watcher.close)
+        nice = sort_options.get('exif_nice', False)
+        exiftool = resources.enter_context(ExifToolPool(exif_jobs, nice=nice) if exif_jobs > 1 else ExifTool(nice=nice))
+
+        # everything already there, then only what changes
+        sort(None, exiftool)
+
+        # path -> (size, mtime_ns, time the file was last seen changing)
+        pending: dict[str, tuple[int, int, float]] = {}
+        try:
+            while not stop.is_set():
+                for path in watcher.read(min(settle, poll_interval) if pending else poll_interval):
+                    pending[path] = (-1, -1, time.monotonic())
+
+                ready = []
+                now = time.monotonic()
+                for path, (size, mtime_ns, since) in list(pending.items()):
+                    try:
+                        st = os.stat(path)
+                    except OSError:
+                        del pending[path]  # moved away or deleted before it settled
+                        continue
+                    if (st.st_size, st.st_mtime_ns) != (size, mtime_ns):
+                        pending[path] = (st.st_size, st.st_mtime_ns, now)
+                    elif now - since >= settle:
+                        ready.append(path)
+                        del pending[path]
+
+                if ready:
+                    logger.info(f'Sorting {len(ready)} new file(s).')
+                    sort(sorted(ready), exiftool)
+        except KeyboardInterrupt:
+            logger.info('Stopped watching.')
+
+    return totals
+
+
 def main() -> None:
 
     # setup command line parsing
     parser = argparse.ArgumentParser(formatter_class=argparse.RawTextHelpFormatter,
                                      description='Sort files (primarily photos and videos) into folders by date\nusing EXIF and other metadata')
-    parser.add_argument('src_dir', type=str, help='source directory')
-    parser.add_argument('dest_dir', type=str, help='destination directory')
+    parser.add_argument('src_dir', type=str, nargs='*',
+                    help='source directory, or several to sort together in one run')
+    parser.add_argument('dest_dir', type=str, nargs='?', help='destination directory')
     parser.add_argument('-r', '--recursive', action='store_true', help='search src_dir recursively')
     parser.add_argument('-c', '--copy', action='store_true', help='copy files instead of move')
     parser.add_argument('-s', '--silent', action='store_true', help='suppress all output except errors (alias for --quiet)')
@@ -575,6 +3398,11 @@ def main() -> None:
                         default=False)
     parser.add_argument('--keep-duplicates', action='store_true',
                         help='If file is a duplicate keep it anyway (after renaming).')
+    parser.add_argument('--content-index', type=str, default=None, metavar='FILE',
+                    help='keep an index of the contents of dest_dir in FILE (use "" for\n\
+    dest_dir/.sortphotos-index.sqlite) and skip files whose content is already anywhere in it')
+    parser.add_argument('--rebuild-content-index', action='store_true',
+                    help='rescan dest_dir for the content index instead of updating it incrementally')
     parser.add_argument('--day-begins', type=int, default=0, help='hour of day that new day begins (0-23), \n\
     defaults to 0 which corresponds to midnight.  Useful for grouping pictures with previous day.')
     parser.add_argument('--ignore-groups', type=str, nargs='+',
@@ -599,11 +3427,89 @@ def main() -> None:
                     default=None,
                     help='glob patterns for files to exclude\n\
     e.g., --exclude "*.raw" "backup/*"')
+    parser.add_argument('--native-exif', action='store_true',
+                    help='read EXIF dates of plain JPEG/TIFF files directly instead of through ExifTool.\n\
+    Files with XMP, IPTC or other metadata still go to ExifTool.  Maker note dates are not read')
+    parser.add_argument('--tiered', action='store_true',
+                    help='with --use-only-tags naming only primary tags, read them with ExifTool -fast first and\n\
+    only read files without a date among them in full (see --primary-tags)')
+    parser.add_argument('--primary-tags', type=str, nargs='+', default=None,
+                    help=f'primary tags for tiered extraction (implies --tiered)\n\
+    default: {" ".join(default_primary_tags)}')
+    parser.add_argument('--primary-fast', type=int, choices=[0, 1, 2], default=2,
+                    help='ExifTool -fast level for the primary pass of tiered extraction (default: 2, 0 for none)')
+    parser.add_argument('--prefilter', action='store_true',
+                    help='walk the source directory in Python and drop hidden, excluded and\n\
+    filtered-extension files (pruning hidden and excluded directories) before ExifTool reads them')
+    parser.add_argument('--extensions', type=str, nargs='+', default=None,
+                    help='only process files with these extensions, e.g., --extensions jpg cr2 mov\n\
+    (implies --prefilter)')
+    parser.add_argument('--exclude-extensions', type=str, nargs='+', default=None,
+                    help='never process files with these extensions, e.g., --exclude-extensions thm db\n\
+    (implies --prefilter)')
+    parser.add_argument('--watch', action='store_true',
+                    help='keep running and sort new files as they appear in src_dir\n\
+    (inotify on Linux, polling elsewhere)')
+    parser.add_argument('--settle', type=float, default=2.0,
+                    help='with --watch, seconds a new file must stay unchanged before it is sorted (default: 2)')
+    parser.add_argument('--poll-interval', type=float, default=5.0,
+                    help='with --watch, seconds between scans when polling (default: 5)')
+    parser.add_argument('--poll', action='store_true',
+                    help='with --watch, poll even where inotify is available')
+    parser.add_argument('--hardlink', action='store_true',
+                    help='with --copy, hard link files instead of copying them where possible')
+    parser.add_argument('--pipeline', action='store_true',
+                    help='transfer files (with --jobs workers) while later files are still being read')
+    parser.add_argument('--profile', type=str, default=None, metavar='FILE',
+                    help='report time per phase, latencies, throughput and peak memory, and save it to FILE as JSON')
+    parser.add_argument('--plan-out', type=str, default=None, metavar='FILE',
+                    help='write what would be done with each file to FILE (.gz to compress) instead of doing it')
+    parser.add_argument('--apply', type=str, default=None, metavar='FILE',
+                    help='carry out a plan written by --plan-out, with src_dir and dest_dir as its roots\n'
+                         '(default: the roots recorded in the plan; a single directory is dest_dir)')
+    parser.add_argument('--journal', type=str, default=None, metavar='FILE',
+                    help='record planned and completed transfers in FILE so an interrupted run can be resumed')
+    parser.add_argument('--resume', action='store_true',
+                    help='finish the run recorded in --journal, skipping files it already handled')
     parser.add_argument('-j', '--jobs', type=int, default=1,
-                    help='number of parallel workers for file operations (default: 1)')
-
-    # parse command line arguments
-    args = parser.parse_args()
+                    help='number of parallel workers for file operations, per destination device (default: 1)')
+    parser.add_argument('--source-jobs', type=int, default=None,
+                    help='with --jobs, number of files read at once from each source device (default: --jobs)')
+    parser.add_argument('--rotational', type=str, nargs='+', default=None, metavar='DIR',
+                    help='treat the disks holding these folders as spinning disks, transferring one file at a time\n\
+    (detected automatically on Linux)')
+    parser.add_argument('--solid-state', type=str, nargs='+', default=None, metavar='DIR',
+                    help='treat the disks holding these folders as SSDs, using all --jobs workers')
+    parser.add_argument('--max-bandwidth', type=_parse_size, default=None, metavar='RATE',
+                    help='most bytes per second to move or copy, e.g., 20M (renames and hard links do not count)')
+    parser.add_argument('--max-files-per-sec', type=float, default=None, metavar='N',
+                    help='most files per second to move or copy')
+    parser.add_argument('--throttle-file', type=str, default=None, metavar='FILE',
+                    help='read max-bandwidth and max-files-per-sec settings from FILE while running, again whenever\n\
+    it changes or on SIGUSR1, e.g., a line "max-bandwidth = 5M"')
+    parser.add_argument('--exif-nice', action='store_true',
+                    help='run ExifTool at the lowest CPU and disk priority (nice/ionice where available)')
+    parser.add_argument('--verify', type=str, choices=verify_modes, default=None,
+                    help='hash copied data as it is written and check each copy: readback hashes it again from\n\
+    storage, fsync trusts a successful fsync and compares sizes.  Hashes go into --content-index')
+    parser.add_argument('--verify-retries', type=int, default=default_verify_retries, metavar='N',
+                    help=f'times a copy that fails --verify is tried again (default: {default_verify_retries})')
+    parser.add_argument('--transfer-order', type=str, choices=transfer_orders, default=None,
+                    help='transfer files in the order they are stored on the source disk, by inode number or by\n\
+    the position of their data (extent, Linux only); speeds up copies from spinning disks')
+    parser.add_argument('--batch-size', type=int, default=None,
+                    help=f'stream metadata from ExifTool in batches of this many files (e.g., {default_batch_size}).\n\
+    Sorting starts right away and memory use stays bounded on very large source trees')
+    parser.add_argument('--exif-jobs', type=int, default=1,
+                    help='number of ExifTool processes extracting metadata in parallel (default: 1)')
+    parser.add_argument('--cache', type=str, default=None, metavar='FILE',
+                    help='SQLite file caching the date of each file between runs.\n\
+    Unchanged files (same size, modification time and inode) skip ExifTool')
+    parser.add_argument('--cache-max-entries', type=int, default=default_cache_max_entries,
+                    help=f'number of files kept in the cache (default: {default_cache_max_entries})')
+
+    # parse command line arguments, allowing options between the directories
+    args = parser.parse_intermixed_args()
 
     # configure logging
     if args.verbose:
@@ -613,10 +3519,48 @@ def main() -> None:
     else:
         logging.basicConfig(level=logging.INFO, format='%(message)s')
 
-    sortPhotos(args.src_dir, args.dest_dir, args.sort, args.rename, args.recursive,
-        args.copy, args.test, not args.keep_duplicates, args.day_begins,
-        args.ignore_groups, args.ignore_tags, args.use_only_groups,
-        args.use_only_tags, args.keep_filename, args.exclude, args.jobs)
+    options = dict(
+        batch_size=args.batch_size, exif_jobs=args.exif_jobs,
+        cache_file=args.cache, cache_max_entries=args.cache_max_entries,
+        prefilter=args.prefilter, extensions=args.extensions, exclude_extensions=args.exclude_extensions,
+        native_exif=args.native_exif,
+        primary_tags=args.primary_tags or (list(default_primary_tags) if args.tiered else None),
+        primary_fast=args.primary_fast,
+        content_index=args.content_index, rebuild_content_index=args.rebuild_content_index,
+        journal=args.journal, resume=args.resume, hardlink=args.hardlink, pipeline=args.pipeline,
+        profile=args.profile, plan_out=args.plan_out, source_jobs=args.source_jobs,
+        rotational=args.rotational, solid_state=args.solid_state, transfer_order=args.transfer_order,
+        max_bandwidth=args.max_bandwidth, max_files_per_sec=args.max_files_per_sec,
+        throttle_file=args.throttle_file, exif_nice=args.exif_nice,
+        verify=args.verify, verify_retries=args.verify_retries)
+
+    # src_dir takes every directory given (its nargs='*' matches them all), the last of which is dest_dir
+    if args.dest_dir is None and args.src_dir:
+        args.dest_dir = args.src_dir.pop()
+    if args.apply is None and not args.src_dir:
+        parser.error('the following arguments are required: src_dir, dest_dir')
+    if args.verify_retries < 0:
+        parser.error('--verify-retries must not be negative')
+    if (args.apply is not None or args.watch) and len(args.src_dir) > 1:
+        parser.error('--apply and --watch take a single source directory')
+    if args.apply is not None:
+        applyPlan(args.apply, args.src_dir[0] if args.src_dir else None, args.dest_dir, jobs=args.jobs,
+                  hardlink=args.hardlink, source_jobs=args.source_jobs, rotational=args.rotational,
+                  solid_state=args.solid_state, max_bandwidth=args.max_bandwidth, max_files_per_sec=args.max_files_per_sec,
+                  throttle_file=args.throttle_file, verify=args.verify, verify_retries=args.verify_retries)
+    elif args.watch:
+        watchPhotos(args.src_dir[0], args.dest_dir, args.sort, args.rename, args.recursive,
+            settle=args.settle, poll_interval=args.poll_interval, use_inotify=not args.poll,
+            copy_files=args.copy, test=args.test, remove_duplicates=not args.keep_duplicates,
+            day_begins=args.day_begins, additional_groups_to_ignore=args.ignore_groups,
+            additional_tags_to_ignore=args.ignore_tags, use_only_groups=args.use_only_groups,
+            use_only_tags=args.use_only_tags, keep_filename=args.keep_filename,
+            exclude_patterns=args.exclude, jobs=args.jobs, **options)
+    else:
+        sortPhotos(args.src_dir, args.dest_dir, args.sort, args.rename, args.recursive,
+            args.copy, args.test, not args.keep_duplicates, args.day_begins,
+            args.ignore_groups, args.ignore_tags, args.use_only_groups,
+            args.use_only_tags, args.keep_filename, args.exclude, args.jobs, **options)
 
 if __name__ == '__main__':
     main()
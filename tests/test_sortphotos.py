@@ -2,9 +2,21 @@
 
 from __future__ import annotations
 
+import asyncio
+import collections
+import errno
+import gzip
+import hashlib
+import json
 import logging
 import os
+import random
 import shutil
+import signal
+import struct
+import sys
+import threading
+import time
 from datetime import datetime, timedelta
 from pathlib import Path
 from unittest.mock import MagicMock, patch
@@ -12,11 +24,38 @@ from unittest.mock import MagicMock, patch
 import pytest
 
 from src.sortphotos import (
+    ContentIndex,
+    CopyVerifier,
     ExifTool,
+    ExifToolPool,
+    MetadataCache,
+    Profiler,
+    TagPolicy,
+    Throttle,
+    TransferJournal,
+    TransferPlan,
+    _DestinationIndex,
+    _InotifyWatcher,
+    _RecordTable,
+    _TransferQueue,
+    _exiftool_extensions,
+    _ignores_case,
+    _is_rotational,
+    _locality_key,
+    _parse_size,
+    _prefetch,
+    _scan_source_files,
+    _schedule_transfers,
+    _transfer_all,
+    _transfer_file,
+    applyPlan,
     check_for_early_morning_photos,
     get_oldest_timestamp,
+    main,
     parse_date_exif,
+    read_exif_dates,
     sortPhotos,
+    watchPhotos,
 )
 
 
@@ -92,6 +131,20 @@ class TestParseDateExif:
     def test_invalid_day(self):
         assert parse_date_exif('2023:06:32 14:30:00') is None
 
+    def test_subsecond_time_with_timezone(self):
+        result = parse_date_exif('2023:06:15 14:30:05.25-07:00')
+        assert result == datetime(2023, 6, 15, 21, 30, 5)
+
+    def test_other_whitespace(self):
+        assert parse_date_exif(' 2023:06:15\t14:30:00\n') == datetime(2023, 6, 15, 14, 30, 0)
+
+    def test_timezone_without_colon_ignored(self):
+        assert parse_date_exif('2023:06:15 14:30:00+0500') == datetime(2023, 6, 15, 14, 30, 0)
+
+    def test_repeated_strings_are_cached(self):
+        first = parse_date_exif('2023:06:15 14:30:00+05:00')
+        assert parse_date_exif('2023:06:15 14:30:00+05:00') is first
+
 
 # ---------------------------------------------------------------------------
 # get_oldest_timestamp
@@ -195,6 +248,39 @@ class TestGetOldestTimestamp:
         src, date, keys = get_oldest_timestamp(data, ['File'], [])
         assert date is None
 
+    def test_future_dates_ignored(self):
+        data = {
+            'SourceFile': '/photo.jpg',
+            'EXIF:ModifyDate': '2999:01:01 00:00:00',
+            'EXIF:CreateDate': '2023:06:15 14:30:00',
+        }
+        src, date, keys = get_oldest_timestamp(data, ['File'], [])
+        assert (date, keys) == (datetime(2023, 6, 15, 14, 30, 0), ['EXIF:CreateDate'])
+
+
+class TestTagPolicy:
+    def test_decisions(self):
+        policy = TagPolicy(['File'], ['EXIF:ModifyDate'])
+        assert policy.accepts('EXIF:CreateDate')
+        assert not policy.accepts('File:FileModifyDate')
+        assert not policy.accepts('ICC_Profile:ProfileDateTime')
+        assert not policy.accepts('EXIF:ModifyDate')
+        assert not policy.accepts('XMP:HistoryWhen')
+        assert not policy.accepts('Composite:GPSDateTime')
+        assert not policy.accepts('SourceFile')
+
+    def test_reused_across_records(self):
+        policy = TagPolicy(['File'], [])
+        for day in (15, 16):
+            data = {
+                'SourceFile': f'/photo{day}.jpg',
+                'File:FileModifyDate': '2000:01:01 00:00:00',
+                'EXIF:CreateDate': f'2023:06:{day} 14:30:00',
+            }
+            assert policy.oldest_timestamp(data) == (
+                f'/photo{day}.jpg', datetime(2023, 6, day, 14, 30, 0), ['EXIF:CreateDate'])
+        assert policy._accepts == {'SourceFile': False, 'File:FileModifyDate': False, 'EXIF:CreateDate': True}
+
 
 # ---------------------------------------------------------------------------
 # check_for_early_morning_photos
@@ -227,6 +313,209 @@ class TestCheckForEarlyMorningPhotos:
         assert result.day == 14
 
 
+# ---------------------------------------------------------------------------
+# _scan_source_files
+# ---------------------------------------------------------------------------
+
+class TestScanSourceFiles:
+    def _touch(self, root: Path, names: list[str]) -> None:
+        for name in names:
+            (root / name).parent.mkdir(parents=True, exist_ok=True)
+            (root / name).write_text(name)
+
+    def _stats(self) -> dict[str, int]:
+        return {'skipped_hidden': 0, 'skipped_excluded': 0, 'errors': 0}
+
+    def test_top_level_only(self, tmp_path):
+        self._touch(tmp_path, ['b.jpg', 'a.jpg', 'sub/c.jpg'])
+        result = list(_scan_source_files(str(tmp_path), recursive=False))
+        assert result == [str(tmp_path / 'a.jpg'), str(tmp_path / 'b.jpg')]
+
+    def test_recursive_skips_hidden(self, tmp_path):
+        self._touch(tmp_path, ['a.jpg', 'sub/b.jpg', '.hidden/c.jpg', '.DS_Store', 'sub/.d.jpg'])
+        stats = self._stats()
+        result = list(_scan_source_files(str(tmp_path), recursive=True, stats=stats))
+        assert result == [str(tmp_path / 'a.jpg'), str(tmp_path / 'sub' / 'b.jpg')]
+        assert stats['skipped_hidden'] == 2
+
+    def test_follows_directory_links_once(self, tmp_path):
+        self._touch(tmp_path / 'elsewhere', ['a.jpg'])
+        self._touch(tmp_path / 'src', ['b.jpg'])
+        (tmp_path / 'src' / 'linked').symlink_to(tmp_path / 'elsewhere')
+        (tmp_path / 'src' / 'loop').symlink_to(tmp_path / 'src')
+        result = list(_scan_source_files(str(tmp_path / 'src'), recursive=True))
+        assert result == [str(tmp_path / 'src' / 'b.jpg'), str(tmp_path / 'src' / 'linked' / 'a.jpg')]
+
+    def test_prunes_excluded_directories(self, tmp_path):
+        self._touch(tmp_path, ['a.jpg', 'RAW/b.cr2', 'backup/c.jpg', 'keep/d.jpg'])
+        stats = self._stats()
+        result = list(_scan_source_files(str(tmp_path), recursive=True, stats=stats,
+                                         exclude_patterns=['RAW', '*/backup/*']))
+        assert result == [str(tmp_path / 'a.jpg'), str(tmp_path / 'keep' / 'd.jpg')]
+
+    def test_extension_filters(self, tmp_path):
+        self._touch(tmp_path, ['a.JPG', 'b.thm', 'c.mov', 'd.txt'])
+        stats = self._stats()
+        result = list(_scan_source_files(str(tmp_path), recursive=False, stats=stats,
+                                         extensions=['jpg', '.MOV', 'thm'], exclude_extensions=['THM']))
+        assert result == [str(tmp_path / 'a.JPG'), str(tmp_path / 'c.mov')]
+        assert stats['skipped_excluded'] == 2
+
+    def test_only_types_exiftool_reads(self, tmp_path):
+        self._touch(tmp_path, ['a.jpg', 'backup.sh', 'notes', 'b.xmp'])
+        stats = self._stats()
+        file_types = frozenset({'.jpg', '.xmp'})
+        result = list(_scan_source_files(str(tmp_path), recursive=False, stats=stats, file_types=file_types))
+        assert result == [str(tmp_path / 'a.jpg'), str(tmp_path / 'b.xmp')]
+        assert stats == self._stats()
+        # as with exiftool -ext, extensions asked for explicitly are read whatever their type
+        result = list(_scan_source_files(str(tmp_path), recursive=False, extensions=['sh', 'jpg'],
+                                         file_types=file_types))
+        assert result == [str(tmp_path / 'a.jpg'), str(tmp_path / 'backup.sh')]
+
+    def test_exiftool_extensions(self):
+        listing = 'Supported file extensions:\n  3FR JPG\n  TIF XMP\n'
+        with patch('src.sortphotos.subprocess.run') as run:
+            run.return_value.stdout = listing
+            assert _exiftool_extensions.__wrapped__('exiftool') == {'.3fr', '.jpg', '.tif', '.xmp'}
+            assert run.call_args.args[0] == ['perl', 'exiftool', '-listf']
+            run.side_effect = OSError('no perl')
+            assert _exiftool_extensions.__wrapped__('exiftool') is None
+
+
+# ---------------------------------------------------------------------------
+# read_exif_dates
+# ---------------------------------------------------------------------------
+
+def _make_tiff(ifd0: dict[int, str], exif: dict[int, str], byte_order: str = '<') -> bytes:
+    """build a little TIFF block with ASCII tags in IFD0 and the ExifIFD"""
+
+    def ifd(tags: dict[int, str | int], offset: int) -> bytes:
+        entries, extra = b'', b''
+        data_start = offset + 2 + 12 * len(tags) + 4
+        for tag, value in sorted(tags.items()):
+            if isinstance(value, int):
+                entries += struct.pack(byte_order + 'HHII', tag, 4, 1, value)
+                continue
+            raw = value.encode() + b'\0'
+            if len(raw) <= 4:
+                entries += struct.pack(byte_order + 'HHI', tag, 2, len(raw)) + raw.ljust(4, b'\0')
+            else:
+                entries += struct.pack(byte_order + 'HHII', tag, 2, len(raw), data_start + len(extra))
+                extra += raw + b'\0' * (len(raw) % 2)
+        return struct.pack(byte_order + 'H', len(tags)) + entries + struct.pack(byte_order + 'I', 0) + extra
+
+    header = (b'II' if byte_order == '<' else b'MM') + struct.pack(byte_order + 'HI', 42, 8)
+    ifd0 = {**ifd0, 0x8769: 0}
+    exif_offset = 8 + len(ifd(ifd0, 8))
+    ifd0[0x8769] = exif_offset
+    return header + ifd(ifd0, 8) + ifd(exif, exif_offset)
+
+
+def _make_jpeg(path: Path, tiff: bytes | None, extra_segments: list[bytes] = ()) -> Path:
+    """write a JPEG holding only metadata segments"""
+    segments = [b'\xff\xe0' + struct.pack('>H', 16) + b'JFIF\0\x01\x01\0\0\x01\0\x01\0\0']
+    if tiff is not None:
+        app1 = b'Exif\0\0' + tiff
+        segments.append(b'\xff\xe1' + struct.pack('>H', len(app1) + 2) + app1)
+    segments += extra_segments
+    path.write_bytes(b'\xff\xd8' + b''.join(segments) + b'\xff\xda\x00\x08\x01\x01\x00\x00\x3f\x00\xff\xd9')
+    return path
+
+
+def _xmp_segment() -> bytes:
+    xmp = b'http://ns.adobe.com/xap/1.0/\0<x:xmpmeta xmlns:x="adobe:ns:meta/"></x:xmpmeta>'
+    return b'\xff\xe1' + struct.pack('>H', len(xmp) + 2) + xmp
+
+
+# (IFD0 tags, ExifIFD tags) covering the date, sub-second and time zone combinations
+NATIVE_EXIF_CASES = {
+    'all_dates': ({0x0132: '2023:06:16 10:00:00'},
+                  {0x9003: '2023:06:15 14:30:00', 0x9004: '2023:06:15 14:31:00'}),
+    'modify_only': ({0x0132: '2021:01:02 03:04:05'}, {}),
+    'subsec': ({}, {0x9003: '2023:06:15 14:30:00', 0x9291: '123'}),
+    'offset': ({}, {0x9003: '2023:06:15 14:30:00', 0x9011: '+02:00'}),
+    'negative_offset': ({0x0132: '2023:06:15 14:30:00', 0x9010: '-7:00'},
+                        {0x9004: '2023:06:15 14:30:00', 0x9292: '5', 0x9012: '-03:30'}),
+    'zero_date': ({}, {0x9003: '0000:00:00 00:00:00', 0x9004: '2019:12:31 23:59:59'}),
+    'no_dates': ({}, {}),
+}
+
+
+class TestReadExifDates:
+    def test_jpeg_dates(self, tmp_path):
+        ifd0, exif = NATIVE_EXIF_CASES['all_dates']
+        photo = _make_jpeg(tmp_path / 'photo.jpg', _make_tiff(ifd0, exif))
+        data = read_exif_dates(str(photo), file_dates=False)
+        assert data == {
+            'SourceFile': str(photo),
+            'EXIF:ModifyDate': '2023:06:16 10:00:00',
+            'EXIF:DateTimeOriginal': '2023:06:15 14:30:00',
+            'EXIF:CreateDate': '2023:06:15 14:31:00',
+        }
+
+    def test_big_endian_tiff_with_composite(self, tmp_path):
+        photo = tmp_path / 'photo.tif'
+        photo.write_bytes(_make_tiff({}, {0x9003: '2023:06:15 14:30:00', 0x9291: '12', 0x9011: '+02:00'}, '>'))
+        data = read_exif_dates(str(photo), file_dates=False)
+        assert data['EXIF:DateTimeOriginal'] == '2023:06:15 14:30:00'
+        assert data['Composite:SubSecDateTimeOriginal'] == '2023:06:15 14:30:00.12+02:00'
+
+    def test_file_dates(self, tmp_path):
+        photo = _make_jpeg(tmp_path / 'photo.jpg', None)
+        data = read_exif_dates(str(photo))
+        assert {'File:FileModifyDate', 'File:FileAccessDate', 'File:FileInodeChangeDate'} <= data.keys()
+        assert parse_date_exif(data['File:FileModifyDate']) is not None
+
+    def test_defers_to_exiftool(self, tmp_path):
+        tiff = _make_tiff({}, {0x9003: '2023:06:15 14:30:00'})
+        xmp = _make_jpeg(tmp_path / 'xmp.jpg', tiff, [_xmp_segment()])
+        iptc = _make_jpeg(tmp_path / 'iptc.jpg', tiff, [b'\xff\xed\x00\x10Photoshop 3.0\0'])
+        other = tmp_path / 'photo.png'
+        other.write_bytes(b'\x89PNG\r\n\x1a\n')
+        truncated = tmp_path / 'truncated.jpg'
+        truncated.write_bytes(_make_jpeg(tmp_path / 'full.jpg', tiff).read_bytes()[:30])
+        for path in (xmp, iptc, other, truncated, tmp_path / 'missing.jpg'):
+            assert read_exif_dates(str(path)) is None
+
+
+@pytest.fixture(scope='module')
+def exiftool_metadata(tmp_path_factory):
+    """ExifTool output for a JPEG per NATIVE_EXIF_CASES (and a big-endian TIFF copy of each)"""
+    if shutil.which('perl') is None:
+        pytest.skip('perl not available')
+    root = tmp_path_factory.mktemp('native')
+    paths = []
+    for name, (ifd0, exif) in NATIVE_EXIF_CASES.items():
+        paths.append(str(_make_jpeg(root / f'{name}.jpg', _make_tiff(ifd0, exif))))
+        (root / f'{name}.tif').write_bytes(_make_tiff(ifd0, exif, '>'))
+        paths.append(str(root / f'{name}.tif'))
+    native = {path: read_exif_dates(path) for path in paths}
+    try:
+        with ExifTool() as et:
+            metadata = et.get_metadata('-j', '-a', '-G', '-time:all', *paths)
+    except (RuntimeError, OSError) as e:
+        pytest.skip(f'ExifTool not usable: {e}')
+    return [(native[data['SourceFile']], data) for data in metadata]
+
+
+class TestNativeExifParity:
+    @pytest.mark.parametrize('groups_to_ignore', [['File'], []])
+    def test_same_oldest_timestamp_as_exiftool(self, exiftool_metadata, groups_to_ignore):
+        assert len(exiftool_metadata) == 2 * len(NATIVE_EXIF_CASES)
+        for native, data in exiftool_metadata:
+            assert native is not None, data['SourceFile']
+            expected = get_oldest_timestamp(data, groups_to_ignore, [])
+            if not groups_to_ignore and expected[2][0].startswith('File:'):
+                continue  # the access time may change when ExifTool reads the file
+            assert get_oldest_timestamp(native, groups_to_ignore, []) == expected, data['SourceFile']
+
+    def test_same_date_tags_as_exiftool(self, exiftool_metadata):
+        for native, data in exiftool_metadata:
+            dated = {k for k, v in data.items() if not k.startswith('File:') and parse_date_exif(v)}
+            assert dated == {k for k, v in native.items() if not k.startswith('File:') and parse_date_exif(v)}
+
+
 # ---------------------------------------------------------------------------
 # ExifTool
 # ---------------------------------------------------------------------------
@@ -244,6 +533,17 @@ class TestExifTool:
         # after exit, process should have terminated
         assert et.process.poll() is not None
 
+    @pytest.mark.skipif(
+        shutil.which('perl') is None or shutil.which('nice') is None or not hasattr(os, 'getpriority'),
+        reason='perl or nice not available',
+    )
+    def test_nice_runs_at_low_priority(self):
+        with ExifTool(nice=True) as et:
+            deadline = time.monotonic() + 5
+            while os.getpriority(os.PRIO_PROCESS, et.process.pid) != 19 and time.monotonic() < deadline:
+                time.sleep(0.01)
+            assert os.getpriority(os.PRIO_PROCESS, et.process.pid) == 19
+
     def test_get_metadata_raises_on_invalid_json(self):
         et = ExifTool()
         et.execute = MagicMock(return_value='not valid json')
@@ -256,6 +556,303 @@ class TestExifTool:
         result = et.get_metadata()
         assert result == [{"SourceFile": "test.jpg"}]
 
+    def test_iter_metadata_batches_files(self):
+        et = ExifTool()
+        et.iter_json = MagicMock(side_effect=lambda *args: iter(
+            [{'SourceFile': a} for a in args if a.endswith('.jpg')]))
+        files = [f'photo{i}.jpg' for i in range(5)]
+        result = list(et.iter_metadata(files, '-j', batch_size=2))
+        assert [r['SourceFile'] for r in result] == files
+        assert et.iter_json.call_count == 3
+        assert et.iter_json.call_args_list[0].args == ('-j', 'photo0.jpg', 'photo1.jpg')
+
+    def _fake_process(self, et: ExifTool, output: bytes) -> None:
+        """feed output to et through a real pipe, as the perl process would"""
+        read_fd, write_fd = os.pipe()
+        os.write(write_fd, output)
+        os.close(write_fd)
+        et.process = MagicMock()
+        et.process.stdout.fileno.return_value = read_fd
+
+    def test_execute_handles_split_multibyte(self):
+        et = ExifTool()
+        et.read_size = 3
+        self._fake_process(et, '[{"SourceFile": "caf\u00e9.jpg"}]\n{ready}\n'.encode('utf-8'))
+        assert json.loads(et.execute('-j')) == [{'SourceFile': 'caf\u00e9.jpg'}]
+
+    def test_execute_raises_when_process_exits(self):
+        et = ExifTool()
+        self._fake_process(et, b'[{"SourceFile": "a.jpg"')
+        with pytest.raises(RuntimeError, match='exited unexpectedly'):
+            et.execute('-j')
+
+    def test_iter_json_yields_objects(self):
+        records = [{'SourceFile': f'caf\u00e9{i}.jpg', 'EXIF:CreateDate': '2023:06:15 14:30:00'}
+                   for i in range(20)]
+        et = ExifTool()
+        et.read_size = 5
+        # same layout as ExifTool -j: top-level objects close with "}" at the start of a line
+        output = '[' + ',\n'.join(json.dumps(r, indent=2) for r in records) + ']\n{ready}\n'
+        self._fake_process(et, output.encode('utf-8'))
+        assert list(et.iter_json('-j')) == records
+
+    def test_iter_json_empty_output(self):
+        et = ExifTool()
+        self._fake_process(et, b'{ready}\n')
+        assert list(et.iter_json('-j')) == []
+
+class TestExifToolPool:
+    def _fake_exiftool(self, instances: list, fail_on: str | None = None):
+        """ExifTool stand-in whose workers answer batches with a random delay"""
+
+        def make(executable, profiler=None, nice=False):
+            et = MagicMock()
+            et.__enter__ = MagicMock(return_value=et)
+            et.__exit__ = MagicMock(return_value=False)
+
+            def iter_metadata(batch, *args, batch_size):
+                time.sleep(random.random() / 100)
+                if fail_on in batch:
+                    raise RuntimeError('boom')
+                return iter([{'SourceFile': f} for f in batch])
+
+            et.iter_metadata.side_effect = iter_metadata
+            instances.append(et)
+            return et
+
+        return make
+
+    def test_results_in_input_order(self):
+        instances: list = []
+        files = [f'photo{i}.jpg' for i in range(50)]
+        with patch('src.sortphotos.ExifTool', side_effect=self._fake_exiftool(instances)):
+            with ExifToolPool(4) as pool:
+                result = list(pool.iter_metadata(files, '-j', batch_size=3))
+        assert [r['SourceFile'] for r in result] == files
+        assert len(instances) == 4
+        assert all(et.__exit__.called for et in instances)
+
+    def test_workers_stopped_on_error(self):
+        instances: list = []
+        files = [f'photo{i}.jpg' for i in range(20)]
+        with patch('src.sortphotos.ExifTool', side_effect=self._fake_exiftool(instances, 'photo7.jpg')):
+            with pytest.raises(RuntimeError, match='boom'):
+                with ExifToolPool(3) as pool:
+                    list(pool.iter_metadata(files, batch_size=2))
+        assert all(et.__exit__.called for et in instances)
+
+    def test_invalid_size(self):
+        with pytest.raises(ValueError):
+            ExifToolPool(0)
+
+
+# ---------------------------------------------------------------------------
+# MetadataCache
+# ---------------------------------------------------------------------------
+
+class TestMetadataCache:
+    def test_store_and_lookup(self, tmp_path):
+        photo = tmp_path / 'photo.jpg'
+        photo.write_text('content')
+        date = datetime(2023, 6, 15, 14, 30, 0)
+        with MetadataCache(str(tmp_path / 'cache.sqlite'), 'settings') as cache:
+            assert cache.lookup(str(photo), photo.stat()) is None
+            cache.store(str(photo), photo.stat(), date, ['EXIF:CreateDate'])
+        with MetadataCache(str(tmp_path / 'cache.sqlite'), 'settings') as cache:
+            assert cache.lookup(str(photo), photo.stat()) == (str(photo), date, ['EXIF:CreateDate'])
+            assert cache.hits == 1
+
+    def test_no_date_is_cached(self, tmp_path):
+        photo = tmp_path / 'photo.jpg'
+        photo.write_text('content')
+        with MetadataCache(str(tmp_path / 'cache.sqlite'), 'settings') as cache:
+            cache.store(str(photo), photo.stat(), None, [])
+            assert cache.lookup(str(photo), photo.stat()) == (str(photo), None, [])
+
+    def test_changed_file_or_settings_miss(self, tmp_path):
+        photo = tmp_path / 'photo.jpg'
+        photo.write_text('content')
+        with MetadataCache(str(tmp_path / 'cache.sqlite'), 'settings') as cache:
+            cache.store(str(photo), photo.stat(), datetime(2023, 6, 15), [])
+        with MetadataCache(str(tmp_path / 'cache.sqlite'), 'other settings') as cache:
+            assert cache.lookup(str(photo), photo.stat()) is None
+        photo.write_text('changed content')
+        with MetadataCache(str(tmp_path / 'cache.sqlite'), 'settings') as cache:
+            assert cache.lookup(str(photo), photo.stat()) is None
+
+    def test_evicts_least_recently_used(self, tmp_path):
+        photos = []
+        for i in range(3):
+            photos.append(tmp_path / f'photo{i}.jpg')
+            photos[-1].write_text(f'content {i}')
+        with MetadataCache(str(tmp_path / 'cache.sqlite'), 'settings', max_entries=2) as cache:
+            for i, photo in enumerate(photos):
+                cache.now = i
+                cache.store(str(photo), photo.stat(), None, [])
+        with MetadataCache(str(tmp_path / 'cache.sqlite'), 'settings', max_entries=2) as cache:
+            assert cache.lookup(str(photos[0]), photos[0].stat()) is None
+            assert cache.lookup(str(photos[2]), photos[2].stat()) is not None
+
+
+# ---------------------------------------------------------------------------
+# ContentIndex
+# ---------------------------------------------------------------------------
+
+class TestContentIndex:
+    def _library(self, tmp_path: Path) -> tuple[Path, str]:
+        library = tmp_path / 'library'
+        (library / '2020' / '01-Jan').mkdir(parents=True)
+        (library / '2020' / '01-Jan' / 'old_name.jpg').write_text('same content')
+        (library / '2020' / '01-Jan' / 'other.jpg').write_text('other content!')
+        return library, str(tmp_path / 'index.sqlite')
+
+    def test_finds_content_under_other_name(self, tmp_path):
+        library, index_file = self._library(tmp_path)
+        photo = tmp_path / 'new_name.jpg'
+        photo.write_text('same content')
+        with ContentIndex(index_file, str(library)) as index:
+            assert index.find_duplicate(str(photo), photo.stat()) == str(library / '2020' / '01-Jan' / 'old_name.jpg')
+
+    def test_no_hashing_without_size_match(self, tmp_path):
+        library, index_file = self._library(tmp_path)
+        photo = tmp_path / 'photo.jpg'
+        photo.write_text('a different length')
+        with ContentIndex(index_file, str(library)) as index:
+            assert index.find_duplicate(str(photo), photo.stat()) is None
+            assert index.hashes_computed == 0
+
+    def test_incremental_updates(self, tmp_path):
+        library, index_file = self._library(tmp_path)
+        photo = tmp_path / 'photo.jpg'
+        photo.write_text('new content!!!')
+        with ContentIndex(index_file, str(library)) as index:
+            assert index.find_duplicate(str(photo), photo.stat()) is None
+            dest = library / '2020' / '01-Jan' / 'photo.jpg'
+            index.plan(str(dest), str(photo), photo.stat().st_size)
+            shutil.copy2(photo, dest)
+            index.transferred(str(dest))
+        # a later run finds the new file without rescanning, and forgets removed ones
+        (library / '2020' / '01-Jan' / 'old_name.jpg').unlink()
+        with ContentIndex(index_file, str(library)) as index:
+            assert index.find_duplicate(str(photo), photo.stat()) == str(dest)
+            same = tmp_path / 'same.jpg'
+            same.write_text('same content')
+            assert index.find_duplicate(str(same), same.stat()) is None
+
+    def test_planned_files_are_duplicates(self, tmp_path):
+        library, index_file = self._library(tmp_path)
+        first, second = tmp_path / 'first.jpg', tmp_path / 'second.jpg'
+        first.write_text('card content')
+        second.write_text('card content')
+        with ContentIndex(index_file, str(library)) as index:
+            assert index.find_duplicate(str(first), first.stat()) is None
+            index.plan(str(library / 'first.jpg'), str(first), first.stat().st_size)
+            assert index.find_duplicate(str(second), second.stat()) == str(library / 'first.jpg')
+
+    def test_source_inside_library_is_not_its_own_duplicate(self, tmp_path, monkeypatch):
+        library, index_file = self._library(tmp_path)
+        (library / 'incoming').mkdir()
+        (library / 'incoming' / 'photo.jpg').write_text('new photo!')
+        monkeypatch.chdir(tmp_path)
+        photo = os.path.join('library', 'incoming', 'photo.jpg')
+        with ContentIndex(index_file, str(library)) as index:
+            assert index.find_duplicate(photo, os.stat(photo)) is None
+
+    def test_read_only_writes_nothing(self, tmp_path):
+        library, index_file = self._library(tmp_path)
+        photo = tmp_path / 'new_name.jpg'
+        photo.write_text('same content')
+        with ContentIndex(index_file, str(library), read_only=True) as index:
+            assert index.find_duplicate(str(photo), photo.stat()) == str(library / '2020' / '01-Jan' / 'old_name.jpg')
+        assert not os.path.exists(index_file)
+        # an existing index is read, but not changed
+        with ContentIndex(index_file, str(library)) as index:
+            pass
+        saved = Path(index_file).read_bytes()
+        (library / '2020' / '01-Jan' / 'old_name.jpg').unlink()
+        with ContentIndex(index_file, str(library), read_only=True) as index:
+            assert index.connection.execute('SELECT COUNT(*) FROM files').fetchone() == (2,)
+            assert index.find_duplicate(str(photo), photo.stat()) is None
+        assert Path(index_file).read_bytes() == saved
+
+
+
+# ---------------------------------------------------------------------------
+# _DestinationIndex
+# ---------------------------------------------------------------------------
+
+class TestDestinationIndex:
+    def test_one_scandir_per_folder(self, tmp_path):
+        (tmp_path / 'a.jpg').write_text('a')
+        index = _DestinationIndex()
+        with patch('src.sortphotos.os.scandir', side_effect=os.scandir) as scandir, \
+                patch('src.sortphotos._ignores_case', return_value=False):
+            assert index.find(str(tmp_path / 'a.jpg')) == str(tmp_path / 'a.jpg')
+            assert index.find(str(tmp_path / 'b.jpg')) is None
+            assert index.find(str(tmp_path / 'missing' / 'c.jpg')) is None
+            assert index.find(str(tmp_path / 'missing' / 'd.jpg')) is None
+        assert scandir.call_count == 2
+
+    def test_planned_files_compare_against_source(self, tmp_path):
+        src = tmp_path / 'src.jpg'
+        src.write_text('content')
+        index = _DestinationIndex()
+        index.add(str(tmp_path / 'dest' / 'photo.jpg'), _RecordTable().pack(str(src), None, []))
+        assert index.find(str(tmp_path / 'dest' / 'photo.jpg')) == str(src)
+
+    def test_case_folded_only_where_ignored(self, tmp_path):
+        (tmp_path / 'IMG.JPG').write_text('x')
+        with patch('src.sortphotos._ignores_case', return_value=False):
+            assert _DestinationIndex().find(str(tmp_path / 'img.jpg')) is None
+        with patch('src.sortphotos._ignores_case', return_value=True):
+            assert _DestinationIndex().find(str(tmp_path / 'img.jpg')) == str(tmp_path / 'IMG.JPG')
+
+    def test_ignores_case(self, tmp_path):
+        (tmp_path / 'Photo.jpg').write_text('x')
+        assert _ignores_case(str(tmp_path)) == (tmp_path / 'PHOTO.JPG').exists()
+        (tmp_path / 'Photo.jpg').unlink()
+        (tmp_path / '123').write_text('x')
+        assert _ignores_case(str(tmp_path)) == (sys.platform in ('darwin', 'win32'))
+
+    def test_directories_collide_without_compare(self, tmp_path):
+        (tmp_path / 'photo.jpg').mkdir()
+        assert _DestinationIndex().find(str(tmp_path / 'photo.jpg')) == ''
+
+    def test_mkdir_once(self, tmp_path):
+        index = _DestinationIndex()
+        folder = str(tmp_path / '2023' / '06-Jun')
+        with patch('src.sortphotos.os.makedirs', side_effect=os.makedirs) as makedirs:
+            for _ in range(3):
+                index.mkdir(folder)
+        assert [c.args[0] for c in makedirs.call_args_list].count(folder) == 1
+        assert (tmp_path / '2023' / '06-Jun').is_dir()
+
+
+# ---------------------------------------------------------------------------
+# _RecordTable
+# ---------------------------------------------------------------------------
+
+class TestRecordTable:
+    def test_round_trip(self):
+        table = _RecordTable()
+        date = datetime(1965, 3, 4, 5, 6, 7, 890)
+        record = table.pack('/photos/2023/IMG_0001.JPG', date, ['EXIF:DateTimeOriginal'])
+        assert table.unpack(record) == ('/photos/2023/IMG_0001.JPG', date, ('EXIF:DateTimeOriginal',))
+        assert os.fspath(record) == '/photos/2023/IMG_0001.JPG'
+        assert table.unpack(table.pack('photo.jpg', None, [])) == ('photo.jpg', None, ())
+        # a path keeps whatever separators it came with
+        assert table.pack('C:/photos\\a/b.jpg', None, []).path == 'C:/photos\\a/b.jpg'
+
+    def test_folders_and_tags_are_shared(self):
+        table = _RecordTable()
+        keys = ['EXIF:DateTimeOriginal', 'EXIF:CreateDate']
+        a = table.pack(os.path.join('photos', '2023', 'a.jpg'), datetime(2023, 1, 1), keys)
+        b = table.pack(os.path.join('photos', '2023', 'b.jpg'), datetime(2023, 1, 2), list(keys))
+        assert a.folder is b.folder
+        assert a.tags == b.tags
+        assert len(table.tag_sets) == 1
+        assert not hasattr(a, '__dict__')
+
 
 # ---------------------------------------------------------------------------
 # sortPhotos (integration tests with mocked ExifTool)
@@ -353,6 +950,7 @@ class TestSortPhotos:
         dest_files = list(dest_dir.rglob('*.jpg'))
         assert len(dest_files) == 1
         assert stats['processed'] == 1
+        assert stats['transfer_rename'] == 1
 
     def test_duplicate_detection_skips_identical(self, tmp_path):
         src_dir = tmp_path / 'src'
@@ -482,6 +1080,60 @@ class TestSortPhotos:
         with pytest.raises(Exception, match='Source directory does not exist'):
             sortPhotos(str(tmp_path / 'nonexistent'), str(tmp_path), '%Y/%m-%b', None)
 
+    def test_several_source_directories(self, tmp_path):
+        card1 = tmp_path / 'card1'
+        card2 = tmp_path / 'card2'
+        dest_dir = tmp_path / 'dest'
+        for folder in (card1, card2, dest_dir):
+            folder.mkdir()
+        # the same photo on both cards, and a different photo with the same name
+        (card1 / 'IMG_0001.jpg').write_text('same photo')
+        (card2 / 'IMG_0001.jpg').write_text('same photo')
+        (card1 / 'IMG_0002.jpg').write_text('first card')
+        (card2 / 'IMG_0002.jpg').write_text('second card')
+
+        metadata = (self._mock_metadata(card1, {'IMG_0001.jpg': '2023:06:15 14:30:00',
+                                                'IMG_0002.jpg': '2023:06:16 09:00:00'})
+                    + self._mock_metadata(card2, {'IMG_0001.jpg': '2023:06:15 14:30:00',
+                                                  'IMG_0002.jpg': '2023:06:16 09:00:00'}))
+
+        with patch('src.sortphotos.ExifTool') as MockExifTool:
+            mock_et = MagicMock()
+            mock_et.get_metadata.return_value = metadata
+            mock_et.__enter__ = MagicMock(return_value=mock_et)
+            mock_et.__exit__ = MagicMock(return_value=False)
+            MockExifTool.return_value = mock_et
+
+            # card1 given twice is only read once
+            stats = sortPhotos([str(card1), str(card2), str(card1)], str(dest_dir), '%Y/%m-%b', None,
+                               copy_files=True)
+
+        # one ExifTool session is handed both cards
+        assert MockExifTool.call_count == 1
+        assert mock_et.get_metadata.call_count == 1
+        assert mock_et.get_metadata.call_args.args[-2:] == (str(card1), str(card2))
+        assert stats['processed'] == 3
+        assert stats['skipped_duplicate'] == 1
+        assert stats['renamed_collision'] == 1
+        assert sorted(p.read_text() for p in dest_dir.rglob('*.jpg')) == ['first card', 'same photo', 'second card']
+
+    def test_nested_source_directories_read_once(self, tmp_path):
+        src_dir = tmp_path / 'src'
+        self._create_source_files(src_dir, ['a.jpg', 'sub/b.jpg'])
+
+        with patch('src.sortphotos.ExifTool') as MockExifTool:
+            mock_et = MagicMock()
+            mock_et.get_metadata.return_value = []
+            mock_et.__enter__ = MagicMock(return_value=mock_et)
+            mock_et.__exit__ = MagicMock(return_value=False)
+            MockExifTool.return_value = mock_et
+
+            sortPhotos([str(src_dir / 'sub'), str(src_dir)], str(tmp_path / 'dest'), '%Y/%m-%b', None,
+                       recursive=True, test=True)
+
+        assert mock_et.get_metadata.call_args.args[-1] == str(src_dir)
+        assert str(src_dir / 'sub') not in mock_et.get_metadata.call_args.args
+
     def test_rename_format(self, tmp_path):
         src_dir = tmp_path / 'src'
         dest_dir = tmp_path / 'dest'
@@ -554,3 +1206,1195 @@ class TestSortPhotos:
         assert stats['processed'] == 5
         dest_files = list(dest_dir.rglob('*.jpg'))
         assert len(dest_files) == 5
+
+    def test_streaming_batches(self, tmp_path):
+        src_dir = tmp_path / 'src'
+        dest_dir = tmp_path / 'dest'
+        src_dir.mkdir()
+        dest_dir.mkdir()
+
+        files = {f'photo{i}.jpg': f'2023:06:{15+i:02d} 14:30:00' for i in range(3)}
+        self._create_source_files(src_dir, list(files.keys()) + ['.hidden/skip.jpg'])
+        metadata = self._mock_metadata(src_dir, files)
+
+        with patch('src.sortphotos.ExifTool') as MockExifTool:
+            mock_et = MagicMock()
+            mock_et.iter_metadata.side_effect = lambda files, *args, batch_size: iter(metadata)
+            mock_et.__enter__ = MagicMock(return_value=mock_et)
+            mock_et.__exit__ = MagicMock(return_value=False)
+            MockExifTool.return_value = mock_et
+
+            stats = sortPhotos(str(src_dir), str(dest_dir), '%Y/%m-%b', None,
+                             copy_files=True, recursive=True, batch_size=2)
+
+        assert stats['processed'] == 3
+        assert len(list(dest_dir.rglob('*.jpg'))) == 3
+        mock_et.get_metadata.assert_not_called()
+        assert mock_et.iter_metadata.call_args.kwargs['batch_size'] == 2
+
+    def test_exif_jobs_uses_pool(self, tmp_path):
+        src_dir = tmp_path / 'src'
+        dest_dir = tmp_path / 'dest'
+        src_dir.mkdir()
+        dest_dir.mkdir()
+
+        files = {f'photo{i}.jpg': f'2023:06:{15+i:02d} 14:30:00' for i in range(4)}
+        self._create_source_files(src_dir, list(files.keys()))
+        metadata = {str(src_dir / name): entry
+                    for name, entry in zip(files, self._mock_metadata(src_dir, files))}
+
+        with patch('src.sortphotos.ExifTool') as MockExifTool:
+            mock_et = MagicMock()
+            mock_et.iter_metadata.side_effect = lambda batch, *args, batch_size: iter(
+                [metadata[f] for f in batch])
+            mock_et.__enter__ = MagicMock(return_value=mock_et)
+            mock_et.__exit__ = MagicMock(return_value=False)
+            MockExifTool.return_value = mock_et
+
+            stats = sortPhotos(str(src_dir), str(dest_dir), '%Y/%m-%b', None,
+                             test=True, batch_size=1, exif_jobs=2)
+
+        assert stats['processed'] == 4
+        assert MockExifTool.call_count == 2
+        # the pool was handed the files found by the scan
+        handed = [f for call in mock_et.iter_metadata.call_args_list for f in call.args[0]]
+        assert sorted(handed) == sorted(metadata)
+
+    def test_cache_skips_exiftool_on_rerun(self, tmp_path):
+        src_dir = tmp_path / 'src'
+        dest_dir = tmp_path / 'dest'
+        src_dir.mkdir()
+        dest_dir.mkdir()
+        cache_file = str(tmp_path / 'cache.sqlite')
+
+        self._create_source_files(src_dir, ['photo1.jpg', 'nodate.jpg', '.hidden.jpg'])
+        metadata = self._mock_metadata(src_dir, {'photo1.jpg': '2023:06:15 14:30:00',
+                                                 'nodate.jpg': 'not a date'})
+
+        def iter_metadata(files, *args, batch_size):
+            files = set(files)
+            return iter([entry for entry in metadata if entry['SourceFile'] in files])
+
+        with patch('src.sortphotos.ExifTool') as MockExifTool:
+            mock_et = MagicMock()
+            mock_et.iter_metadata.side_effect = iter_metadata
+            mock_et.__enter__ = MagicMock(return_value=mock_et)
+            mock_et.__exit__ = MagicMock(return_value=False)
+            MockExifTool.return_value = mock_et
+
+            first = sortPhotos(str(src_dir), str(dest_dir), '%Y/%m-%b', None,
+                             test=True, cache_file=cache_file)
+            second = sortPhotos(str(src_dir), str(dest_dir), '%Y/%m-%b', None,
+                              test=True, cache_file=cache_file)
+
+        assert first == second
+        assert second['processed'] == 1
+        assert second['skipped_no_date'] == 1
+        assert second['skipped_hidden'] == 1
+        assert mock_et.iter_metadata.call_count == 1
+        assert MockExifTool.call_count == 1
+
+
+    @pytest.mark.parametrize('mode', [{'batch_size': 100}, {'prefilter': True}])
+    def test_python_scan_reads_only_types_exiftool_scans(self, tmp_path, mode):
+        src_dir = tmp_path / 'src'
+        dest_dir = tmp_path / 'dest'
+        self._create_source_files(src_dir, ['photo.jpg', 'backup.sh'])
+
+        def dates(files):
+            # ExifTool gives every file it is handed by name at least its File dates
+            return [{'SourceFile': f, 'File:FileModifyDate': '2023:06:15 14:30:00'} for f in files]
+
+        with patch('src.sortphotos.ExifTool') as MockExifTool, \
+                patch('src.sortphotos._exiftool_extensions', return_value=frozenset({'.jpg'})):
+            mock_et = MagicMock()
+            mock_et.iter_metadata.side_effect = lambda files, *args, batch_size: iter(dates(files))
+            mock_et.get_metadata.side_effect = \
+                lambda *args: dates(Path(args[args.index('-@') + 1]).read_text().splitlines())
+            mock_et.__enter__ = MagicMock(return_value=mock_et)
+            mock_et.__exit__ = MagicMock(return_value=False)
+            MockExifTool.return_value = mock_et
+
+            # File dates count, as they do from the command line
+            stats = sortPhotos(str(src_dir), str(dest_dir), '%Y', None, additional_groups_to_ignore=[], **mode)
+
+        assert stats['processed'] == 1
+        assert (dest_dir / '2023' / 'photo.jpg').exists()
+        assert (src_dir / 'backup.sh').exists()
+
+    def test_prefilter_passes_argument_file(self, tmp_path):
+        src_dir = tmp_path / 'src'
+        dest_dir = tmp_path / 'dest'
+        src_dir.mkdir()
+        dest_dir.mkdir()
+
+        self._create_source_files(src_dir, ['photo.jpg', 'photo.raw', '.hidden.jpg'])
+        metadata = self._mock_metadata(src_dir, {'photo.jpg': '2023:06:15 14:30:00'})
+        argfile_contents = []
+
+        def get_metadata(*args):
+            argfile_contents.append(Path(args[args.index('-@') + 1]).read_text())
+            return metadata
+
+        with patch('src.sortphotos.ExifTool') as MockExifTool:
+            mock_et = MagicMock()
+            mock_et.get_metadata.side_effect = get_metadata
+            mock_et.__enter__ = MagicMock(return_value=mock_et)
+            mock_et.__exit__ = MagicMock(return_value=False)
+            MockExifTool.return_value = mock_et
+
+            stats = sortPhotos(str(src_dir), str(dest_dir), '%Y/%m-%b', None,
+                             test=True, exclude_patterns=['*.raw'], prefilter=True)
+
+        assert argfile_contents == [f'{src_dir / "photo.jpg"}\n']
+        assert stats['processed'] == 1
+        assert stats['skipped_excluded'] == 1
+        assert stats['skipped_hidden'] == 1
+
+    def test_native_exif_skips_exiftool(self, tmp_path):
+        src_dir = tmp_path / 'src'
+        dest_dir = tmp_path / 'dest'
+        src_dir.mkdir()
+        dest_dir.mkdir()
+
+        _make_jpeg(src_dir / 'native.jpg', _make_tiff({}, {0x9003: '2023:06:15 14:30:00'}))
+        _make_jpeg(src_dir / 'xmp.jpg', _make_tiff({}, {0x9003: '2023:06:15 14:30:00'}), [_xmp_segment()])
+        metadata = self._mock_metadata(src_dir, {'xmp.jpg': '2022:01:01 00:00:00'})
+
+        with patch('src.sortphotos.ExifTool') as MockExifTool:
+            mock_et = MagicMock()
+            mock_et.iter_metadata.side_effect = lambda files, *args, batch_size: iter(metadata)
+            mock_et.__enter__ = MagicMock(return_value=mock_et)
+            mock_et.__exit__ = MagicMock(return_value=False)
+            MockExifTool.return_value = mock_et
+
+            stats = sortPhotos(str(src_dir), str(dest_dir), '%Y/%m-%b', None,
+                             copy_files=True, native_exif=True)
+
+        assert mock_et.iter_metadata.call_args.args[0] == [str(src_dir / 'xmp.jpg')]
+        assert stats['processed'] == 2
+        assert (dest_dir / '2023' / '06-Jun' / 'native.jpg').exists()
+        assert (dest_dir / '2022' / '01-Jan' / 'xmp.jpg').exists()
+
+    def test_tiered_extraction(self, tmp_path):
+        src_dir = tmp_path / 'src'
+        dest_dir = tmp_path / 'dest'
+        src_dir.mkdir()
+        dest_dir.mkdir()
+
+        self._create_source_files(src_dir, ['primary.jpg', 'xmp.jpg'])
+        primary = {'SourceFile': str(src_dir / 'primary.jpg'), 'EXIF:DateTimeOriginal': '2023:06:15 14:30:00'}
+        full = {'SourceFile': str(src_dir / 'xmp.jpg'), 'XMP:DateCreated': '2022:01:01 00:00:00'}
+        calls = []
+
+        def iter_metadata(files, *args, batch_size):
+            calls.append((list(files), args))
+            if '-fast2' not in args:
+                return iter([full])
+            return iter([primary, {'SourceFile': str(src_dir / 'xmp.jpg')}])
+
+        with patch('src.sortphotos.ExifTool') as MockExifTool:
+            mock_et = MagicMock()
+            mock_et.iter_metadata.side_effect = iter_metadata
+            mock_et.__enter__ = MagicMock(return_value=mock_et)
+            mock_et.__exit__ = MagicMock(return_value=False)
+            MockExifTool.return_value = mock_et
+
+            stats = sortPhotos(str(src_dir), str(dest_dir), '%Y/%m-%b', None, test=True,
+                             use_only_tags=['EXIF:DateTimeOriginal', 'XMP:DateCreated'],
+                             primary_tags=['EXIF:DateTimeOriginal', 'XMP:DateCreated'])
+
+        assert stats['processed'] == 2
+        assert len(calls) == 2
+        assert '-fast2' in calls[0][1] and '-EXIF:DateTimeOriginal' in calls[0][1]
+        assert '-fast2' not in calls[1][1] and '-XMP:DateCreated' in calls[1][1]
+        assert calls[1][0] == [str(src_dir / 'xmp.jpg')]
+
+    def test_tiered_extraction_matches_full_read(self, tmp_path):
+        src_dir = tmp_path / 'src'
+        self._create_source_files(src_dir, ['scan.jpg'])
+        # a scanned print: the scan is from 2023, the photo from 2020
+        record = {'SourceFile': str(src_dir / 'scan.jpg'), 'EXIF:DateTimeOriginal': '2023:06:15 14:30:00',
+                  'XMP:DateCreated': '2020:01:01 00:00:00'}
+        calls = []
+
+        def iter_metadata(files, *args, batch_size):
+            calls.append(args)
+            if '-time:all' in args:
+                return iter([record])
+            return iter([{key: value for key, value in record.items() if not key.startswith('XMP')}])
+
+        dates = {}
+        for tiers in ({}, {'primary_tags': ['EXIF:DateTimeOriginal']}):
+            with patch('src.sortphotos.ExifTool') as MockExifTool:
+                mock_et = MagicMock()
+                mock_et.iter_metadata.side_effect = iter_metadata
+                mock_et.__enter__ = MagicMock(return_value=mock_et)
+                mock_et.__exit__ = MagicMock(return_value=False)
+                MockExifTool.return_value = mock_et
+
+                sortPhotos(str(src_dir), str(tmp_path / 'dest'), '%Y', None, test=True, batch_size=10,
+                           plan_out=str(tmp_path / 'plan.jsonl'), **tiers)
+            dates[bool(tiers)] = next(TransferPlan.read(str(tmp_path / 'plan.jsonl'))[1])['dest']
+
+        assert dates[True] == dates[False] == '2020/scan.jpg'
+        # the primary tags could not settle it, so tiers were not used
+        assert all('-time:all' in args for args in calls)
+
+    def test_content_index_skips_library_duplicates(self, tmp_path):
+        src_dir = tmp_path / 'src'
+        dest_dir = tmp_path / 'dest'
+        src_dir.mkdir()
+        (dest_dir / 'elsewhere').mkdir(parents=True)
+        (dest_dir / 'elsewhere' / 'renamed.jpg').write_text('already sorted')
+
+        (src_dir / 'photo1.jpg').write_text('already sorted')
+        (src_dir / 'photo2.jpg').write_text('new photo')
+        (src_dir / 'photo3.jpg').write_text('new photo')
+        metadata = self._mock_metadata(src_dir, {
+            'photo1.jpg': '2023:06:15 14:30:00',
+            'photo2.jpg': '2023:06:15 14:30:00',
+            'photo3.jpg': '2023:07:15 14:30:00',
+        })
+
+        with patch('src.sortphotos.ExifTool') as MockExifTool:
+            mock_et = MagicMock()
+            mock_et.get_metadata.return_value = metadata
+            mock_et.__enter__ = MagicMock(return_value=mock_et)
+            mock_et.__exit__ = MagicMock(return_value=False)
+            MockExifTool.return_value = mock_et
+
+            stats = sortPhotos(str(src_dir), str(dest_dir), '%Y/%m-%b', None,
+                             copy_files=True, content_index='')
+
+        assert stats['processed'] == 1
+        assert stats['skipped_duplicate'] == 2
+        assert (dest_dir / '2023' / '06-Jun' / 'photo2.jpg').exists()
+        assert (dest_dir / '.sortphotos-index.sqlite').exists()
+
+    def test_content_index_not_written_in_test_mode(self, tmp_path):
+        src_dir = tmp_path / 'src'
+        dest_dir = tmp_path / 'dest'
+        self._create_source_files(src_dir, ['photo1.jpg'])
+        metadata = self._mock_metadata(src_dir, {'photo1.jpg': '2023:06:15 14:30:00'})
+
+        with patch('src.sortphotos.ExifTool') as MockExifTool:
+            mock_et = MagicMock()
+            mock_et.get_metadata.return_value = metadata
+            mock_et.__enter__ = MagicMock(return_value=mock_et)
+            mock_et.__exit__ = MagicMock(return_value=False)
+            MockExifTool.return_value = mock_et
+
+            stats = sortPhotos(str(src_dir), str(dest_dir), '%Y', None, test=True, content_index='')
+
+        assert stats['processed'] == 1
+        assert not dest_dir.exists()
+
+    def test_verified_copy_hashes_recorded_in_content_index(self, tmp_path):
+        src_dir = tmp_path / 'src'
+        dest_dir = tmp_path / 'dest'
+        src_dir.mkdir()
+        dest_dir.mkdir()
+        (src_dir / 'photo1.jpg').write_text('new photo')
+        metadata = self._mock_metadata(src_dir, {'photo1.jpg': '2023:06:15 14:30:00'})
+
+        with patch('src.sortphotos.ExifTool') as MockExifTool:
+            mock_et = MagicMock()
+            mock_et.get_metadata.return_value = metadata
+            mock_et.__enter__ = MagicMock(return_value=mock_et)
+            mock_et.__exit__ = MagicMock(return_value=False)
+            MockExifTool.return_value = mock_et
+
+            stats = sortPhotos(str(src_dir), str(dest_dir), '%Y/%m-%b', None,
+                               copy_files=True, content_index='', verify='readback')
+
+        assert stats['transfer_verified'] == 1
+        dest = dest_dir / '2023' / '06-Jun' / 'photo1.jpg'
+        with ContentIndex(str(dest_dir / '.sortphotos-index.sqlite'), str(dest_dir)) as index:
+            recorded = index.connection.execute('SELECT hash FROM files WHERE path = ?', (str(dest),)).fetchone()
+        assert recorded == (hashlib.sha256(b'new photo').hexdigest(),)
+
+    def test_same_name_in_one_run_not_overwritten(self, tmp_path):
+        src_dir = tmp_path / 'src'
+        dest_dir = tmp_path / 'dest'
+        dest_dir.mkdir()
+        self._create_source_files(src_dir, ['a/photo.jpg', 'b/photo.jpg'])
+        metadata = self._mock_metadata(src_dir, {
+            'a/photo.jpg': '2023:06:15 14:30:00',
+            'b/photo.jpg': '2023:06:15 14:30:00',
+        })
+
+        with patch('src.sortphotos.ExifTool') as MockExifTool:
+            mock_et = MagicMock()
+            mock_et.get_metadata.return_value = metadata
+            mock_et.__enter__ = MagicMock(return_value=mock_et)
+            mock_et.__exit__ = MagicMock(return_value=False)
+            MockExifTool.return_value = mock_et
+
+            stats = sortPhotos(str(src_dir), str(dest_dir), '%Y/%m-%b', None, copy_files=True)
+
+        assert stats['processed'] == 2
+        assert stats['renamed_collision'] == 1
+        assert sorted(p.name for p in dest_dir.rglob('*.jpg')) == ['photo.jpg', 'photo_1.jpg']
+
+
+    def test_resume_from_journal(self, tmp_path):
+        src_dir = tmp_path / 'src'
+        dest_dir = tmp_path / 'dest'
+        journal = tmp_path / 'journal.jsonl'
+        self._create_source_files(src_dir, ['done.jpg', 'partial.jpg', 'moved.jpg', 'nodate.jpg', 'new.jpg',
+                                            'foreign.jpg'])
+        (dest_dir / '2023').mkdir(parents=True)
+        shutil.move(src_dir / 'moved.jpg', dest_dir / '2023' / 'moved.jpg')
+        (dest_dir / '2023' / '.partial.jpg.k3j_x9a2.part').write_text('cont')
+        (dest_dir / '2023' / 'foreign.jpg').write_text('put there since')
+
+        # a run killed while transferring partial.jpg, just after moving moved.jpg
+        entries = [
+            {'op': 'plan', 'src': str(src_dir / 'done.jpg'), 'dest': str(dest_dir / '2023' / 'done.jpg'), 'copy': True},
+            {'op': 'done', 'src': str(src_dir / 'done.jpg'), 'dest': str(dest_dir / '2023' / 'done.jpg')},
+            {'op': 'skip', 'src': str(src_dir / 'nodate.jpg')},
+            {'op': 'plan', 'src': str(src_dir / 'partial.jpg'), 'dest': str(dest_dir / '2023' / 'partial.jpg'), 'copy': True},
+            {'op': 'plan', 'src': str(src_dir / 'moved.jpg'), 'dest': str(dest_dir / '2023' / 'moved.jpg'), 'copy': False},
+            {'op': 'plan', 'src': str(src_dir / 'foreign.jpg'), 'dest': str(dest_dir / '2023' / 'foreign.jpg'),
+             'copy': False},
+        ]
+        journal.write_text(''.join(json.dumps(e) + '\n' for e in entries) + '{"op": "do')
+
+        extracted = []
+
+        def iter_metadata(files, *args, batch_size):
+            files = list(files)
+            extracted.extend(files)
+            return iter([{'SourceFile': f, 'EXIF:CreateDate': '2023:06:15 14:30:00'} for f in files])
+
+        with patch('src.sortphotos.ExifTool') as MockExifTool:
+            mock_et = MagicMock()
+            mock_et.iter_metadata.side_effect = iter_metadata
+            mock_et.__enter__ = MagicMock(return_value=mock_et)
+            mock_et.__exit__ = MagicMock(return_value=False)
+            MockExifTool.return_value = mock_et
+
+            stats = sortPhotos(str(src_dir), str(dest_dir), '%Y', None, copy_files=True,
+                               journal=str(journal), resume=True)
+
+        assert stats['resumed'] == 2
+        assert stats['errors'] == 1
+        assert stats['processed'] == 1
+        assert extracted == [str(src_dir / 'new.jpg')]
+        assert (dest_dir / '2023' / 'partial.jpg').read_text() == (src_dir / 'partial.jpg').read_text()
+        # the file that took foreign.jpg's destination is not replaced, and the partial copy is gone
+        assert (dest_dir / '2023' / 'foreign.jpg').read_text() == 'put there since'
+        assert (src_dir / 'foreign.jpg').exists()
+        assert sorted(p.name for p in (dest_dir / '2023').iterdir()) == [
+            'foreign.jpg', 'moved.jpg', 'new.jpg', 'partial.jpg']
+
+        with TransferJournal(str(journal), resume=True) as reloaded:
+            assert list(reloaded.unfinished) == [str(src_dir / 'foreign.jpg')]
+            assert str(src_dir / 'new.jpg') in reloaded
+
+    def test_resumed_copies_are_verified(self, tmp_path):
+        src_dir = tmp_path / 'src'
+        dest_dir = tmp_path / 'dest'
+        journal = tmp_path / 'journal.jsonl'
+        self._create_source_files(src_dir, ['partial.jpg'])
+        (dest_dir / '2023').mkdir(parents=True)
+        journal.write_text(json.dumps({'op': 'plan', 'src': str(src_dir / 'partial.jpg'),
+                                       'dest': str(dest_dir / '2023' / 'partial.jpg'), 'copy': True}) + '\n')
+
+        with patch('src.sortphotos.ExifTool') as MockExifTool, \
+                patch.object(CopyVerifier, 'copy', autospec=True, side_effect=CopyVerifier.copy) as verified_copy:
+            mock_et = MagicMock()
+            mock_et.iter_metadata.return_value = iter([])
+            mock_et.__enter__ = MagicMock(return_value=mock_et)
+            mock_et.__exit__ = MagicMock(return_value=False)
+            MockExifTool.return_value = mock_et
+
+            stats = sortPhotos(str(src_dir), str(dest_dir), '%Y', None, copy_files=True, journal=str(journal),
+                               resume=True, verify='readback', content_index='')
+
+        assert stats['resumed'] == 1
+        assert verified_copy.call_count == 1
+        content = (src_dir / 'partial.jpg').read_bytes()
+        assert (dest_dir / '2023' / 'partial.jpg').read_bytes() == content
+        with ContentIndex(str(dest_dir / '.sortphotos-index.sqlite'), str(dest_dir)) as index:
+            assert index.connection.execute('SELECT hash FROM files WHERE path = ?',
+                                            (str(dest_dir / '2023' / 'partial.jpg'),)).fetchone() == (
+                hashlib.sha256(content).hexdigest(),)
+
+    def test_journal_records_transfers(self, tmp_path):
+        src_dir = tmp_path / 'src'
+        dest_dir = tmp_path / 'dest'
+        journal = tmp_path / 'journal.jsonl'
+        self._create_source_files(src_dir, ['photo.jpg', 'nodate.jpg'])
+        metadata = self._mock_metadata(src_dir, {'photo.jpg': '2023:06:15 14:30:00'})
+        metadata.append({'SourceFile': str(src_dir / 'nodate.jpg')})
+
+        with patch('src.sortphotos.ExifTool') as MockExifTool:
+            mock_et = MagicMock()
+            mock_et.get_metadata.return_value = metadata
+            mock_et.__enter__ = MagicMock(return_value=mock_et)
+            mock_et.__exit__ = MagicMock(return_value=False)
+            MockExifTool.return_value = mock_et
+
+            sortPhotos(str(src_dir), str(dest_dir), '%Y', None, journal=str(journal))
+
+        entries = [json.loads(line) for line in journal.read_text().splitlines()]
+        assert [(e['op'], Path(e['src']).name) for e in entries] == [
+            ('plan', 'photo.jpg'), ('skip', 'nodate.jpg'), ('done', 'photo.jpg')]
+        assert entries[0]['dest'] == str(dest_dir / '2023' / 'photo.jpg')
+
+
+    def test_pipeline_transfers_while_extracting(self, tmp_path):
+        src_dir = tmp_path / 'src'
+        dest_dir = tmp_path / 'dest'
+        names = [f'photo{i:03d}.jpg' for i in range(150)] + ['sub/photo000.jpg']
+        self._create_source_files(src_dir, names)
+        transferred_early = []
+
+        def iter_metadata(files, *args, batch_size):
+            for i, f in enumerate(files):
+                if i == 140:
+                    # the first files must arrive while ExifTool is still reading the rest
+                    deadline = time.monotonic() + 10
+                    while not any(dest_dir.rglob('*.jpg')) and time.monotonic() < deadline:
+                        time.sleep(0.01)
+                    transferred_early.append(any(dest_dir.rglob('*.jpg')))
+                yield {'SourceFile': f, 'EXIF:CreateDate': '2023:06:15 14:30:00'}
+
+        real_transfer = _transfer_file
+
+        def transfer(src, dest, copy, hardlink=False):
+            if src.endswith('photo007.jpg'):
+                return (src, dest, 'disk full', None)
+            return real_transfer(src, dest, copy, hardlink)
+
+        with patch('src.sortphotos.ExifTool') as MockExifTool, \
+                patch('src.sortphotos._transfer_file', side_effect=transfer):
+            mock_et = MagicMock()
+            mock_et.iter_metadata.side_effect = iter_metadata
+            mock_et.__enter__ = MagicMock(return_value=mock_et)
+            mock_et.__exit__ = MagicMock(return_value=False)
+            MockExifTool.return_value = mock_et
+
+            stats = sortPhotos(str(src_dir), str(dest_dir), '%Y', None, recursive=True,
+                               jobs=3, pipeline=True)
+
+        assert transferred_early == [True]
+        assert stats['processed'] == 150
+        assert stats['errors'] == 1
+        assert stats['renamed_collision'] == 1
+        assert stats['transfer_rename'] == 150
+        assert len(list((dest_dir / '2023').iterdir())) == 150
+        assert [p.name for p in src_dir.rglob('*.jpg')] == ['photo007.jpg']
+
+
+    def test_profile_report(self, tmp_path):
+        src_dir = tmp_path / 'src'
+        dest_dir = tmp_path / 'dest'
+        self._create_source_files(src_dir, ['photo1.jpg', 'photo2.jpg'])
+        metadata = self._mock_metadata(src_dir, {'photo1.jpg': '2023:06:15 14:30:00',
+                                                 'photo2.jpg': '2023:06:16 14:30:00'})
+
+        with patch('src.sortphotos.ExifTool') as MockExifTool:
+            mock_et = MagicMock()
+            mock_et.get_metadata.return_value = metadata
+            mock_et.__enter__ = MagicMock(return_value=mock_et)
+            mock_et.__exit__ = MagicMock(return_value=False)
+            MockExifTool.return_value = mock_et
+
+            stats = sortPhotos(str(src_dir), str(dest_dir), '%Y', None, copy_files=True,
+                               profile=str(tmp_path / 'profile.json'))
+
+        report = stats['profile']
+        assert json.loads((tmp_path / 'profile.json').read_text()) == report
+        assert report['files'] == 2
+        assert {'extract', 'timestamps', 'plan', 'transfer'} <= report['phases'].keys()
+        assert report['phases']['plan']['count'] == 2
+        assert report['transfer']['bytes'] == sum(p.stat().st_size for p in dest_dir.rglob('*.jpg'))
+
+    @pytest.mark.parametrize('order', ['inode', 'extent'])
+    def test_transfer_order(self, tmp_path, order):
+        src_dir = tmp_path / 'src'
+        dest_dir = tmp_path / 'dest'
+        names = [f'photo{n}.jpg' for n in range(8)]
+        self._create_source_files(src_dir, names)
+        random.Random(1).shuffle(names)
+        metadata = self._mock_metadata(src_dir, {name: '2023:06:15 14:30:00' for name in names})
+        expected = sorted((str(src_dir / name) for name in names), key=lambda path: _locality_key(path, order))
+        transferred = []
+
+        def transfer_file(src, dest, copy, hardlink=False):
+            transferred.append(src)
+            return _transfer_file(src, dest, copy, hardlink)
+
+        with patch('src.sortphotos.ExifTool') as MockExifTool, \
+                patch('src.sortphotos._transfer_file', transfer_file):
+            mock_et = MagicMock()
+            mock_et.get_metadata.return_value = metadata
+            mock_et.__enter__ = MagicMock(return_value=mock_et)
+            mock_et.__exit__ = MagicMock(return_value=False)
+            MockExifTool.return_value = mock_et
+
+            sortPhotos(str(src_dir), str(dest_dir), '%Y', None, copy_files=True, transfer_order=order)
+
+        assert transferred == expected
+
+    def _plan(self, tmp_path, plan_file, dates):
+        src_dir = tmp_path / 'src'
+        dest_dir = tmp_path / 'dest'
+        self._create_source_files(src_dir, list(dates))
+        metadata = self._mock_metadata(src_dir, dates)
+
+        with patch('src.sortphotos.ExifTool') as MockExifTool:
+            mock_et = MagicMock()
+            mock_et.get_metadata.return_value = metadata
+            mock_et.__enter__ = MagicMock(return_value=mock_et)
+            mock_et.__exit__ = MagicMock(return_value=False)
+            MockExifTool.return_value = mock_et
+
+            sortPhotos(str(src_dir), str(dest_dir), '%Y/%m', None, plan_out=str(plan_file))
+        return src_dir, dest_dir
+
+    def test_plan_out_writes_plan_without_moving(self, tmp_path):
+        plan_file = tmp_path / 'plan.jsonl.gz'
+        src_dir, dest_dir = self._plan(tmp_path, plan_file, {'photo1.jpg': '2023:06:15 14:30:00',
+                                                             'photo2.jpg': '2023:07:01 10:00:00'})
+
+        assert (src_dir / 'photo1.jpg').exists()
+        assert not dest_dir.exists()
+        with gzip.open(plan_file, 'rt') as f:
+            assert json.loads(f.readline())['sortphotos_plan'] == 1
+        header, entries = TransferPlan.read(str(plan_file))
+        assert header['src_dir'] == str(src_dir)
+        entries = sorted(entries, key=lambda entry: entry['src'])
+        assert [(e['src'], e['dest'], e['action']) for e in entries] == [
+            ('photo1.jpg', os.path.join('2023', '06', 'photo1.jpg'), 'move'),
+            ('photo2.jpg', os.path.join('2023', '07', 'photo2.jpg'), 'move'),
+        ]
+        assert entries[0]['date'] == '2023-06-15T14:30:00'
+        assert entries[0]['size'] == (src_dir / 'photo1.jpg').stat().st_size
+
+    def test_apply_plan(self, tmp_path):
+        plan_file = tmp_path / 'plan.jsonl'
+        src_dir, dest_dir = self._plan(tmp_path, plan_file, {'photo1.jpg': '2023:06:15 14:30:00',
+                                                             'photo2.jpg': '2023:07:01 10:00:00'})
+        (src_dir / 'photo2.jpg').write_bytes(b'edited since the plan was made')
+
+        stats = applyPlan(str(plan_file))
+
+        assert stats['processed'] == 1
+        assert stats['skipped_changed'] == 1
+        assert (dest_dir / '2023' / '06' / 'photo1.jpg').exists()
+        assert not (src_dir / 'photo1.jpg').exists()
+        assert (src_dir / 'photo2.jpg').exists()
+
+    def test_apply_plan_relocated_roots(self, tmp_path):
+        plan_file = tmp_path / 'plan.jsonl'
+        src_dir, _ = self._plan(tmp_path, plan_file, {'photo1.jpg': '2023:06:15 14:30:00'})
+        # the tree is mounted somewhere else on the host applying the plan
+        mounted = tmp_path / 'mounted'
+        shutil.move(str(src_dir), str(mounted))
+        other_dest = tmp_path / 'other'
+        (other_dest / '2023' / '06').mkdir(parents=True)
+        (other_dest / '2023' / '06' / 'photo1.jpg').write_bytes(b'not the same photo')
+
+        stats = applyPlan(str(plan_file), str(mounted), str(other_dest), jobs=2)
+
+        assert stats['errors'] == 1
+        assert stats['processed'] == 0
+        assert (mounted / 'photo1.jpg').exists()
+        assert (other_dest / '2023' / '06' / 'photo1.jpg').read_bytes() == b'not the same photo'
+
+    def test_apply_rejects_other_files(self, tmp_path):
+        (tmp_path / 'journal').write_text('{"op": "plan"}\n')
+        with pytest.raises(ValueError):
+            applyPlan(str(tmp_path / 'journal'))
+
+
+# ---------------------------------------------------------------------------
+# Profiler
+# ---------------------------------------------------------------------------
+
+class TestProfiler:
+    def test_nested_phases_not_counted_twice(self):
+        profiler = Profiler()
+        with profiler.phase('outer'):
+            time.sleep(0.01)
+            with profiler.phase('inner'):
+                time.sleep(0.1)
+        assert profiler.wall['inner'] >= 0.1
+        assert 0.01 <= profiler.wall['outer'] < 0.09
+
+    def test_iterate_records_latencies(self):
+        profiler = Profiler()
+        for _ in profiler.iterate('produce', range(10), between='consume'):
+            time.sleep(0.002)
+        report = profiler.report()
+        assert report['files'] == 10
+        latency = report['phases']['consume']['latency_ms']
+        assert report['phases']['consume']['count'] == 10
+        assert 2 <= latency['p50'] <= latency['p90'] <= latency['p99'] <= latency['max'] < 50
+
+    def test_transfer_throughput(self, tmp_path):
+        profiler = Profiler()
+        (tmp_path / 'a.jpg').write_bytes(b'x' * 1000)
+        transfer = profiler.transfer(_transfer_file)
+        assert transfer(str(tmp_path / 'a.jpg'), str(tmp_path / 'b.jpg'), True)[2] is None
+        assert transfer(str(tmp_path / 'missing.jpg'), str(tmp_path / 'c.jpg'), True)[2] is not None
+        report = profiler.report()
+        assert report['transfer']['files'] == 2
+        assert report['transfer']['bytes'] == 1000
+        assert report['phases']['transfer']['count'] == 2
+
+
+# ---------------------------------------------------------------------------
+# _prefetch
+# ---------------------------------------------------------------------------
+
+class TestPrefetch:
+    def test_yields_all_items_in_order(self):
+        assert list(_prefetch(iter(range(1000)), maxsize=3)) == list(range(1000))
+
+    def test_reraises_errors(self):
+        def items():
+            yield 1
+            raise ValueError('bad batch')
+
+        result = _prefetch(items(), maxsize=3)
+        assert next(result) == 1
+        with pytest.raises(ValueError, match='bad batch'):
+            next(result)
+
+    def test_close_stops_producer(self):
+        closed = threading.Event()
+
+        def items():
+            try:
+                yield from range(10**9)
+            finally:
+                closed.set()
+
+        result = _prefetch(items(), maxsize=3)
+        assert next(result) == 0
+        result.close()
+        assert closed.is_set()
+
+
+# ---------------------------------------------------------------------------
+# _transfer_file
+# ---------------------------------------------------------------------------
+
+class TestTransferFile:
+    COPY_METHODS = {'reflink', 'copy_file_range', 'sendfile', 'copy'}
+
+    def _source(self, tmp_path):
+        src = tmp_path / 'src.jpg'
+        src.write_bytes(os.urandom(100_000))
+        os.utime(src, ns=(1_600_000_000_000_000_000, 1_600_000_000_000_000_000))
+        return src, src.read_bytes()
+
+    def test_move_is_rename(self, tmp_path):
+        src, data = self._source(tmp_path)
+        dest = tmp_path / 'dest.jpg'
+        assert _transfer_file(str(src), str(dest), copy=False) == (str(src), str(dest), None, 'rename')
+        assert not src.exists()
+        assert dest.read_bytes() == data
+
+    def test_move_across_file_systems_copies(self, tmp_path):
+        src, data = self._source(tmp_path)
+        dest = tmp_path / 'dest.jpg'
+        with patch('src.sortphotos.os.rename', side_effect=OSError(errno.EXDEV, 'cross-device')):
+            _, _, error, method = _transfer_file(str(src), str(dest), copy=False)
+        assert error is None
+        assert method in self.COPY_METHODS
+        assert not src.exists()
+        assert dest.read_bytes() == data
+        assert dest.stat().st_mtime_ns == 1_600_000_000_000_000_000
+
+    def test_copy_replaces_partial_dest(self, tmp_path):
+        src, data = self._source(tmp_path)
+        dest = tmp_path / 'dest.jpg'
+        dest.write_bytes(data[:10])
+        _, _, error, method = _transfer_file(str(src), str(dest), copy=True)
+        assert error is None
+        assert method in self.COPY_METHODS
+        assert dest.read_bytes() == data
+        assert dest.stat().st_mtime_ns == 1_600_000_000_000_000_000
+        assert sorted(p.name for p in tmp_path.iterdir()) == ['dest.jpg', 'src.jpg']
+
+    @pytest.mark.skipif(not hasattr(os, 'copy_file_range'), reason='no copy_file_range')
+    def test_copy_file_range_returning_nothing_falls_back(self, tmp_path):
+        src, data = self._source(tmp_path)
+        dest = tmp_path / 'dest.jpg'
+        with patch('fcntl.ioctl', side_effect=OSError(errno.EOPNOTSUPP, 'no reflink')), \
+                patch('src.sortphotos.os.copy_file_range', return_value=0), \
+                patch('src.sortphotos.os.rename', side_effect=OSError(errno.EXDEV, 'cross-device')):
+            _, _, error, method = _transfer_file(str(src), str(dest), copy=False)
+        assert error is None
+        assert method in {'sendfile', 'copy'}
+        assert dest.read_bytes() == data
+        assert not src.exists()
+
+    @pytest.mark.skipif(not hasattr(os, 'copy_file_range'), reason='no copy_file_range')
+    def test_short_copy_is_an_error(self, tmp_path):
+        src, data = self._source(tmp_path)
+        dest = tmp_path / 'dest.jpg'
+        sent = iter([4096])
+
+        with patch('fcntl.ioctl', side_effect=OSError(errno.EOPNOTSUPP, 'no reflink')), \
+                patch('src.sortphotos.os.copy_file_range', side_effect=lambda i, o, n: next(sent, 0)), \
+                patch('src.sortphotos.os.rename', side_effect=OSError(errno.EXDEV, 'cross-device')):
+            _, _, error, method = _transfer_file(str(src), str(dest), copy=False)
+        assert 'stopped after 4096 of 100000 bytes' in error and method is None
+        # the source of the move is kept and no partial file is left
+        assert src.read_bytes() == data
+        assert sorted(p.name for p in tmp_path.iterdir()) == ['src.jpg']
+
+    def test_hardlink(self, tmp_path):
+        src, _ = self._source(tmp_path)
+        dest = tmp_path / 'dest.jpg'
+        assert _transfer_file(str(src), str(dest), copy=True, hardlink=True)[3] == 'hardlink'
+        assert os.path.samefile(src, dest)
+
+    def test_error_leaves_no_temporary_file(self, tmp_path):
+        _, _, error, method = _transfer_file(str(tmp_path / 'missing.jpg'), str(tmp_path / 'dest.jpg'), copy=True)
+        assert error is not None and method is None
+        assert list(tmp_path.iterdir()) == []
+
+    @pytest.mark.parametrize('mode', ['readback', 'fsync'])
+    def test_verified_copy(self, tmp_path, mode):
+        src, data = self._source(tmp_path)
+        dest = tmp_path / 'dest.jpg'
+        verifier = CopyVerifier(mode)
+        with patch('src.sortphotos.os.rename', side_effect=OSError(errno.EXDEV, 'cross-device')):
+            assert _transfer_file(str(src), str(dest), copy=False, verifier=verifier)[2:] == (None, 'verified')
+        assert not src.exists()
+        assert dest.read_bytes() == data
+        assert dest.stat().st_mtime_ns == 1_600_000_000_000_000_000
+        assert verifier.digests == {str(dest): hashlib.sha256(data).hexdigest()}
+        assert verifier.retried == 0
+
+    def test_verified_copy_retries_corrupt_copy(self, tmp_path):
+        src, data = self._source(tmp_path)
+        dest = tmp_path / 'dest.jpg'
+        verifier = CopyVerifier('readback')
+        copy = verifier._copy
+        attempts = []
+
+        def flaky_copy(src, dest, throttle):
+            result = copy(src, dest, throttle)
+            attempts.append(dest)
+            if len(attempts) == 1:  # the first copy is damaged on its way to storage
+                with open(dest, 'r+b') as f:
+                    f.write(b'\0')
+            return result
+
+        with patch.object(verifier, '_copy', flaky_copy):
+            _, _, error, method = _transfer_file(str(src), str(dest), copy=True, verifier=verifier)
+        assert (error, method) == (None, 'verified')
+        assert len(attempts) == 2
+        assert verifier.retried == 1
+        assert dest.read_bytes() == data
+
+    def test_verified_copy_gives_up(self, tmp_path):
+        src, data = self._source(tmp_path)
+        dest = tmp_path / 'dest.jpg'
+        verifier = CopyVerifier('fsync', retries=1)
+        with patch('src.sortphotos.os.rename', side_effect=OSError(errno.EXDEV, 'cross-device')), \
+                patch.object(verifier, '_check', return_value='1 bytes written of 100000'):
+            _, _, error, method = _transfer_file(str(src), str(dest), copy=False, verifier=verifier)
+        assert 'verification failed' in error and method is None
+        assert verifier.retried == 1
+        assert verifier.digests == {}
+        # the source of the move is kept and nothing is left at the destination
+        assert src.read_bytes() == data
+        assert sorted(p.name for p in tmp_path.iterdir()) == ['src.jpg']
+
+    def test_unknown_verify_mode(self):
+        with pytest.raises(ValueError, match='readback, fsync'):
+            CopyVerifier('checksum')
+        with pytest.raises(ValueError, match='negative'):
+            CopyVerifier('fsync', -1)
+
+
+# ---------------------------------------------------------------------------
+# Throttle
+# ---------------------------------------------------------------------------
+
+class TestThrottle:
+    def test_parse_size(self):
+        assert _parse_size('20M') == 20 * 2**20
+        assert _parse_size('1.5GB') == 1.5 * 2**30
+        assert _parse_size('500k/s') == 500 * 1024
+        assert _parse_size('100') == 100
+        with pytest.raises(ValueError):
+            _parse_size('fast')
+
+    def test_files_are_paced(self):
+        throttle = Throttle(files_per_sec=100)
+        start = time.monotonic()
+        for _ in range(30):
+            throttle.acquire(files=1)
+        # 10 at once (a tenth of a second's worth), then one every 10 ms
+        assert 0.15 <= time.monotonic() - start < 1.0
+
+    def test_copies_within_bandwidth(self, tmp_path):
+        (tmp_path / 'src.jpg').write_bytes(os.urandom(600 * 1024))
+        throttle = Throttle(bandwidth=2**20)
+        start = time.monotonic()
+        _, _, error, _ = _transfer_file(str(tmp_path / 'src.jpg'), str(tmp_path / 'dest.jpg'), True,
+                                        throttle=throttle)
+        assert error is None
+        assert time.monotonic() - start >= 0.4
+        assert (tmp_path / 'dest.jpg').read_bytes() == (tmp_path / 'src.jpg').read_bytes()
+
+    @pytest.mark.skipif(not hasattr(signal, 'SIGUSR1'), reason='no SIGUSR1')
+    def test_control_file(self, tmp_path):
+        control = tmp_path / 'limits'
+        control.write_text('max-files-per-sec = 5  # business hours\nmax-bandwidth = none\n')
+        throttle = Throttle(bandwidth=10**6, control_file=str(control))
+        assert (throttle.bandwidth, throttle.files_per_sec) == (None, 5)
+
+        with throttle:
+            control.write_text('max-bandwidth = 2M\n')
+            os.kill(os.getpid(), signal.SIGUSR1)
+            throttle.acquire()
+            # settings left out of the file keep the values given when the throttle was made
+            assert (throttle.bandwidth, throttle.files_per_sec) == (2 * 2**20, None)
+
+            control.write_text('speed = ludicrous\n')
+            os.kill(os.getpid(), signal.SIGUSR1)
+            throttle.acquire()
+            assert (throttle.bandwidth, throttle.files_per_sec) == (2 * 2**20, None)
+        assert signal.getsignal(signal.SIGUSR1) != throttle._on_signal
+
+
+# ---------------------------------------------------------------------------
+# transfer scheduling
+# ---------------------------------------------------------------------------
+
+def _device_by_name(folder):
+    # card/ and ssd/ sources, hdd/ and nvme/ destinations
+    return ['card', 'ssd', 'hdd', 'nvme'].index(os.path.basename(folder))
+
+
+class TestTransferAll:
+    def test_slow_device_does_not_hold_up_others(self):
+        card_done = threading.Event()
+        results = []
+
+        def transfer_file(src, dest, copy, hardlink):
+            if src.startswith('card'):
+                card_done.wait(5)
+            return src, dest, None, 'copy'
+
+        def finished(src, dest, error, method):
+            results.append(src)
+            if len(results) == 3:
+                card_done.set()
+
+        transfers = [('card/a.jpg', 'hdd/a.jpg', True)] + [(f'ssd/{n}.jpg', f'nvme/{n}.jpg', True) for n in 'bcd']
+        with patch('src.sortphotos._device_of', _device_by_name):
+            _transfer_all(transfers, finished, jobs=1, transfer_file=transfer_file)
+        assert results == ['ssd/b.jpg', 'ssd/c.jpg', 'ssd/d.jpg', 'card/a.jpg']
+
+    def test_in_flight_is_bounded(self):
+        results = []
+        most = 0
+
+        def transfers():
+            nonlocal most
+            for n in range(40):
+                most = max(most, n - len(results))
+                yield f'ssd/{n}.jpg', f'nvme/{n}.jpg', False
+
+        def transfer_file(src, dest, copy, hardlink):
+            time.sleep(0.002)
+            return src, dest, None, 'rename'
+
+        with patch('src.sortphotos._device_of', _device_by_name):
+            _transfer_all(transfers(), lambda *result: results.append(result), jobs=2, window=4,
+                          transfer_file=transfer_file)
+        assert len(results) == 40
+        assert most <= 5
+
+    def test_queue_keeps_device_limits(self):
+        lock = threading.Lock()
+        active = collections.Counter()
+        most = collections.Counter()
+
+        def transfer_file(src, dest, copy, hardlink):
+            with lock:
+                active[dest[:4]] += 1
+                most[dest[:4]] = max(most[dest[:4]], active[dest[:4]])
+            time.sleep(0.02)
+            with lock:
+                active[dest[:4]] -= 1
+            return src, dest, None, 'copy'
+
+        with patch('src.sortphotos._device_of', _device_by_name), \
+                patch('src.sortphotos._is_rotational', lambda dev: None):
+            transfers = _TransferQueue(4, True, False, 8, transfer_file, rotational=['hdd'])
+            for n in range(6):
+                transfers.put(f'ssd/{n}.jpg', f'hdd/{n}.jpg')
+                transfers.put(f'ssd/{n}.jpg', f'nvme/{n}.jpg')
+            results = list(transfers.finish())
+        assert len(results) == 12
+        assert most['hdd/'] == 1
+        assert most['nvme'] > 1
+
+    def _concurrency(self, transfers, **options):
+        lock = threading.Lock()
+        active = collections.Counter()
+        most = collections.Counter()
+
+        def transfer_file(src, dest, copy, hardlink):
+            source = os.path.dirname(src)
+            with lock:
+                active[source] += 1
+                most[source] = max(most[source], active[source])
+            time.sleep(0.05)
+            with lock:
+                active[source] -= 1
+            return src, dest, None, 'copy'
+
+        with patch('src.sortphotos._device_of', _device_by_name):
+            _transfer_all(transfers, lambda *result: None, jobs=4, transfer_file=transfer_file, **options)
+        return most
+
+    def test_rotational_devices_one_at_a_time(self):
+        transfers = [(f'{src}/{n}.jpg', f'nvme/{src}{n}.jpg', True) for n in range(4) for src in ('card', 'ssd')]
+        with patch('src.sortphotos._is_rotational', lambda dev: None):
+            most = self._concurrency(transfers, rotational=['card'])
+        assert most['card'] == 1
+        assert most['ssd'] > 1
+
+    def test_solid_state_override(self):
+        transfers = [(f'ssd/{n}.jpg', f'nvme/{n}.jpg', True) for n in range(4)]
+        with patch('src.sortphotos._is_rotational', lambda dev: True):
+            assert self._concurrency(transfers)['ssd'] == 1
+            assert self._concurrency(transfers, solid_state=['ssd', 'nvme'])['ssd'] > 1
+
+    def test_is_rotational(self, tmp_path):
+        assert _is_rotational(os.stat(tmp_path).st_dev) in (True, False, None)
+        assert _is_rotational(-1) is None
+
+    def test_locality_key(self, tmp_path):
+        (tmp_path / 'empty.jpg').touch()
+        st = os.stat(tmp_path / 'empty.jpg')
+        # an empty file has no extents, so it falls back to its inode
+        assert _locality_key(str(tmp_path / 'empty.jpg'), 'extent') == (st.st_dev, 1, st.st_ino)
+        assert _locality_key(str(tmp_path / 'missing.jpg'), 'inode')[0] == -1
+
+    def test_cancel_finishes_running_transfers(self):
+        started, completed = [], []
+        first = threading.Event()
+
+        def transfer_file(src, dest, copy, hardlink):
+            started.append(src)
+            first.set()
+            time.sleep(0.1)
+            completed.append(src)
+            return src, dest, None, 'copy'
+
+        async def run():
+            transfers = [(f'ssd/{n}.jpg', f'nvme/{n}.jpg', True) for n in range(20)]
+            task = asyncio.ensure_future(_schedule_transfers(transfers, lambda *result: None, 2, 2, False,
+                                                             transfer_file, 100))
+            await asyncio.get_running_loop().run_in_executor(None, first.wait, 5)
+            task.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await task
+
+        with patch('src.sortphotos._device_of', _device_by_name):
+            asyncio.run(run())
+        assert 0 < len(started) <= 2
+        assert sorted(completed) == sorted(started)
+
+
+# ---------------------------------------------------------------------------
+# watch mode
+# ---------------------------------------------------------------------------
+
+class TestWatchPhotos:
+    def _wait_for(self, condition, timeout=10.0):
+        deadline = time.monotonic() + timeout
+        while not condition():
+            assert time.monotonic() < deadline, 'timed out'
+            time.sleep(0.05)
+
+    @pytest.mark.parametrize('use_inotify', [False, True])
+    def test_sorts_files_as_they_arrive(self, tmp_path, use_inotify):
+        if use_inotify and not sys.platform.startswith('linux'):
+            pytest.skip('inotify is only available on Linux')
+        src_dir = tmp_path / 'src'
+        dest_dir = tmp_path / 'dest'
+        src_dir.mkdir()
+        dest_dir.mkdir()
+        (src_dir / 'before.jpg').write_text('before')
+
+        def iter_metadata(files, *args, batch_size):
+            return iter([{'SourceFile': f, 'EXIF:CreateDate': '2023:06:15 14:30:00'} for f in files])
+
+        stop = threading.Event()
+        result = {}
+        with patch('src.sortphotos.ExifTool') as MockExifTool:
+            mock_et = MagicMock()
+            mock_et.iter_metadata.side_effect = iter_metadata
+            mock_et.__enter__ = MagicMock(return_value=mock_et)
+            mock_et.__exit__ = MagicMock(return_value=False)
+            MockExifTool.return_value = mock_et
+
+            thread = threading.Thread(target=lambda: result.update(watchPhotos(
+                str(src_dir), str(dest_dir), '%Y', None, recursive=True,
+                settle=0.2, poll_interval=0.1, use_inotify=use_inotify, stop=stop)))
+            thread.start()
+            try:
+                self._wait_for(lambda: (dest_dir / '2023' / 'before.jpg').exists())
+                (src_dir / 'sub').mkdir()
+                (src_dir / 'sub' / 'after.jpg').write_text('after')
+                self._wait_for(lambda: (dest_dir / '2023' / 'after.jpg').exists())
+            finally:
+                stop.set()
+                thread.join()
+
+        assert result['processed'] == 2
+        assert not (src_dir / 'sub' / 'after.jpg').exists()
+        MockExifTool.assert_called_once()
+
+    def test_new_files_pass_extension_filters(self, tmp_path):
+        src_dir = tmp_path / 'src'
+        dest_dir = tmp_path / 'dest'
+        src_dir.mkdir()
+        (src_dir / 'old.tif').write_text('old')
+
+        def iter_metadata(files, *args, batch_size):
+            return iter([{'SourceFile': f, 'EXIF:CreateDate': '2023:06:15 14:30:00'} for f in files])
+
+        rounds = []
+
+        def sort_round(*args, **kwargs):
+            stats = sortPhotos(*args, **kwargs)
+            rounds.append(kwargs['files'])
+            return stats
+
+        stop = threading.Event()
+        with patch('src.sortphotos.ExifTool') as MockExifTool, patch('src.sortphotos.sortPhotos', sort_round):
+            mock_et = MagicMock()
+            mock_et.iter_metadata.side_effect = iter_metadata
+            mock_et.__enter__ = MagicMock(return_value=mock_et)
+            mock_et.__exit__ = MagicMock(return_value=False)
+            MockExifTool.return_value = mock_et
+
+            thread = threading.Thread(target=lambda: watchPhotos(
+                str(src_dir), str(dest_dir), '%Y', None, settle=0.2, poll_interval=0.1, use_inotify=False,
+                stop=stop, extensions=['jpg']))
+            thread.start()
+            try:
+                self._wait_for(lambda: rounds)  # the first round has finished
+                (src_dir / 'new.tif').write_text('new')
+                (src_dir / 'new.jpg').write_text('new')
+                self._wait_for(lambda: (dest_dir / '2023' / 'new.jpg').exists())
+            finally:
+                stop.set()
+                thread.join()
+
+        # the new files were sorted as arrivals, not by the first round
+        assert rounds[0] is None and str(src_dir / 'new.tif') in rounds[-1]
+        assert (src_dir / 'old.tif').exists()
+        assert (src_dir / 'new.tif').exists()
+        assert not (dest_dir / '2023' / 'new.tif').exists()
+
+    def test_new_files_pass_directory_exclusions(self, tmp_path):
+        src_dir = tmp_path / 'src'
+        dest_dir = tmp_path / 'dest'
+        (src_dir / 'backup').mkdir(parents=True)
+        (src_dir / 'keep').mkdir()
+
+        def iter_metadata(files, *args, batch_size):
+            return iter([{'SourceFile': f, 'EXIF:CreateDate': '2023:06:15 14:30:00'} for f in files])
+
+        rounds = []
+
+        def sort_round(*args, **kwargs):
+            stats = sortPhotos(*args, **kwargs)
+            rounds.append(kwargs['files'])
+            return stats
+
+        stop = threading.Event()
+        with patch('src.sortphotos.ExifTool') as MockExifTool, patch('src.sortphotos.sortPhotos', sort_round):
+            mock_et = MagicMock()
+            mock_et.iter_metadata.side_effect = iter_metadata
+            mock_et.__enter__ = MagicMock(return_value=mock_et)
+            mock_et.__exit__ = MagicMock(return_value=False)
+            MockExifTool.return_value = mock_et
+
+            thread = threading.Thread(target=lambda: watchPhotos(
+                str(src_dir), str(dest_dir), '%Y', None, recursive=True, settle=0.2, poll_interval=0.1,
+                use_inotify=False, stop=stop, exclude_patterns=['backup']))
+            thread.start()
+            try:
+                self._wait_for(lambda: rounds)  # the first round has finished
+                (src_dir / 'backup' / 'new.jpg').write_text('new')
+                (src_dir / 'keep' / 'other.jpg').write_text('new')
+                self._wait_for(lambda: (dest_dir / '2023' / 'other.jpg').exists())
+            finally:
+                stop.set()
+                thread.join()
+
+        assert str(src_dir / 'backup' / 'new.jpg') in rounds[-1]
+        assert (src_dir / 'backup' / 'new.jpg').exists()
+        assert not (dest_dir / '2023' / 'new.jpg').exists()
+
+    @pytest.mark.skipif(not sys.platform.startswith('linux'), reason='inotify is only available on Linux')
+    def test_inotify_reports_files_in_new_directories(self, tmp_path):
+        watcher = _InotifyWatcher(str(tmp_path), recursive=True)
+        try:
+            (tmp_path / 'new').mkdir()
+            (tmp_path / 'new' / 'photo.jpg').write_text('x')
+            (tmp_path / '.hidden.jpg').write_text('x')
+            changed = set()
+            deadline = time.monotonic() + 5
+            while str(tmp_path / 'new' / 'photo.jpg') not in changed and time.monotonic() < deadline:
+                changed |= watcher.read(0.5)
+            assert changed == {str(tmp_path / 'new' / 'photo.jpg')}
+        finally:
+            watcher.close()
+
+
+# ---------------------------------------------------------------------------
+# command line
+# ---------------------------------------------------------------------------
+
+class TestMain:
+    def _run(self, *argv):
+        calls = []
+        with patch('sys.argv', ['sortphotos', *argv]), \
+                patch('src.sortphotos.sortPhotos', lambda *args, **kwargs: calls.append(('sort', args, kwargs))), \
+                patch('src.sortphotos.applyPlan', lambda *args, **kwargs: calls.append(('apply', args, kwargs))), \
+                patch('logging.basicConfig'):
+            main()
+        return calls
+
+    def test_options_between_directories(self):
+        [(name, args, kwargs)] = self._run('/source', '-r', '/destination', '--extensions', 'jpg', 'heic')
+        assert args[:2] == (['/source'], '/destination')
+        assert args[4] is True  # recursive
+        assert kwargs['extensions'] == ['jpg', 'heic']
+        [(name, args, kwargs)] = self._run('/card1', '/card2', '-c', '/destination')
+        assert args[:2] == (['/card1', '/card2'], '/destination')
+
+    def test_apply_directories_are_optional(self):
+        assert self._run('--apply', 'plan.jsonl')[0][1] == ('plan.jsonl', None, None)
+        assert self._run('--apply', 'plan.jsonl', '/destination')[0][1] == ('plan.jsonl', None, '/destination')
+        assert self._run('/source', '--apply', 'plan.jsonl', '/destination')[0][1] == (
+            'plan.jsonl', '/source', '/destination')
+
+    def test_negative_verify_retries(self):
+        with pytest.raises(SystemExit):
+            self._run('--verify', 'fsync', '--verify-retries', '-1', '/source', '/destination')
+
+    def test_directories_required(self):
+        with pytest.raises(SystemExit):
+            self._run('/destination')